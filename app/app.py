@@ -1,5 +1,75 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from app.routers import websocket
+from fastapi.responses import PlainTextResponse
+from app.core.metrics import metrics
+from app.database import pool_status
+from app.routers import conversations, history, websocket
+from app.utils.redis import close_redis
 
-app = FastAPI()
-app.include_router(websocket.router, prefix="/ws", tags=["messenger"])
\ No newline at end of file
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Stop the fanout listener before releasing the shared Redis client
+    await websocket.manager.shutdown()
+    await close_redis()
+
+
+app = FastAPI(lifespan=lifespan)
+app.include_router(websocket.router, prefix="/ws", tags=["messenger"])
+app.include_router(history.router, prefix="/conversations", tags=["history"])
+app.include_router(conversations.router, prefix="/conversations", tags=["conversations"])
+
+# Gauges are read at scrape time, so nothing on the hot path updates them
+metrics.add_gauge(
+    "rumr_active_connections", "Open websocket connections on this worker",
+    lambda: len(websocket.manager.active_connections),
+)
+metrics.add_gauge(
+    "rumr_connected_users", "Users with at least one open websocket on this worker",
+    websocket.manager.active_connections.user_count,
+)
+metrics.add_snapshot("db_pool", pool_status)
+metrics.add_snapshot("membership_cache", websocket.manager.membership.stats)
+metrics.add_snapshot("block_cache", websocket.manager.blocks.stats)
+metrics.add_snapshot("profile_cache", websocket.manager.profiles.stats)
+metrics.add_snapshot("recent_messages", websocket.manager.recent.stats)
+metrics.add_snapshot("outbound", websocket.manager.outbound_snapshot)
+metrics.add_snapshot("writer", websocket.manager.writer.stats.snapshot)
+metrics.add_snapshot("presence", websocket.manager.presence.snapshot)
+metrics.add_snapshot("receipts", websocket.manager.receipts.snapshot)
+metrics.add_snapshot("events", websocket.manager.event_stats.snapshot)
+metrics.add_snapshot("fanout", websocket.manager.scheduler.snapshot)
+metrics.add_snapshot("rate_limit", websocket.manager.flood.stats.snapshot)
+metrics.add_snapshot("heartbeat", websocket.manager.heartbeats.snapshot)
+metrics.add_snapshot("dedup", websocket.manager.dedup.stats)
+
+
+@app.get("/db/pool")
+def db_pool():
+    """Connection pool occupancy and checkout wait times, for sizing DB_POOL_SIZE"""
+    return pool_status()
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Hit/miss counters and sizes of the hot-path caches"""
+    return {
+        "membership": websocket.manager.membership.stats(),
+        "blocks": websocket.manager.blocks.stats(),
+        "profiles": websocket.manager.profiles.stats(),
+        "recent": websocket.manager.recent.stats(),
+    }
+
+
+@app.get("/connections/stats")
+async def connection_stats():
+    """Open connections, outbound queue depth and slow-consumer drops on this worker"""
+    return websocket.manager.outbound_snapshot()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Stage timings, per-frame DB queries, fanout sizes and gauges in Prometheus text format"""
+    # Rendered on the event loop, which is the only thread that adds label series and connections
+    return metrics.render()
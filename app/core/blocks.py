@@ -0,0 +1,79 @@
+from typing import Optional, Tuple
+import os
+import weakref
+
+from sqlalchemy import event
+from sqlmodel import Session
+
+from app.database import run_db, session_scope
+from app.models.blocked_user import BlockedUser, check_block_either_way
+from app.utils.cache import TTLCache
+
+BLOCK_CACHE_SIZE = int(os.getenv("BLOCK_CACHE_SIZE", "100000"))
+BLOCK_CACHE_TTL = float(os.getenv("BLOCK_CACHE_TTL", "300"))
+
+
+def pair_key(user_a: str, user_b: str) -> Tuple[str, str]:
+    """Order-independent key, since the answer is the same in both directions"""
+    return (user_a, user_b) if user_a <= user_b else (user_b, user_a)
+
+
+# Every live service, so ORM writes in this process can invalidate them
+_services: "weakref.WeakSet[BlockService]" = weakref.WeakSet()
+
+
+class BlockService:
+    """Answers "has either user blocked the other" from a bounded cache.
+
+    Both positive and negative answers are cached; creating or removing a
+    block invalidates the pair.
+    """
+
+    def __init__(self, maxsize: int = BLOCK_CACHE_SIZE, ttl: float = BLOCK_CACHE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        _services.add(self)
+
+    async def is_blocked(self, user_a: str, user_b: str, db: Optional[Session] = None) -> bool:
+        key = pair_key(user_a, user_b)
+        blocked = self._cache.get(key)
+        if blocked is not None:
+            return blocked
+        if db is not None:
+            blocked = await run_db(check_block_either_way, db, user_a, user_b)
+        else:
+            blocked = await run_db(self._load_in_scope, user_a, user_b)
+        self._cache.set(key, blocked)
+        return blocked
+
+    def peek(self, user_a: str, user_b: str) -> Optional[bool]:
+        """Cached answer only, never touching the DB; None when the pair is not cached"""
+        return self._cache.get(pair_key(user_a, user_b))
+
+    @staticmethod
+    def _load_in_scope(user_a: str, user_b: str) -> bool:
+        with session_scope() as db:
+            return check_block_either_way(db, user_a, user_b)
+
+    def invalidate(self, user_a: str, user_b: str):
+        self._cache.pop(pair_key(user_a, user_b))
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+def invalidate_everywhere(user_a: str, user_b: str):
+    for service in list(_services):
+        service.invalidate(user_a, user_b)
+
+
+# Blocks created or removed through the ORM in this process drop the cached
+# pair; other workers pick the change up via the bus or TTL
+@event.listens_for(BlockedUser, "after_insert")
+@event.listens_for(BlockedUser, "after_update")
+@event.listens_for(BlockedUser, "after_delete")
+def _block_changed(mapper, connection, target: BlockedUser):
+    if target.blocker_id and target.blocked_id:
+        invalidate_everywhere(target.blocker_id, target.blocked_id)
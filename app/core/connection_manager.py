@@ -1,46 +1,190 @@
-from typing import Dict
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+import asyncio
+import os
 from fastapi import WebSocket
 from sqlalchemy.orm import Session
-from sqlalchemy import select
-from app.models.user import User
-from app.models.conversation import Conversation
-from app.models.conversation_participant import ConversationParticipant
 from app.models.message_response import MessageResponse
+from app.core.blocks import BlockService
+from app.core.dedup import SendDeduplicator
+from app.core.events import EventStats, EventThrottle
+from app.core.fanout import FanoutScheduler
+from app.core.heartbeat import HeartbeatMonitor
+from app.core.membership import MembershipIndex
+from app.core.message_writer import MessageWriter
+from app.core.presence import PresenceChange, PresenceRegistry
+from app.core.profiles import ProfileCache
+from app.core.ratelimit import get_flood_control
+from app.core.receipts import ReceiptBuffer
+from app.core.recent import RecentMessages
+from app.core.registry import TOO_MANY_DEVICES_CLOSE_CODE, ConnectionRegistry
+from app.core.timers import TimerWheel
+from app.database import run_db, session_scope
+from app.models.conversation import Conversation
+from app.models.message import Message, load_messages_after
+from app.core.frames import JSON, Codec, OutboundFrame
+from app.core.message_bus import MessageBus, get_message_bus
+from app.core.metrics import metrics
+from app.core.outbound import OUTBOUND_COALESCE_MS, OUTBOUND_OVERFLOW_POLICY, SPILL, Connection, OutboundStats, RedisSpillStore
 from datetime import datetime
-import json
 import traceback
+
+# Most missed messages replayed per conversation from the DB on resume
+RESUME_MAX_MESSAGES = int(os.getenv("RESUME_MAX_MESSAGES", "500"))
+
+
+def _load_missed(conversation_id: str, seq: int, limit: int) -> List[Message]:
+    with session_scope() as db:
+        return load_messages_after(db, conversation_id, seq, limit)
+
+
+def _load_last_seq(conversation_id: str) -> int:
+    with session_scope() as db:
+        conversation = db.get(Conversation, conversation_id)
+        return (conversation.last_seq or 0) if conversation is not None else 0
+
+
 class ConnectionManager:
-    def __init__(self):
-        # Track connections by user_id
-        self.active_connections: Dict[str, WebSocket] = {}
+    def __init__(self, bus: MessageBus = None):
+        # Every socket on this worker, several per user (one per device)
+        self.active_connections = ConnectionRegistry()
+        # Queue/drop counters shared by every connection's writer
+        self.outbound_stats = OutboundStats()
+        self.spill_store = RedisSpillStore() if OUTBOUND_OVERFLOW_POLICY == SPILL else None
+        # Fanout transport shared with the other workers
+        self.bus = bus or get_message_bus()
+        # Cached conversation membership, with the members online on this worker
+        self.membership = MembershipIndex(is_online=lambda user_id: user_id in self.active_connections)
+        # Cached block relationships between pairs of users
+        self.blocks = BlockService()
+        # Cached sender profiles used to enrich broadcasts
+        self.profiles = ProfileCache()
+        # Group-commit stage for new messages
+        self.writer = MessageWriter()
+        # Latest broadcasts per conversation, replayed to clients that resume
+        self.recent = RecentMessages()
+        # Online state of the users on this worker, persisted and pushed in batches
+        self.presence = PresenceRegistry()
+        # Delivered/read high-water marks, persisted and pushed to senders in batches
+        self.receipts = ReceiptBuffer()
+        # Typing indicators and other transient events, rate-coalesced per sender and conversation
+        self.event_stats = EventStats()
+        self.event_throttle = EventThrottle(self._release_event)
+        self._background: Set[asyncio.Task] = set()
+        # (sender, conversation) pairs whose caches are being loaded after a dropped event
+        self._warming: Set[Tuple[str, str]] = set()
+        # Token buckets per sender and per conversation, checked before any DB work
+        self.flood = get_flood_control()
+        # Recent sends by client_message_id, so a retried frame is re-acked instead of stored twice
+        self.dedup = SendDeduplicator()
+        # Chunked, size-fair delivery of broadcasts to the local sockets
+        self.scheduler = FanoutScheduler(self.deliver_chunk)
+        # One wheel for every per-connection timer, driving heartbeats and idle reaping
+        self.timers = TimerWheel()
+        self.heartbeats = HeartbeatMonitor(self.timers)
 
-    async def connect(self, websocket: WebSocket, user_id: str):
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
+    async def connect(
+        self, websocket: WebSocket, user_id: str, intern_profiles: bool = False,
+        codec: Codec = JSON, subprotocol: Optional[str] = None, coalesce: bool = False,
+        heartbeat: bool = False,
+    ) -> Connection:
+        if subprotocol is not None:
+            await websocket.accept(subprotocol=subprotocol)
+        else:
+            await websocket.accept()
+        connection = Connection(
+            websocket, user_id, self.outbound_stats,
+            spill_store=self.spill_store, on_evict=self._evicted,
+            intern_profiles=intern_profiles, codec=codec,
+            coalesce_window=OUTBOUND_COALESCE_MS / 1000 if coalesce else 0.0,
+            heartbeat=heartbeat,
+        )
+        first, pushed_out = self.active_connections.add(connection)
+        connection.start()
+        self.heartbeats.watch(connection)
+        self.presence.connected(user_id)
+        if first:
+            self.membership.user_online(user_id)
+        for previous in pushed_out:
+            # Past MAX_CONNECTIONS_PER_USER the user's oldest device makes room
+            self.presence.disconnected(user_id)
+            previous.evict(TOO_MANY_DEVICES_CLOSE_CODE)
+        if not self.bus.started:
+            await self.bus.start(self.deliver_local)
+        if not self.presence.started:
+            self.presence.start(self.publish_presence)
+        if not self.receipts.started:
+            self.receipts.start(self.publish_receipts)
+        if not self.scheduler.started:
+            self.scheduler.start()
+        if not self.timers.started:
+            self.timers.start()
+        return connection
 
-    def disconnect(self, user_id: str):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
+    async def shutdown(self):
+        # Each stage stops even if an earlier one failed, e.g. a final flush with the DB down
+        for stop in (
+            self.writer.stop, self.timers.stop, self.presence.stop,
+            self.receipts.stop, self.scheduler.stop, self.bus.stop,
+        ):
+            try:
+                await stop()
+            except Exception:
+                print(traceback.format_exc())
+
+    def disconnect(self, user_id: str, connection: Optional[Connection] = None):
+        """Forget one socket of a user, or all of them when connection is None"""
+        connections = (connection,) if connection is not None else self.active_connections.get(user_id)
+        for current in connections:
+            last = self.active_connections.remove(current)
+            # Already gone, e.g. pushed out by a newer device
+            if last is None:
+                continue
+            current.close()
+            self.heartbeats.unwatch(current)
+            self.presence.disconnected(user_id)
+            if last:
+                self.membership.user_offline(user_id)
 
-    async def send_message_to_user_using_websocket(self, message: dict, user_id: str):
-        if user_id in self.active_connections:
-            message=json.dumps(message, indent=4, sort_keys=True, default=str)
+    def _evicted(self, connection: Connection):
+        """Writer callback for sockets that failed or fell too far behind"""
+        self.disconnect(connection.user_id, connection)
 
-            await self.active_connections[user_id].send_text(message)
+    def outbound_snapshot(self) -> dict:
+        depths = [connection.depth for connection in self.active_connections.connections()]
+        snapshot = self.outbound_stats.snapshot()
+        snapshot.update({
+            "connections": len(depths),
+            "users": self.active_connections.user_count(),
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+        })
+        return snapshot
+
+    async def send_message_to_user_using_websocket(self, message: Union[dict, str], user_id: str):
+        """Queue a payload, or an already encoded frame, for every device of one connected user"""
+        for connection in self.active_connections.get(user_id):
+            if isinstance(message, dict):
+                connection.send_json(message)
+            else:
+                connection.send(message)
 
 
     async def broadcast_to_conversation(self, message_data: dict, conversation_id: str, sender_id: str, db: Session) -> MessageResponse:
         """Broadcast message to all active participants in the conversation, respecting block status"""
-        # Get the conversation
-        conversation = db.exec(select(Conversation).where(Conversation.id == conversation_id)).scalar()
+        response, participant_ids = await self.prepare_broadcast(message_data, conversation_id, sender_id, db)
+        if participant_ids:
+            await self.fanout(response.model_dump(), participant_ids, conversation_id)
+        return response  # Return the MessageResponse object
 
+    async def prepare_broadcast(self, message_data: dict, conversation_id: str, sender_id: str, db: Optional[Session] = None) -> Tuple[MessageResponse, List[str]]:
+        """Build the enriched response and its recipients; the only step that needs the DB"""
+        # Membership comes from the cache; only a miss touches the DB
+        conversation = await self.membership.get(conversation_id, db)
         if not conversation:
-            return MessageResponse()
-            
-        conversation_creator_id = conversation.user_id
-        
-        # Get sender information
-        sender = db.exec(select(User).where(User.UserID == sender_id)).scalar()
+            return MessageResponse(), []
+
+        # Sender profile comes from the cache; only a miss touches the DB
+        profile = await self.profiles.get(sender_id, db)
         
         # Create MessageResponse object with enhanced data
         response = MessageResponse(
@@ -51,48 +195,278 @@ class ConnectionManager:
             type=message_data.get("type"),
             created_at=datetime.fromisoformat(message_data.get("created_at")) if isinstance(message_data.get("created_at"), str) else message_data.get("created_at"),
             status=1,  # Default to delivered
-            
-            # Add sender profile information
-            PhoneNumber=sender.PhoneNumber if sender else None,
-            FirstName=sender.FirstName if sender else None,
-            LastName=sender.LastName if sender else None,
-            Email=sender.Email if sender else None,
-            Username=sender.Username if sender else None,
-            Bio=sender.Bio if sender else None,
-            ProfilePhoto=sender.ProfilePhoto if sender else None,
-            backgroundImage=sender.backgroundImage if sender else None,
-            PrivacySettingsID=sender.PrivacySettingsID if sender else None,
+            seq=message_data.get("seq"),
             
             # Media reference from message
-            image_key=message_data.get("image_key")
+            image_key=message_data.get("image_key"),
+            
+            # Add sender profile information
+            **profile
         )
         
-        # Get all participants in this conversation
-        participants = db.exec(
-            select(ConversationParticipant).where(
-                ConversationParticipant.conversation_id == conversation_id,
-                ConversationParticipant.deleted == False
-            )
-        ).scalars().all()
-        
-        
-        # Send to each active participant
-        for participant in participants:
-            recipient_id = participant.user_id
-          
-                
-            # Skip if recipient isn't connected
-            if recipient_id not in self.active_connections:
+        return response, list(conversation.members)
+
+    async def fanout(self, payload: dict, recipients: Iterable[str], conversation_id: Optional[str] = None):
+        """Publish a payload for the given recipients to every worker; whichever worker holds each socket delivers it"""
+        await self.bus.publish({"conversation_id": conversation_id, "recipients": list(recipients), "payload": payload})
+
+    async def spilled_positions(self, user_id: str) -> Dict[str, int]:
+        """Resume positions for broadcasts the user's sockets spilled (OUTBOUND_OVERFLOW_POLICY=spill)"""
+        if self.spill_store is None:
+            return {}
+        try:
+            return await self.spill_store.drain(user_id)
+        except Exception:
+            print(traceback.format_exc())
+            return {}
+
+    async def resume(self, connection: Connection, positions: Dict[str, int]):
+        """Send a reconnecting client what it missed after each last-seen sequence.
+
+        The gap is served from the ring buffer when it is fully there, else from
+        the DB (at most RESUME_MAX_MESSAGES; a resume_truncated frame says where
+        the replay stopped). The replay is queued only as fast as the socket
+        drains it, so none of it overflows. Live broadcasts may interleave with
+        the replay, so clients order by seq and drop sequences they already have.
+        """
+        for conversation_id, seq in positions.items():
+            conversation = await self.membership.get(conversation_id)
+            if conversation is None or connection.user_id not in conversation.members:
                 continue
-                
-            
-                
-            # Send the enriched message data to this participant
-            try:
-                # Convert MessageResponse to dict for JSON serialization
-                await self.send_message_to_user_using_websocket(response.model_dump(), recipient_id)
-            except Exception:
-                print(traceback.format_exc())
-                
-                
-        return response  # Return the MessageResponse object
\ No newline at end of file
+            frames = self.recent.since(conversation_id, seq)
+            truncated = False
+            if frames is None:
+                frames, truncated = await self._missed_from_db(conversation_id, seq)
+            for frame in frames:
+                # Paced by the socket: the gap may be longer than the outbound queue
+                if not await connection.send_paced(frame):
+                    return
+            if truncated:
+                connection.send_json({
+                    "status": "resume_truncated",
+                    "conversation_id": conversation_id,
+                    "seq": frames[-1].payload["seq"],
+                })
+
+    async def latest_seq(self, conversation_id: str) -> int:
+        """Highest sequence known for a conversation: the ring buffer's, else Conversation.last_seq"""
+        latest = self.recent.latest(conversation_id)
+        if latest is None:
+            latest = await run_db(_load_last_seq, conversation_id)
+        return latest
+
+    async def _missed_from_db(self, conversation_id: str, seq: int) -> Tuple[List[OutboundFrame], bool]:
+        messages = await run_db(_load_missed, conversation_id, seq, RESUME_MAX_MESSAGES)
+        frames = []
+        for message in messages:
+            profile = await self.profiles.get(message.sender_id)
+            frames.append(OutboundFrame(MessageResponse(
+                id=message.id,
+                sender_id=message.sender_id,
+                conversation_id=conversation_id,
+                content=message.content,
+                type=message.type,
+                created_at=message.created_at,
+                status=1,
+                seq=message.seq,
+                image_key=message.image_key,
+                **profile
+            ).model_dump()))
+        return frames, len(messages) == RESUME_MAX_MESSAGES
+
+    async def membership_changed(self, conversation_id: str):
+        """Invalidation hook for joins, leaves and soft deletes, applied on every worker"""
+        self.membership.invalidate(conversation_id)
+        await self.bus.publish({"control": "membership", "conversation_id": conversation_id})
+
+    async def block_changed(self, blocker_id: str, blocked_id: str):
+        """Invalidation hook for a block being created or removed, applied on every worker"""
+        self.blocks.invalidate(blocker_id, blocked_id)
+        await self.bus.publish({"control": "block", "users": [blocker_id, blocked_id]})
+
+    async def profile_changed(self, user_id: str):
+        """Invalidation hook for a profile update, applied on every worker"""
+        self.profiles.invalidate(user_id)
+        await self.bus.publish({"control": "profile", "user_id": user_id})
+
+    async def publish_presence(self, changes: List[PresenceChange]):
+        """Presence callback: one envelope per debounce window with every net change on this worker"""
+        await self.bus.publish({
+            "control": "presence",
+            "changes": [{"user_id": user_id, "online": online} for user_id, online, _ in changes],
+        })
+
+    def deliver_presence(self, changes: List[dict]):
+        """Tell local users about peers that came online or went offline.
+
+        Interested peers are the online members of the conversations in the
+        membership cache, i.e. recently active ones; presence for the rest is
+        read from the DB (is_user_online/last_seen) when the client asks.
+        """
+        for change in changes:
+            user_id = change["user_id"]
+            peers = set()
+            for conversation_id in self.membership.conversations_of(user_id):
+                conversation = self.membership.peek(conversation_id)
+                if conversation is not None:
+                    peers.update(conversation.online)
+            peers.discard(user_id)
+            if not peers:
+                continue
+            frame = OutboundFrame({"status": "presence", "user_id": user_id, "online": change["online"]})
+            for peer_id in peers:
+                for connection in self.active_connections.get(peer_id):
+                    connection.send_broadcast(frame)
+
+    async def send_event(self, sender_id: str, conversation_id: str, event_type: str) -> bool:
+        """Relay a transient event to the conversation without touching the DB.
+
+        Membership and blocks come from the caches only; when either is not
+        cached the event is dropped, and the missing entries are loaded in the
+        background so the sender's next event goes through. Returns False if
+        it was dropped.
+        """
+        self.event_stats.received += 1
+        conversation = self.membership.peek(conversation_id)
+        if conversation is None:
+            self.event_stats.uncached += 1
+            self._warm_event_caches(sender_id, conversation_id)
+            return False
+        if sender_id not in conversation.members:
+            return False
+        blocked = self.blocks.peek(sender_id, conversation.owner_id)
+        if blocked is None:
+            self.event_stats.uncached += 1
+            self._warm_event_caches(sender_id, conversation_id)
+        if blocked is not False:
+            return False
+        envelope = {
+            "control": "event",
+            "conversation_id": conversation_id,
+            "recipients": list(conversation.members),
+            "payload": {"status": "event", "type": event_type, "conversation_id": conversation_id, "user_id": sender_id},
+        }
+        envelope = self.event_throttle.offer((sender_id, conversation_id), envelope)
+        if envelope is None:
+            self.event_stats.coalesced += 1
+            return True
+        await self._publish_event(envelope)
+        return True
+
+    def _warm_event_caches(self, sender_id: str, conversation_id: str):
+        key = (sender_id, conversation_id)
+        if key in self._warming:
+            return
+        self._warming.add(key)
+        task = asyncio.create_task(self._warm(key))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _warm(self, key: Tuple[str, str]):
+        sender_id, conversation_id = key
+        try:
+            conversation = await self.membership.get(conversation_id)
+            if conversation is not None and sender_id in conversation.members:
+                await self.blocks.is_blocked(sender_id, conversation.owner_id)
+        except Exception:
+            print(traceback.format_exc())
+        finally:
+            self._warming.discard(key)
+
+    def _release_event(self, envelope: dict):
+        """Throttle callback for the latest event held back at the end of a window"""
+        task = asyncio.create_task(self._publish_event(envelope))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _publish_event(self, envelope: dict):
+        self.event_stats.published += 1
+        await self.bus.publish(envelope)
+
+    def deliver_event(self, envelope: dict):
+        """Send a transient event to the recipients here that are keeping up; no queueing behind messages"""
+        conversation = self.membership.peek(envelope["conversation_id"])
+        recipients = conversation.online if conversation is not None else envelope["recipients"]
+        frame = OutboundFrame(envelope["payload"])
+        sender_id = envelope["payload"]["user_id"]
+        for recipient_id in recipients:
+            if recipient_id == sender_id:
+                continue
+            for connection in self.active_connections.get(recipient_id):
+                if connection.send_ephemeral(frame):
+                    self.event_stats.delivered += 1
+
+    async def publish_receipts(self, receipts: Dict[str, List[dict]]):
+        """Receipt callback: one envelope per push window with the new marks of every conversation"""
+        await self.bus.publish({"control": "receipts", "conversations": receipts})
+
+    def deliver_receipts(self, conversations: Dict[str, List[dict]]):
+        """Send each conversation's receipts, as one frame, to the senders connected here.
+
+        Senders are taken from the recent-message buffer; when it does not
+        reach back far enough every online member gets the frame.
+        """
+        for conversation_id, receipts in conversations.items():
+            up_to = max(receipt["delivered"] for receipt in receipts)
+            recipients = self.recent.senders(conversation_id, up_to)
+            if recipients is None:
+                conversation = self.membership.peek(conversation_id)
+                if conversation is None:
+                    continue
+                recipients = conversation.online
+            frame = OutboundFrame({"status": "receipts", "conversation_id": conversation_id, "receipts": receipts})
+            for recipient_id in recipients:
+                for connection in self.active_connections.get(recipient_id):
+                    connection.send_broadcast(frame)
+
+    async def deliver_local(self, envelope: dict):
+        """Bus callback: send an envelope to the recipients connected to this worker"""
+        control = envelope.get("control")
+        if control == "membership":
+            self.membership.invalidate(envelope["conversation_id"])
+            return
+        if control == "block":
+            self.blocks.invalidate(*envelope["users"])
+            return
+        if control == "profile":
+            self.profiles.invalidate(envelope["user_id"])
+            return
+        if control == "presence":
+            self.deliver_presence(envelope["changes"])
+            return
+        if control == "receipts":
+            self.deliver_receipts(envelope["conversations"])
+            return
+        if control == "event":
+            self.deliver_event(envelope)
+            return
+
+        # Prefer the online members index over scanning the full member list
+        conversation = self.membership.peek(envelope.get("conversation_id"))
+        recipients = list(conversation.online) if conversation is not None else envelope["recipients"]
+
+        # Encoded lazily, once per broadcast, and shared by every recipient
+        frame = OutboundFrame(envelope["payload"])
+        seq = envelope["payload"].get("seq")
+        if seq is not None:
+            self.recent.add(envelope["conversation_id"], seq, frame)
+        members = len(conversation.members) if conversation is not None else len(envelope["recipients"])
+        if self.scheduler.started:
+            self.scheduler.submit(frame, recipients, members)
+        else:
+            metrics.fanout_recipients.observe(self.deliver_chunk(frame, recipients))
+
+    def deliver_chunk(self, frame: OutboundFrame, recipients: Iterable[str]) -> int:
+        """Queue a broadcast for the given recipients' sockets on this worker; returns how many"""
+        delivered = 0
+        for recipient_id in recipients:
+            # Every device of the recipient connected to this worker, if any
+            for connection in self.active_connections.get(recipient_id):
+                delivered += 1
+
+                # Send the enriched message data (or its interned form) to this participant
+                try:
+                    connection.send_broadcast(frame)
+                except Exception:
+                    print(traceback.format_exc())
+        return delivered
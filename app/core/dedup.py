@@ -0,0 +1,77 @@
+from typing import Callable, Dict, Optional, Tuple
+import asyncio
+import os
+import time
+
+from app.models.message import Message
+from app.utils.cache import TTLCache
+
+# Sends remembered per worker, and for how long a replay is answered from memory
+DEDUP_CACHE_SIZE = int(os.getenv("DEDUP_CACHE_SIZE", "100000"))
+DEDUP_WINDOW_SECONDS = float(os.getenv("DEDUP_WINDOW_SECONDS", "300"))
+
+# Matches the client_message_id column
+MAX_CLIENT_MESSAGE_ID_LENGTH = 64
+
+
+def valid_client_message_id(value) -> bool:
+    return isinstance(value, str) and 0 < len(value) <= MAX_CLIENT_MESSAGE_ID_LENGTH
+
+
+class SendDeduplicator:
+    """Recent sends by (sender_id, client_message_id), so a replayed frame is re-acked, not stored again.
+
+    The first attempt claims its key with a future that resolves to the stored
+    message; a replay arriving meanwhile waits on that future instead of
+    inserting, and one arriving later finds the message in the cache. Every
+    claim must be settled, with None if saving failed or was abandoned, which
+    releases the key so the client's next retry is a fresh send. Replays
+    outside the window, or on another worker, are caught by the unique index
+    (see MessageWriter) and re-acked all the same.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = DEDUP_CACHE_SIZE,
+        window: float = DEDUP_WINDOW_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._sends = TTLCache(maxsize=maxsize, ttl=window, clock=clock)
+        # Claims not settled yet; kept apart so eviction can never strand a waiting replay
+        self._pending: Dict[Tuple[str, str], "asyncio.Future[Optional[Message]]"] = {}
+
+    def claim(self, sender_id: str, client_message_id: str) -> Optional["asyncio.Future[Optional[Message]]"]:
+        """None if the send is new (and is now claimed), else a future of the earlier attempt's message"""
+        key = (sender_id, client_message_id)
+        pending = self._pending.get(key)
+        if pending is not None:
+            return pending
+        stored = self._sends.get(key)
+        loop = asyncio.get_running_loop()
+        if stored is not None:
+            future = loop.create_future()
+            future.set_result(stored)
+            return future
+        self._pending[key] = loop.create_future()
+        return None
+
+    def settle(self, sender_id: str, client_message_id: str, message: Optional[Message]):
+        """Resolve a claim with the stored message, or release it with None if saving failed"""
+        key = (sender_id, client_message_id)
+        if message is not None:
+            self._sends.set(key, message)
+        future = self._pending.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(message)
+
+    def clear(self):
+        self._sends.clear()
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_result(None)
+
+    def stats(self) -> dict:
+        stats = self._sends.stats()
+        stats["pending"] = len(self._pending)
+        return stats
@@ -0,0 +1,74 @@
+from typing import Callable, Dict, Hashable, Optional
+import asyncio
+import os
+import time
+
+from app.utils.cache import TTLCache
+
+# Transient signals clients may send as {"event": {"conversation_id": ..., "type": ...}}
+EPHEMERAL_EVENT_TYPES = ("typing", "paused", "recording", "uploading")
+# At most one event per sender and conversation in this window; the latest one wins
+EPHEMERAL_MIN_INTERVAL_MS = float(os.getenv("EPHEMERAL_MIN_INTERVAL_MS", "1000"))
+# Recipients with this many frames already queued do not get events
+EPHEMERAL_QUEUE_LIMIT = int(os.getenv("EPHEMERAL_QUEUE_LIMIT", "32"))
+EPHEMERAL_THROTTLE_SIZE = int(os.getenv("EPHEMERAL_THROTTLE_SIZE", "100000"))
+
+
+class EventStats:
+    __slots__ = ("received", "published", "coalesced", "uncached", "delivered")
+
+    def __init__(self):
+        self.received = 0
+        self.published = 0
+        self.coalesced = 0
+        self.uncached = 0
+        self.delivered = 0
+
+    def snapshot(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class EventThrottle:
+    """Rate coalescing per key: the first event in a window goes out at once,
+    later ones replace each other and only the latest goes out when the
+    window ends, so a final "paused" is never lost behind a "typing".
+    """
+
+    def __init__(
+        self,
+        release: Callable[[dict], None],
+        interval: float = EPHEMERAL_MIN_INTERVAL_MS / 1000,
+        maxsize: int = EPHEMERAL_THROTTLE_SIZE,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.release = release
+        self.interval = interval
+        self.clock = clock
+        # key -> when its last event went out; entries expire with the window
+        self._sent = TTLCache(maxsize=maxsize, ttl=interval, clock=clock)
+        # key -> latest event held back until the window ends
+        self._held: Dict[Hashable, dict] = {}
+
+    def offer(self, key: Hashable, event: dict) -> Optional[dict]:
+        """The event to send now, or None if it was held back"""
+        if key in self._held:
+            self._held[key] = event
+            return None
+        sent_at = self._sent.get(key, record=False)
+        if sent_at is None:
+            self._sent.set(key, self.clock())
+            return event
+        self._held[key] = event
+        delay = max(0.0, sent_at + self.interval - self.clock())
+        asyncio.get_running_loop().call_later(delay, self._flush, key)
+        return None
+
+    def _flush(self, key: Hashable):
+        event = self._held.pop(key, None)
+        if event is not None:
+            self._sent.set(key, self.clock())
+            self.release(event)
+
+    def clear(self):
+        self._sent.clear()
+        self._held.clear()
@@ -0,0 +1,156 @@
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Sequence, Tuple
+import asyncio
+import os
+import time
+import traceback
+
+from app.core.frames import OutboundFrame
+from app.core.metrics import metrics
+
+# Recipients handed to the local sockets before yielding to the event loop
+FANOUT_CHUNK_SIZE = int(os.getenv("FANOUT_CHUNK_SIZE", "256"))
+# Upper bound (members) of each size class but the last
+FANOUT_DIRECT_MAX = int(os.getenv("FANOUT_DIRECT_MAX", "2"))
+FANOUT_SMALL_MAX = int(os.getenv("FANOUT_SMALL_MAX", "100"))
+# Chunks served per turn of each class, smallest conversations first
+FANOUT_WEIGHTS = tuple(int(weight) for weight in os.getenv("FANOUT_WEIGHTS", "8,4,1").split(","))
+
+DIRECT = "direct"
+SMALL = "small"
+LARGE = "large"
+SIZE_CLASSES = (DIRECT, SMALL, LARGE)
+
+
+def size_class(members: int) -> str:
+    """Size class of a conversation; it only changes with membership, so one conversation keeps its order"""
+    if members <= FANOUT_DIRECT_MAX:
+        return DIRECT
+    if members <= FANOUT_SMALL_MAX:
+        return SMALL
+    return LARGE
+
+
+class _Job:
+    """One broadcast, possibly split over several chunks"""
+
+    __slots__ = ("frame", "size_class", "submitted", "chunks", "delivered")
+
+    def __init__(self, frame: OutboundFrame, size_class: str, chunks: int):
+        self.frame = frame
+        self.size_class = size_class
+        self.submitted = time.perf_counter()
+        self.chunks = chunks
+        self.delivered = 0
+
+
+class FanoutStats:
+    __slots__ = ("broadcasts", "chunks", "deliveries")
+
+    def __init__(self):
+        self.broadcasts = 0
+        self.chunks = 0
+        self.deliveries = 0
+
+    def snapshot(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class FanoutScheduler:
+    """Hands broadcasts to local sockets in chunks, with weighted fair queuing per size class.
+
+    Recipient lists are split into chunks of FANOUT_CHUNK_SIZE and queued by
+    the conversation's size class. One dispatcher task serves up to
+    FANOUT_WEIGHTS[i] chunks of each class per round, smallest class first,
+    and yields to the event loop between chunks, so a 1:1 message waits for
+    at most one chunk of a 10k-member broadcast instead of all of it, while
+    large groups still progress. Each class is FIFO, so messages of one
+    conversation keep their order.
+
+    Work is spread across processes by the bus already: each worker only
+    delivers to the sockets it holds.
+    """
+
+    def __init__(
+        self,
+        deliver: Callable[[OutboundFrame, Sequence[str]], int],
+        chunk_size: int = FANOUT_CHUNK_SIZE,
+        weights: Sequence[int] = FANOUT_WEIGHTS,
+    ):
+        self.deliver = deliver
+        self.chunk_size = max(1, chunk_size)
+        self.weights = dict(zip(SIZE_CLASSES, weights))
+        self.stats = FanoutStats()
+        self._queues: Dict[str, Deque[Tuple[_Job, Sequence[str]]]] = {name: deque() for name in SIZE_CLASSES}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def started(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop dispatching; chunks still queued are dropped along with their sockets"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for queue in self._queues.values():
+            queue.clear()
+
+    def submit(self, frame: OutboundFrame, recipients: List[str], members: int):
+        """Queue a broadcast; members (not online recipients) picks the size class"""
+        chunks = [recipients[start:start + self.chunk_size] for start in range(0, len(recipients), self.chunk_size)]
+        job = _Job(frame, size_class(members), len(chunks))
+        self.stats.broadcasts += 1
+        if not chunks:
+            self._finish(job)
+            return
+        self._queues[job.size_class].extend((job, chunk) for chunk in chunks)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def pending(self) -> Dict[str, int]:
+        return {name: len(queue) for name, queue in self._queues.items()}
+
+    async def _run(self):
+        while True:
+            if not any(self._queues.values()):
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            for name in SIZE_CLASSES:
+                queue = self._queues[name]
+                for _ in range(self.weights.get(name, 1)):
+                    if not queue:
+                        break
+                    self._run_chunk(*queue.popleft())
+                    # Let sockets, inbound frames and smaller broadcasts in
+                    await asyncio.sleep(0)
+
+    def _run_chunk(self, job: _Job, recipients: Sequence[str]):
+        metrics.fanout_queue_seconds.observe(time.perf_counter() - job.submitted, (job.size_class,))
+        self.stats.chunks += 1
+        try:
+            job.delivered += self.deliver(job.frame, recipients)
+        except Exception:
+            print(traceback.format_exc())
+        job.chunks -= 1
+        if job.chunks == 0:
+            self._finish(job)
+
+    def _finish(self, job: _Job):
+        self.stats.deliveries += job.delivered
+        metrics.fanout_recipients.observe(job.delivered)
+        metrics.fanout_seconds.observe(time.perf_counter() - job.submitted, (job.size_class,))
+
+    def snapshot(self) -> dict:
+        snapshot = self.stats.snapshot()
+        snapshot.update({f"pending_{name}": count for name, count in self.pending().items()})
+        return snapshot
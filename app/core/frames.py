@@ -0,0 +1,243 @@
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+import json
+import os
+import zlib
+
+import msgpack
+
+from app.core.profiles import PROFILE_FIELDS
+
+# Binary frames at least this large are deflated on compressing connections
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "256"))
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+# Upper bound for an inbound frame once decompressed
+MAX_INBOUND_FRAME_BYTES = int(os.getenv("MAX_INBOUND_FRAME_BYTES", "1048576"))
+
+Frame = Union[str, bytes]
+
+# Short keys used by the binary protocol, for inbound and outbound frames alike
+SHORT_KEYS = {
+    "id": "i",
+    "created_at": "at",
+    "sender_id": "s",
+    "conversation_id": "c",
+    "content": "b",
+    "type": "t",
+    "status": "st",
+    "message": "m",
+    "messages": "ms",
+    "index": "x",
+    "seq": "q",
+    "resume": "r",
+    "read": "rd",
+    "online": "on",
+    "receipts": "rc",
+    "delivered": "dv",
+    "event": "e",
+    "retry_after": "ra",
+    "client_message_id": "k",
+    "duplicate": "dp",
+    "user_id": "u",
+    "image_key": "ik",
+    "PhoneNumber": "ph",
+    "FirstName": "fn",
+    "LastName": "ln",
+    "Email": "em",
+    "Username": "un",
+    "Bio": "bi",
+    "ProfilePhoto": "pp",
+    "backgroundImage": "bg",
+    "PrivacySettingsID": "ps",
+}
+LONG_KEYS = {short: key for key, short in SHORT_KEYS.items()}
+
+# Leading byte of every frame on a compressing connection
+RAW = b"\x00"
+DEFLATED = b"\x01"
+
+
+def encode_json(payload: dict) -> str:
+    """Compact JSON text frame; default=str keeps the datetime format clients already parse"""
+    return json.dumps(payload, separators=(",", ":"), default=str)
+
+
+# Maps nested under these fields are renamed too; resume is not, its keys are conversation ids
+NESTED_MAPS = frozenset(("event", "read", "delivered"))
+_NESTED_KEYS = NESTED_MAPS | {SHORT_KEYS[key] for key in NESTED_MAPS}
+
+
+def _rename(payload: dict, keys: Dict[str, str]) -> dict:
+    """Rename keys, including those of maps nested in a list (batches) or under NESTED_MAPS; drops nulls"""
+    renamed = {}
+    for key, value in payload.items():
+        if value is None:
+            continue
+        key = keys.get(key, key)
+        if isinstance(value, list):
+            value = [_rename(item, keys) if isinstance(item, dict) else item for item in value]
+        elif isinstance(value, dict) and key in _NESTED_KEYS:
+            value = _rename(value, keys)
+        renamed[key] = value
+    return renamed
+
+
+class FrameDecodeError(ValueError):
+    """An inbound binary frame that could not be decoded"""
+
+
+class JsonCodec:
+    """The original protocol: JSON text frames with full field names"""
+
+    name = "json"
+
+    @property
+    def raw(self) -> "JsonCodec":
+        return self
+
+    def encode(self, payload: dict) -> Frame:
+        return encode_json(payload)
+
+    def join(self, frames: List[str]) -> str:
+        """Wrap frames encoded by .raw into one {"messages": [...]} frame without re-encoding"""
+        return '{"messages":[' + ",".join(frames) + "]}"
+
+    def decode(self, data: Frame) -> dict:
+        return json.loads(data)
+
+
+class MsgpackCodec:
+    """Binary MessagePack frames with short keys; null fields are omitted.
+
+    With compress=True every frame carries a leading flag byte, and frames of
+    COMPRESS_MIN_BYTES or more are raw-deflated. The decision is made per
+    message, so small acks are not compressed, and a broadcast is compressed
+    once for all of its recipients rather than once per socket.
+    """
+
+    def __init__(self, compress: bool = False):
+        self.compress = compress
+        self.name = "msgpack+deflate" if compress else "msgpack"
+        # Uncompressed items for join(); the batch is compressed as a whole
+        self.raw = MsgpackCodec() if compress else self
+
+    def encode(self, payload: dict) -> Frame:
+        return self._finish(msgpack.packb(_rename(payload, SHORT_KEYS), default=str))
+
+    def join(self, frames: List[bytes]) -> bytes:
+        """Wrap frames encoded by .raw into one {"ms": [...]} map without re-encoding"""
+        header = b"\x81" + msgpack.packb(SHORT_KEYS["messages"]) + msgpack.Packer().pack_array_header(len(frames))
+        return self._finish(header + b"".join(frames))
+
+    def _finish(self, data: bytes) -> bytes:
+        if not self.compress:
+            return data
+        if len(data) < COMPRESS_MIN_BYTES:
+            return RAW + data
+        deflater = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return DEFLATED + deflater.compress(data) + deflater.flush()
+
+    def decode(self, data: Frame) -> dict:
+        if isinstance(data, str):
+            # Text frames are always JSON, whatever was negotiated
+            return json.loads(data)
+        try:
+            if self.compress:
+                data = self._inflate(data)
+            payload = msgpack.unpackb(data, max_bin_len=MAX_INBOUND_FRAME_BYTES, max_str_len=MAX_INBOUND_FRAME_BYTES)
+        except (ValueError, zlib.error) as exc:
+            raise FrameDecodeError(str(exc)) from exc
+        if not isinstance(payload, dict):
+            raise FrameDecodeError("Expected a map")
+        return _rename(payload, LONG_KEYS)
+
+    def _inflate(self, data: bytes) -> bytes:
+        flag, body = data[:1], data[1:]
+        if flag == RAW:
+            return body
+        if flag != DEFLATED:
+            raise FrameDecodeError("Unknown compression flag")
+        inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+        inflated = inflater.decompress(body, MAX_INBOUND_FRAME_BYTES)
+        if inflater.unconsumed_tail:
+            raise FrameDecodeError("Frame too large")
+        return inflated
+
+
+Codec = Union[JsonCodec, MsgpackCodec]
+
+JSON = JsonCodec()
+MSGPACK = MsgpackCodec()
+MSGPACK_DEFLATE = MsgpackCodec(compress=True)
+
+# Sec-WebSocket-Protocol values the endpoint accepts
+SUBPROTOCOLS = {
+    "rumr.json": JSON,
+    "rumr.msgpack": MSGPACK,
+    "rumr.msgpack.deflate": MSGPACK_DEFLATE,
+}
+
+
+def negotiate(offered: Iterable[str]) -> Tuple[Codec, Optional[str]]:
+    """Pick the first subprotocol the client offered that we speak; JSON without one"""
+    for subprotocol in offered:
+        codec = SUBPROTOCOLS.get(subprotocol)
+        if codec is not None:
+            return codec, subprotocol
+    return JSON, None
+
+
+# Parts of a broadcast that can be encoded
+FULL = "full"
+PROFILE = "profile"
+MESSAGE = "message"
+
+
+class OutboundFrame:
+    """A broadcast payload encoded at most once per codec, then shared by every recipient.
+
+    Connections that intern sender profiles get the payload split in two: a
+    profile frame, sent only when the connection has not seen that profile
+    yet, and the message without the profile fields. Each part is also
+    encoded at most once per codec.
+    """
+
+    __slots__ = ("payload", "_encoded")
+
+    def __init__(self, payload: dict):
+        self.payload = payload
+        self._encoded: Dict[Tuple[str, str], Frame] = {}
+
+    def encode(self, codec: Codec, part: str = FULL) -> Frame:
+        key = (codec.name, part)
+        frame = self._encoded.get(key)
+        if frame is None:
+            frame = self._encoded[key] = codec.encode(self._part(part))
+        return frame
+
+    def _part(self, part: str) -> dict:
+        if part == PROFILE:
+            # {"status": "profile", "user_id": ..., <profile fields>}
+            profile = {"status": "profile", "user_id": self.sender_id}
+            profile.update((field, self.payload.get(field)) for field in PROFILE_FIELDS)
+            return profile
+        if part == MESSAGE:
+            # Without sender profile fields; clients resolve sender_id themselves
+            return {key: value for key, value in self.payload.items() if key not in PROFILE_FIELDS}
+        return self.payload
+
+    @property
+    def sender_id(self) -> Optional[str]:
+        return self.payload.get("sender_id")
+
+    @property
+    def text(self) -> str:
+        return self.encode(JSON)
+
+    @property
+    def profile_text(self) -> str:
+        """The JSON profile frame; also the profile's fingerprint"""
+        return self.encode(JSON, PROFILE)
+
+    @property
+    def message_text(self) -> str:
+        return self.encode(JSON, MESSAGE)
@@ -0,0 +1,89 @@
+import os
+import time
+from typing import Callable
+
+from app.core.outbound import Connection
+from app.core.timers import TimerWheel
+
+# Heartbeat clients are pinged after this long without a frame from them
+HEARTBEAT_INTERVAL_SECONDS = float(os.getenv("HEARTBEAT_INTERVAL_SECONDS", "25"))
+# Heartbeat clients silent this long (no frame, no pong) are disconnected
+IDLE_TIMEOUT_SECONDS = float(os.getenv("IDLE_TIMEOUT_SECONDS", "60"))
+# Same for clients without the heartbeat feature; 0 leaves them to the server's protocol pings
+LEGACY_IDLE_TIMEOUT_SECONDS = float(os.getenv("LEGACY_IDLE_TIMEOUT_SECONDS", "0"))
+
+# Close code for reaped connections (Going Away)
+IDLE_CLOSE_CODE = 1001
+
+
+class HeartbeatStats:
+    __slots__ = ("watched", "pings", "reaped")
+
+    def __init__(self):
+        self.watched = 0
+        self.pings = 0
+        self.reaped = 0
+
+    def snapshot(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class HeartbeatMonitor:
+    """Pings quiet heartbeat clients and reaps silent connections.
+
+    Each watched connection holds one timer on the shared wheel, checked every
+    HEARTBEAT_INTERVAL_SECONDS; any inbound frame counts as a sign of life.
+    A reaped connection is evicted like a failed one, which removes it from
+    the registry and from presence.
+    """
+
+    def __init__(
+        self,
+        wheel: TimerWheel,
+        interval: float = HEARTBEAT_INTERVAL_SECONDS,
+        idle_timeout: float = IDLE_TIMEOUT_SECONDS,
+        legacy_idle_timeout: float = LEGACY_IDLE_TIMEOUT_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.wheel = wheel
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.legacy_idle_timeout = legacy_idle_timeout
+        self.clock = clock
+        self.stats = HeartbeatStats()
+
+    def watch(self, connection: Connection):
+        timeout = self.idle_timeout if connection.heartbeat else self.legacy_idle_timeout
+        if timeout <= 0:
+            return
+        self.stats.watched += 1
+        connection.timer = self.wheel.schedule(min(self.interval, timeout), self._check, connection)
+
+    def unwatch(self, connection: Connection):
+        if connection.timer is not None:
+            connection.timer.cancel()
+            connection.timer = None
+            self.stats.watched -= 1
+
+    def _check(self, connection: Connection):
+        connection.timer = None
+        if connection.closed:
+            self.stats.watched -= 1
+            return
+        idle = self.clock() - connection.last_activity
+        timeout = self.idle_timeout if connection.heartbeat else self.legacy_idle_timeout
+        if idle >= timeout:
+            self.stats.watched -= 1
+            self.stats.reaped += 1
+            connection.evict(IDLE_CLOSE_CODE)
+            return
+        # Ping anyone quiet for half an interval, so a live client answers before the next check
+        if connection.heartbeat and idle >= self.interval / 2:
+            self.stats.pings += 1
+            connection.send_json({"status": "ping"})
+        connection.timer = self.wheel.schedule(min(self.interval, timeout - idle), self._check, connection)
+
+    def snapshot(self) -> dict:
+        snapshot = self.stats.snapshot()
+        snapshot["timers"] = len(self.wheel)
+        return snapshot
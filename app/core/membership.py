@@ -0,0 +1,182 @@
+from typing import Callable, Dict, Iterable, Optional, Set
+import os
+import weakref
+
+from sqlalchemy import and_, event
+from sqlmodel import Session, select
+
+from app.database import run_db, session_scope
+from app.models.conversation import Conversation
+from app.models.conversation_participant import ConversationParticipant
+from app.utils.cache import TTLCache
+
+MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", "10000"))
+MEMBERSHIP_CACHE_TTL = float(os.getenv("MEMBERSHIP_CACHE_TTL", "60"))
+
+
+class ConversationMembers:
+    """Cached view of one conversation: its owner, members and who is online here"""
+
+    __slots__ = ("conversation_id", "owner_id", "members", "online")
+
+    def __init__(self, conversation_id: str, owner_id: str, members: Iterable[str]):
+        self.conversation_id = conversation_id
+        self.owner_id = owner_id
+        self.members: Set[str] = set(members)
+        # Members with a socket on this worker; fanout iterates only these
+        self.online: Set[str] = set()
+
+
+def load_conversation_members(db: Session, conversation_id: str) -> Optional[ConversationMembers]:
+    """Fetch owner and active participants of a conversation in a single query"""
+    rows = db.exec(
+        select(Conversation.user_id, ConversationParticipant.user_id)
+        .select_from(Conversation)
+        .outerjoin(
+            ConversationParticipant,
+            and_(
+                ConversationParticipant.conversation_id == Conversation.id,
+                ConversationParticipant.deleted == False
+            )
+        )
+        .where(Conversation.id == conversation_id)
+    ).all()
+    if not rows:
+        return None
+    return ConversationMembers(conversation_id, rows[0][0], [member for _, member in rows if member])
+
+
+# Every live index, so ORM writes in this process can invalidate them
+_indexes: "weakref.WeakSet[MembershipIndex]" = weakref.WeakSet()
+
+
+class MembershipIndex:
+    """conversation_id -> ConversationMembers with LRU/TTL eviction.
+
+    Also keeps a reverse index of cached conversations per user, so that
+    connect/disconnect can update each entry's online set without a scan.
+    """
+
+    def __init__(
+        self,
+        is_online: Callable[[str], bool],
+        maxsize: int = MEMBERSHIP_CACHE_SIZE,
+        ttl: float = MEMBERSHIP_CACHE_TTL,
+    ):
+        self.is_online = is_online
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl, on_evict=self._forget)
+        self._by_user: Dict[str, Set[str]] = {}
+        _indexes.add(self)
+
+    def peek(self, conversation_id: str) -> Optional[ConversationMembers]:
+        """Cached entry, if any, without touching hit/miss statistics"""
+        return self._cache.get(conversation_id, record=False)
+
+    async def get(self, conversation_id: str, db: Optional[Session] = None) -> Optional[ConversationMembers]:
+        """Cached membership, loading it on the DB thread pool on a miss"""
+        entry = self._cache.get(conversation_id)
+        if entry is not None:
+            return entry
+        if db is not None:
+            entry = await run_db(load_conversation_members, db, conversation_id)
+        else:
+            entry = await run_db(self._load_in_scope, conversation_id)
+        if entry is not None:
+            self.add(entry)
+        return entry
+
+    @staticmethod
+    def _load_in_scope(conversation_id: str) -> Optional[ConversationMembers]:
+        with session_scope() as db:
+            return load_conversation_members(db, conversation_id)
+
+    def add(self, entry: ConversationMembers):
+        with self._cache.lock:
+            entry.online = {member for member in entry.members if self.is_online(member)}
+            self._cache.set(entry.conversation_id, entry)
+            for member in entry.members:
+                self._by_user.setdefault(member, set()).add(entry.conversation_id)
+
+    def conversations_of(self, user_id: str) -> Set[str]:
+        """Cached conversations the user belongs to"""
+        return set(self._by_user.get(user_id, ()))
+
+    # Presence hooks, called by the connection manager
+
+    def user_online(self, user_id: str):
+        with self._cache.lock:
+            for conversation_id in list(self._by_user.get(user_id, ())):
+                entry = self._cache.get(conversation_id, record=False)
+                if entry is not None:
+                    entry.online.add(user_id)
+
+    def user_offline(self, user_id: str):
+        with self._cache.lock:
+            for conversation_id in list(self._by_user.get(user_id, ())):
+                entry = self._cache.get(conversation_id, record=False)
+                if entry is not None:
+                    entry.online.discard(user_id)
+
+    # Invalidation hooks
+
+    def join(self, conversation_id: str, user_id: str):
+        with self._cache.lock:
+            entry = self._cache.get(conversation_id, record=False)
+            if entry is None:
+                return
+            entry.members.add(user_id)
+            self._by_user.setdefault(user_id, set()).add(conversation_id)
+            if self.is_online(user_id):
+                entry.online.add(user_id)
+
+    def leave(self, conversation_id: str, user_id: str):
+        """Participant left or was soft deleted (deleted/deleted_at set)"""
+        with self._cache.lock:
+            entry = self._cache.get(conversation_id, record=False)
+            if entry is None:
+                return
+            entry.members.discard(user_id)
+            entry.online.discard(user_id)
+            conversations = self._by_user.get(user_id)
+            if conversations is not None:
+                conversations.discard(conversation_id)
+                if not conversations:
+                    del self._by_user[user_id]
+
+    def invalidate(self, conversation_id: str):
+        self._cache.pop(conversation_id)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+    def _forget(self, conversation_id: str, entry: ConversationMembers):
+        for member in entry.members:
+            conversations = self._by_user.get(member)
+            if conversations is None:
+                continue
+            conversations.discard(conversation_id)
+            if not conversations:
+                del self._by_user[member]
+
+
+def invalidate_everywhere(conversation_id: str):
+    for index in list(_indexes):
+        index.invalidate(conversation_id)
+
+
+# Participant and conversation writes made through the ORM in this process
+# drop the cached entry; other workers pick the change up via the bus or TTL
+@event.listens_for(ConversationParticipant, "after_insert")
+@event.listens_for(ConversationParticipant, "after_update")
+@event.listens_for(ConversationParticipant, "after_delete")
+def _participant_changed(mapper, connection, target: ConversationParticipant):
+    invalidate_everywhere(target.conversation_id)
+
+
+@event.listens_for(Conversation, "after_update")
+@event.listens_for(Conversation, "after_delete")
+def _conversation_changed(mapper, connection, target: Conversation):
+    invalidate_everywhere(target.id)
@@ -0,0 +1,151 @@
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Optional
+import asyncio
+import json
+import os
+import traceback
+
+# Callback each worker registers to deliver an envelope to the sockets it holds
+DeliverCallback = Callable[[dict], Awaitable[None]]
+
+FANOUT_CHANNEL = os.getenv("FANOUT_CHANNEL", "rumr:fanout")
+# Longest wait between attempts to resubscribe after the Redis connection drops
+BUS_RECONNECT_MAX_SECONDS = float(os.getenv("BUS_RECONNECT_MAX_SECONDS", "30"))
+
+
+class MessageBus(ABC):
+    """Transport that carries broadcast envelopes to every worker.
+
+    An envelope is a dict of the form {"recipients": [...], "payload": {...}}.
+    It is published once by the worker that accepted the message, and every
+    subscribed worker delivers it to the recipients connected to that worker.
+    """
+
+    def __init__(self):
+        self._deliver: Optional[DeliverCallback] = None
+
+    @property
+    def started(self) -> bool:
+        return self._deliver is not None
+
+    async def start(self, deliver: DeliverCallback):
+        self._deliver = deliver
+
+    async def stop(self):
+        self._deliver = None
+
+    @abstractmethod
+    async def publish(self, envelope: dict):
+        """Hand an envelope to every worker, this one included"""
+
+
+class InProcessMessageBus(MessageBus):
+    """Single-worker backend: publishing delivers straight to the local sockets"""
+
+    async def publish(self, envelope: dict):
+        if self._deliver is not None:
+            await self._deliver(envelope)
+
+
+class RedisMessageBus(MessageBus):
+    """Multi-worker backend built on Redis pub/sub.
+
+    The publishing worker does not deliver locally; it receives its own
+    envelope back through its subscription like every other worker, so each
+    socket is written exactly once by the worker that owns it. If the
+    subscription drops, the listener resubscribes with exponential backoff;
+    envelopes published meanwhile are lost, as with any Redis pub/sub.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        channel: str = FANOUT_CHANNEL,
+        retry_delay: float = 0.5,
+        max_retry_delay: float = BUS_RECONNECT_MAX_SECONDS,
+    ):
+        super().__init__()
+        if client is None:
+            from app.utils.redis import get_redis
+            client = get_redis()
+        self.client = client
+        self.channel = channel
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.reconnects = 0
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+        # Connects racing to start the bus on a fresh worker must share one subscription
+        self._start_lock = asyncio.Lock()
+
+    async def start(self, deliver: DeliverCallback):
+        async with self._start_lock:
+            if self.started:
+                return
+            # Only report started once the subscription is in place
+            await self._subscribe()
+            await super().start(deliver)
+            self._listener = asyncio.create_task(self._listen())
+
+    async def _subscribe(self):
+        pubsub = self.client.pubsub()
+        await pubsub.subscribe(self.channel)
+        self._pubsub = pubsub
+
+    async def _close_pubsub(self):
+        pubsub, self._pubsub = self._pubsub, None
+        if pubsub is None:
+            return
+        try:
+            await pubsub.aclose()
+        except Exception:
+            pass
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe(self.channel)
+            await self._pubsub.aclose()
+            self._pubsub = None
+        await super().stop()
+
+    async def publish(self, envelope: dict):
+        await self.client.publish(self.channel, json.dumps(envelope, default=str))
+
+    async def _listen(self):
+        delay = self.retry_delay
+        while True:
+            try:
+                if self._pubsub is None:
+                    await self._subscribe()
+                    self.reconnects += 1
+                    delay = self.retry_delay
+                async for item in self._pubsub.listen():
+                    if item.get("type") != "message":
+                        continue
+                    try:
+                        await self._deliver(json.loads(item["data"]))
+                    except Exception:
+                        print(traceback.format_exc())
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                print(traceback.format_exc())
+            # The connection dropped (or listen() ended); start over on a fresh one
+            await self._close_pubsub()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+
+
+def get_message_bus() -> MessageBus:
+    """Build the backend selected by MESSAGE_BUS ("memory" or "redis")"""
+    backend = os.getenv("MESSAGE_BUS", "memory").lower()
+    if backend == "redis":
+        return RedisMessageBus()
+    return InProcessMessageBus()
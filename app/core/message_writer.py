@@ -0,0 +1,208 @@
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import os
+import traceback
+
+from app.database import frame_queries, run_db, session_scope
+from app.models.message import Message, load_by_client_ids, save_messages
+
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", "200"))
+MESSAGE_BATCH_DELAY_MS = float(os.getenv("MESSAGE_BATCH_DELAY_MS", "5"))
+
+
+class DuplicateMessage(Exception):
+    """The sender already stored a message with this client_message_id; carries the stored row"""
+
+    def __init__(self, message: Message):
+        super().__init__(f"Duplicate client_message_id {message.client_message_id}")
+        self.message = message
+
+
+class WriterStats:
+    __slots__ = ("batches", "messages", "failed_batches", "largest_batch", "duplicates")
+
+    def __init__(self):
+        self.batches = 0
+        self.messages = 0
+        self.failed_batches = 0
+        self.largest_batch = 0
+        self.duplicates = 0
+
+    def snapshot(self) -> dict:
+        snapshot = {name: getattr(self, name) for name in self.__slots__}
+        snapshot["avg_batch"] = self.messages / self.batches if self.batches else 0.0
+        return snapshot
+
+
+class MessageWriter:
+    """Group-commit stage for new messages.
+
+    Messages from every socket are collected for up to max_delay seconds or
+    max_batch rows, then written with one multi-row INSERT and one commit on
+    the DB thread pool. save() resolves only once the batch holding the
+    message is durable, so callers can ack the client afterwards.
+    save_many() keeps a client's batch together in a single group commit.
+    A message whose client_message_id its sender already stored is not
+    inserted again; its result is a DuplicateMessage holding the stored row.
+    """
+
+    def __init__(self, max_batch: int = MESSAGE_BATCH_SIZE, max_delay: float = MESSAGE_BATCH_DELAY_MS / 1000):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.stats = WriterStats()
+        self._queue: Optional["asyncio.Queue[Tuple[List[Message], asyncio.Future]]"] = None
+        self._task: Optional[asyncio.Task] = None
+        # True from the moment a batch is dequeued until its futures are resolved
+        self._busy = False
+
+    async def save(self, message: Message) -> Message:
+        error = (await self.save_many([message]))[0]
+        if error is not None:
+            raise error
+        return message
+
+    async def save_many(self, messages: List[Message]) -> List[Optional[Exception]]:
+        """Persist messages in one commit; returns None or the error for each message"""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((messages, future))
+        return await future
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush whatever is queued, then stop the batching task"""
+        if self._task is None:
+            return
+        while self._busy or not self._queue.empty():
+            await asyncio.sleep(self.max_delay)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        # This task may be created while a frame is being timed; batches are shared
+        # by many frames, so their statements are not attributed to any one of them
+        frame_queries.set(None)
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            self._busy = True
+            rows = len(batch[0][0])
+            deadline = loop.time() + self.max_delay
+            # A save_many() group is never split, so a batch may overshoot max_batch
+            while rows < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+                rows += len(batch[-1][0])
+            try:
+                await self._flush(batch)
+            except Exception as error:
+                # Never let one batch stop the writer, and never leave a sender without an answer
+                print(traceback.format_exc())
+                for group, future in batch:
+                    if not future.done():
+                        future.set_result([error] * len(group))
+            finally:
+                self._busy = False
+
+    async def _flush(self, batch: List[Tuple[List[Message], asyncio.Future]]):
+        messages = [message for group, _ in batch for message in group]
+        try:
+            await run_db(self._write_batch, messages)
+        except Exception:
+            print(traceback.format_exc())
+            self.stats.failed_batches += 1
+            try:
+                results = await run_db(self._write_after_failure, messages)
+            except Exception as error:
+                # e.g. the database is unreachable: every sender gets the error rather than no answer
+                print(traceback.format_exc())
+                results = [error] * len(messages)
+            self.stats.duplicates += sum(isinstance(result, DuplicateMessage) for result in results)
+        else:
+            results = [None] * len(messages)
+            self.stats.batches += 1
+            self.stats.messages += len(messages)
+            self.stats.largest_batch = max(self.stats.largest_batch, len(messages))
+
+        offset = 0
+        for group, future in batch:
+            if not future.done():
+                future.set_result(results[offset:offset + len(group)])
+            offset += len(group)
+
+    @staticmethod
+    def _write_batch(messages: List[Message]):
+        with session_scope() as db:
+            save_messages(db, messages)
+
+    @classmethod
+    def _write_after_failure(cls, messages: List[Message]) -> List[Optional[Exception]]:
+        """Retry a failed batch without the messages that are already stored.
+
+        Replayed sends are the usual reason for a failed batch (the unique
+        index on sender_id, client_message_id), so they are looked up with one
+        query and the rest retried as a batch. Only if that fails too are the
+        rows written one by one, so one bad message does not fail the others.
+        """
+        results: List[Optional[Exception]] = [None] * len(messages)
+        stored = cls._find_stored(messages)
+        fresh = []
+        for position, message in enumerate(messages):
+            key = (message.sender_id, message.client_message_id)
+            if key in stored:
+                results[position] = DuplicateMessage(stored[key])
+            else:
+                fresh.append(position)
+        if stored and fresh:
+            try:
+                cls._write_batch([messages[position] for position in fresh])
+                return results
+            except Exception:
+                print(traceback.format_exc())
+        for position in fresh:
+            try:
+                with session_scope() as db:
+                    save_messages(db, [messages[position]])
+            except Exception as error:
+                results[position] = error
+        # A row may also have been stored meanwhile, e.g. by another worker or earlier in this batch
+        failed = [position for position in fresh if results[position] is not None]
+        stored = cls._find_stored([messages[position] for position in failed])
+        for position in failed:
+            message = messages[position]
+            key = (message.sender_id, message.client_message_id)
+            if key in stored:
+                results[position] = DuplicateMessage(stored[key])
+        return results
+
+    @staticmethod
+    def _find_stored(messages: List[Message]) -> Dict[Tuple[str, str], Message]:
+        """Rows already stored for these sends; nothing if the lookup itself fails"""
+        keys = list({
+            (message.sender_id, message.client_message_id)
+            for message in messages if message.client_message_id is not None
+        })
+        if not keys:
+            return {}
+        try:
+            with session_scope() as db:
+                return {
+                    (message.sender_id, message.client_message_id): message
+                    for message in load_by_client_ids(db, keys)
+                }
+        except Exception:
+            print(traceback.format_exc())
+            return {}
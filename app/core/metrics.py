@@ -0,0 +1,161 @@
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import os
+import time
+
+from app.database import frame_queries
+
+# Frames slower than this are logged with their per-stage breakdown (0 disables)
+SLOW_MESSAGE_MS = float(os.getenv("SLOW_MESSAGE_MS", "0"))
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter", f"{self.name} {self.value}"]
+
+
+class Gauge:
+    """Gauge read from a callback at scrape time, so the hot path never updates it"""
+
+    def __init__(self, name: str, help: str, read: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.read()}"]
+
+
+class Histogram:
+    """Fixed-bucket histogram, optionally split by label values"""
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        # label values -> [per-bucket counts..., +Inf count], sum
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, labels: Tuple[str, ...] = ()):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames + ('le',), labels + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Metrics:
+    """Hot-path metrics for the websocket endpoint, rendered in Prometheus text format"""
+
+    def __init__(self):
+        self.frame_seconds = Histogram("rumr_frame_seconds", "Time to process one inbound frame")
+        self.stage_seconds = Histogram(
+            "rumr_frame_stage_seconds", "Time spent per stage of inbound frame processing", labelnames=("stage",)
+        )
+        self.frame_db_queries = Histogram(
+            "rumr_frame_db_queries", "DB statements issued while processing one frame", buckets=COUNT_BUCKETS
+        )
+        self.fanout_recipients = Histogram(
+            "rumr_fanout_recipients", "Local recipients a broadcast was queued for", buckets=COUNT_BUCKETS
+        )
+        self.fanout_queue_seconds = Histogram(
+            "rumr_fanout_queue_seconds", "Time a fanout chunk waited for the scheduler", labelnames=("size_class",)
+        )
+        self.fanout_seconds = Histogram(
+            "rumr_fanout_seconds", "Time from a broadcast reaching this worker to its last local enqueue",
+            labelnames=("size_class",),
+        )
+        self.send_seconds = Histogram("rumr_send_seconds", "Time for one websocket send by a connection writer")
+        self.slow_frames = Counter("rumr_slow_frames_total", "Frames slower than SLOW_MESSAGE_MS")
+        self._collectors: list = [
+            self.frame_seconds, self.stage_seconds, self.frame_db_queries,
+            self.fanout_recipients, self.fanout_queue_seconds, self.fanout_seconds, self.send_seconds, self.slow_frames,
+        ]
+        self._snapshots: List[Tuple[str, Callable[[], dict]]] = []
+
+    def add_gauge(self, name: str, help: str, read: Callable[[], float]):
+        self._collectors.append(Gauge(name, help, read))
+
+    def add_snapshot(self, prefix: str, read: Callable[[], dict]):
+        """Expose every numeric field of a stats dict as rumr_<prefix>_<field>"""
+        self._snapshots.append((prefix, read))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for collector in self._collectors:
+            lines.extend(collector.render())
+        for prefix, read in self._snapshots:
+            for key, value in read().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    name = f"rumr_{prefix}_{key}"
+                    lines.append(f"# TYPE {name} gauge")
+                    lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class FrameTimer:
+    """Per-frame stage stopwatch.
+
+    mark(stage) attributes the time since the previous mark to that stage, and
+    finish() records everything in one go. DB statements run on the thread
+    pool while the timer is active are counted for this frame only.
+    """
+
+    __slots__ = ("started", "last", "stages", "queries", "_token")
+
+    def __init__(self):
+        self.started = self.last = time.perf_counter()
+        self.stages: List[Tuple[str, float]] = []
+        self.queries = [0]
+        self._token = frame_queries.set(self.queries)
+
+    def mark(self, stage: str):
+        now = time.perf_counter()
+        self.stages.append((stage, now - self.last))
+        self.last = now
+
+    def finish(self, **context: Optional[str]):
+        total = time.perf_counter() - self.started
+        frame_queries.reset(self._token)
+        metrics.frame_seconds.observe(total)
+        metrics.frame_db_queries.observe(self.queries[0])
+        for stage, elapsed in self.stages:
+            metrics.stage_seconds.observe(elapsed, (stage,))
+        if SLOW_MESSAGE_MS and total * 1000 >= SLOW_MESSAGE_MS:
+            metrics.slow_frames.inc()
+            breakdown = " ".join(f"{stage}={elapsed * 1000:.2f}ms" for stage, elapsed in self.stages)
+            details = " ".join(f"{key}={value}" for key, value in context.items())
+            print(f"Slow frame {total * 1000:.2f}ms {details} queries={self.queries[0]} {breakdown}")
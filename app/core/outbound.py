@@ -0,0 +1,432 @@
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+import asyncio
+import os
+import time
+import traceback
+
+from fastapi import WebSocket
+
+from app.core.events import EPHEMERAL_QUEUE_LIMIT
+from app.core.frames import FULL, JSON, MESSAGE, PROFILE, Codec, Frame, OutboundFrame
+from app.core.metrics import metrics
+
+OUTBOUND_QUEUE_SIZE = int(os.getenv("OUTBOUND_QUEUE_SIZE", "256"))
+OUTBOUND_OVERFLOW_POLICY = os.getenv("OUTBOUND_OVERFLOW_POLICY", "drop_oldest").lower()
+# How long missed positions are kept for a user who does not reconnect
+OFFLINE_SPILL_TTL_SECONDS = int(os.getenv("OFFLINE_SPILL_TTL_SECONDS", "86400"))
+# Sender profiles remembered per interning connection before the table is reset
+INTERNED_PROFILES_MAX = int(os.getenv("INTERNED_PROFILES_MAX", "1024"))
+# Broadcasts reaching a coalescing connection within this window share one frame
+OUTBOUND_COALESCE_MS = float(os.getenv("OUTBOUND_COALESCE_MS", "5"))
+OUTBOUND_COALESCE_MAX = int(os.getenv("OUTBOUND_COALESCE_MAX", "50"))
+
+# What to do when a connection's outbound queue is full
+DROP_OLDEST = "drop_oldest"
+DISCONNECT = "disconnect"
+SPILL = "spill"
+OVERFLOW_POLICIES = (DROP_OLDEST, DISCONNECT, SPILL)
+
+# Close code sent to consumers disconnected for falling behind (Try Again Later)
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+class OutboundStats:
+    """Counters shared by every connection of one manager"""
+
+    __slots__ = (
+        "enqueued", "sent", "dropped", "spilled", "spill_errors", "slow_disconnects", "send_errors", "coalesced",
+        "ephemeral_dropped",
+    )
+
+    def __init__(self):
+        self.enqueued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.spill_errors = 0
+        self.slow_disconnects = 0
+        self.send_errors = 0
+        self.coalesced = 0
+        self.ephemeral_dropped = 0
+
+    def snapshot(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class SpillStore(ABC):
+    """Offline record of broadcasts a slow consumer could not take.
+
+    Only positions are kept, never encoded frames: the next socket of the
+    user may use another codec, and the frames themselves are replayed from
+    the recent buffer or the DB by ConnectionManager.resume.
+    """
+
+    @abstractmethod
+    async def spill(self, user_id: str, missed: List[Tuple[str, int]]):
+        """Remember (conversation_id, seq) broadcasts the user missed"""
+
+    @abstractmethod
+    async def drain(self, user_id: str) -> Dict[str, int]:
+        """Forget and return what the user missed, as resume positions (last seq seen per conversation)"""
+
+
+class RedisSpillStore(SpillStore):
+    """Earliest missed seq per conversation, in a per-user Redis hash (rumr:offline:<user_id>)"""
+
+    def __init__(self, client=None, ttl: int = OFFLINE_SPILL_TTL_SECONDS):
+        if client is None:
+            from app.utils.redis import get_redis
+            client = get_redis()
+        self.client = client
+        self.ttl = ttl
+
+    async def spill(self, user_id: str, missed: List[Tuple[str, int]]):
+        key = f"rumr:offline:{user_id}"
+        pipe = self.client.pipeline(transaction=False)
+        for conversation_id, seq in missed:
+            # A socket gets each conversation's broadcasts in seq order, so the first one is the earliest
+            pipe.hsetnx(key, conversation_id, seq)
+        pipe.expire(key, self.ttl)
+        await pipe.execute()
+
+    async def drain(self, user_id: str) -> Dict[str, int]:
+        key = f"rumr:offline:{user_id}"
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hgetall(key)
+        pipe.delete(key)
+        missed, _ = await pipe.execute()
+        return {
+            (conversation_id.decode() if isinstance(conversation_id, bytes) else conversation_id): int(seq) - 1
+            for conversation_id, seq in missed.items()
+        }
+
+
+def _missed(frames: Iterable[OutboundFrame]) -> List[Tuple[str, int]]:
+    """(conversation_id, seq) of the messages among broadcast frames"""
+    missed = []
+    for frame in frames:
+        conversation_id, seq = frame.payload.get("conversation_id"), frame.payload.get("seq")
+        if conversation_id is not None and seq is not None:
+            missed.append((conversation_id, seq))
+    return missed
+
+
+class FrameQueue:
+    """Bounded FIFO of encoded frames for a single consumer (the writer task).
+
+    A small fraction of an asyncio.Queue's footprint: no putter/getter deques
+    or join bookkeeping, and no buffer at all until the first frame arrives.
+    """
+
+    __slots__ = ("maxsize", "_queue", "_waiter", "_room_waiter")
+
+    def __init__(self, maxsize: int = 0):
+        self.maxsize = maxsize
+        self._queue: Optional[Deque[Frame]] = None
+        self._waiter: Optional[asyncio.Future] = None
+        # A producer pacing itself to the consumer (see wait_for_room)
+        self._room_waiter: Optional[asyncio.Future] = None
+
+    def qsize(self) -> int:
+        return len(self._queue) if self._queue else 0
+
+    def empty(self) -> bool:
+        return not self._queue
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= self.qsize()
+
+    def put_nowait(self, frame: Frame):
+        if self.full():
+            raise asyncio.QueueFull
+        if self._queue is None:
+            self._queue = deque()
+        self._queue.append(frame)
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def get_nowait(self) -> Frame:
+        if not self._queue:
+            raise asyncio.QueueEmpty
+        frame = self._queue.popleft()
+        self.wake()
+        return frame
+
+    async def get(self) -> Frame:
+        while not self._queue:
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        frame = self._queue.popleft()
+        self.wake()
+        return frame
+
+    def room(self) -> int:
+        return self.maxsize - self.qsize() if self.maxsize > 0 else 1 << 30
+
+    async def wait_for_room(self, frames: int = 1):
+        """Wait until the consumer has taken something, unless frames already fit"""
+        if self.room() < frames:
+            self._room_waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._room_waiter
+            finally:
+                self._room_waiter = None
+
+    def wake(self):
+        """Release a producer waiting for room"""
+        if self._room_waiter is not None and not self._room_waiter.done():
+            self._room_waiter.set_result(None)
+
+
+class Connection:
+    """One websocket with its own bounded outbound queue and writer task.
+
+    Broadcasts only enqueue pre-encoded frames, so a slow client delays
+    nobody but itself. When the queue is full the overflow policy decides
+    whether to drop the oldest frame, disconnect the client or spill the
+    frame to offline storage.
+
+    Frames are encoded with the codec negotiated for the socket. A
+    connection that interns profiles remembers which sender profiles it
+    has already been sent, and receives broadcasts without them. A
+    coalescing connection holds broadcasts for up to coalesce_window seconds
+    and sends them as one {"messages": [...]} frame.
+
+    Slotted, and optional state is only allocated when used, since a worker
+    holds one of these per open socket.
+    """
+
+    __slots__ = (
+        "websocket", "user_id", "stats", "policy", "spill_store", "on_evict", "codec", "known_profiles",
+        "coalesce_window", "_pending", "_flush_handle", "queue", "closed", "_writer", "_background",
+        "heartbeat", "last_activity", "timer",
+    )
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user_id: str,
+        stats: OutboundStats,
+        maxsize: int = OUTBOUND_QUEUE_SIZE,
+        policy: str = OUTBOUND_OVERFLOW_POLICY,
+        spill_store: Optional[SpillStore] = None,
+        on_evict: Optional[Callable[["Connection"], None]] = None,
+        intern_profiles: bool = False,
+        codec: Codec = JSON,
+        coalesce_window: float = 0.0,
+        heartbeat: bool = False,
+    ):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {policy!r}, expected one of {OVERFLOW_POLICIES}")
+        self.websocket = websocket
+        self.user_id = user_id
+        self.stats = stats
+        self.policy = policy
+        self.spill_store = spill_store
+        self.on_evict = on_evict
+        self.codec = codec
+        # sender_id -> profile frame last sent on this socket (None: legacy full frames)
+        self.known_profiles: Optional[Dict[str, Frame]] = {} if intern_profiles else None
+        self.coalesce_window = coalesce_window
+        self._pending: List[Tuple[OutboundFrame, str]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self.queue = FrameQueue(maxsize=maxsize)
+        self.closed = False
+        self._writer: Optional[asyncio.Task] = None
+        # Spill and close tasks still running; created on first use
+        self._background: Optional[Set[asyncio.Task]] = None
+        # Whether the client answers {"status": "ping"}, when it last sent a frame, and its idle check
+        self.heartbeat = heartbeat
+        self.last_activity = time.monotonic()
+        self.timer = None
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def touch(self):
+        """Record a sign of life from the client"""
+        self.last_activity = time.monotonic()
+
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    def send(self, frame: Frame) -> bool:
+        """Enqueue a frame without waiting; returns False if it was not queued"""
+        if self._pending:
+            # Keep frames in order: held broadcasts go out first
+            self._flush_pending()
+        return self._enqueue(frame)
+
+    def _enqueue(self, frame: Frame, sources: Tuple[OutboundFrame, ...] = ()) -> bool:
+        """Queue an encoded frame; sources are the broadcasts it carries, for the spill policy"""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            return self._overflow(frame, sources)
+        self.stats.enqueued += 1
+        return True
+
+    def send_json(self, payload: dict) -> bool:
+        return self.send(self.codec.encode(payload))
+
+    def send_broadcast(self, frame: OutboundFrame) -> bool:
+        """Enqueue a broadcast in the form this connection negotiated"""
+        sender_id = frame.sender_id
+        if self.known_profiles is None or sender_id is None:
+            return self._send_part(frame, FULL)
+        profile = frame.encode(self.codec, PROFILE)
+        # Sent once per session, and again whenever the profile changes
+        if self.known_profiles.get(sender_id) != profile:
+            if len(self.known_profiles) >= INTERNED_PROFILES_MAX:
+                self.known_profiles.clear()
+            if not self._send_part(frame, PROFILE):
+                return False
+            self.known_profiles[sender_id] = profile
+        return self._send_part(frame, MESSAGE)
+
+    async def send_paced(self, frame: OutboundFrame) -> bool:
+        """Enqueue a broadcast once it fits, so a long replay never overflows the queue.
+
+        Returns False if the connection closed while waiting. Live broadcasts
+        are not held back by this; they can still overflow as usual.
+        """
+        # A profile frame may go out ahead of the message
+        needed = 2 if self.known_profiles is not None else 1
+        while not self.closed and self.queue.room() < needed:
+            await self.queue.wait_for_room(needed)
+        return self.send_broadcast(frame)
+
+    def send_ephemeral(self, frame: OutboundFrame) -> bool:
+        """Enqueue a transient event only if the socket is keeping up; never overflows"""
+        if self.closed:
+            return False
+        if self.queue.qsize() >= EPHEMERAL_QUEUE_LIMIT or self.queue.full():
+            self.stats.ephemeral_dropped += 1
+            return False
+        self.queue.put_nowait(frame.encode(self.codec))
+        self.stats.enqueued += 1
+        return True
+
+    def _send_part(self, frame: OutboundFrame, part: str) -> bool:
+        if self.coalesce_window <= 0:
+            return self._enqueue(frame.encode(self.codec, part), (frame,) if part != PROFILE else ())
+        if self.closed:
+            return False
+        self._pending.append((frame, part))
+        if len(self._pending) >= OUTBOUND_COALESCE_MAX:
+            self._flush_pending()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.coalesce_window, self._flush_pending)
+        return True
+
+    def _flush_pending(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, []
+        if len(pending) == 1:
+            # Nothing to coalesce; reuse the frame shared with other recipients
+            frame, part = pending[0]
+            self._enqueue(frame.encode(self.codec, part), (frame,) if part != PROFILE else ())
+        elif pending:
+            # Items are encoded once per broadcast; only the wrapper is per connection
+            raw = self.codec.raw
+            self._enqueue(
+                self.codec.join([frame.encode(raw, part) for frame, part in pending]),
+                tuple(frame for frame, part in pending if part != PROFILE),
+            )
+            self.stats.coalesced += len(pending) - 1
+
+    def close(self):
+        """Stop the writer; frames still queued are discarded"""
+        self.closed = True
+        self._pending = []
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+        self.queue.wake()
+
+    def _overflow(self, frame: Frame, sources: Tuple[OutboundFrame, ...] = ()) -> bool:
+        if self.policy == DROP_OLDEST:
+            self.queue.get_nowait()
+            self.queue.put_nowait(frame)
+            if self.known_profiles:
+                # The dropped frame may have been a profile; send them all again
+                self.known_profiles.clear()
+            self.stats.dropped += 1
+            self.stats.enqueued += 1
+            return True
+        if self.policy == SPILL and self.spill_store is not None:
+            missed = _missed(sources)
+            if missed:
+                self._in_background(self._spill(missed))
+            else:
+                # Acks, errors and profiles have nothing to replay them from
+                self.stats.dropped += 1
+            return False
+        # DISCONNECT, or SPILL with nowhere to spill to
+        self.stats.dropped += 1
+        self.stats.slow_disconnects += 1
+        self.evict(SLOW_CONSUMER_CLOSE_CODE)
+        return False
+
+    async def _spill(self, missed: List[Tuple[str, int]]):
+        try:
+            await self.spill_store.spill(self.user_id, missed)
+        except Exception:
+            self.stats.spill_errors += 1
+            self.stats.dropped += len(missed)
+            print(traceback.format_exc())
+            return
+        self.stats.spilled += len(missed)
+
+    def evict(self, code: int):
+        """Stop writing, tell the manager, and close the socket with code"""
+        self.close()
+        if self.on_evict is not None:
+            self.on_evict(self)
+        self._in_background(self._close_socket(code))
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    def _in_background(self, coro):
+        if self._background is None:
+            self._background = set()
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _write_loop(self):
+        while True:
+            frame = await self.queue.get()
+            try:
+                started = time.perf_counter()
+                if isinstance(frame, bytes):
+                    await self.websocket.send_bytes(frame)
+                else:
+                    await self.websocket.send_text(frame)
+                metrics.send_seconds.observe(time.perf_counter() - started)
+                self.stats.sent += 1
+            except Exception:
+                # The socket is gone; stop writing and let the manager forget it
+                self.stats.send_errors += 1
+                self.closed = True
+                self._writer = None
+                if self.on_evict is not None:
+                    self.on_evict(self)
+                return
@@ -0,0 +1,179 @@
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from datetime import datetime, timezone
+import asyncio
+import os
+import traceback
+
+from app.database import run_db, session_scope
+from app.models.user import save_presence
+
+PRESENCE_FLUSH_SECONDS = float(os.getenv("PRESENCE_FLUSH_SECONDS", "5"))
+PRESENCE_DEBOUNCE_SECONDS = float(os.getenv("PRESENCE_DEBOUNCE_SECONDS", "1"))
+
+# (user_id, online, last_seen)
+PresenceChange = Tuple[str, bool, datetime]
+
+
+class PresenceStats:
+    __slots__ = ("flushes", "rows_written", "writes_skipped", "pushes", "pushes_skipped")
+
+    def __init__(self):
+        self.flushes = 0
+        self.rows_written = 0
+        self.writes_skipped = 0
+        self.pushes = 0
+        self.pushes_skipped = 0
+
+    def snapshot(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class _NetChanges:
+    """Latest state per user since the last drain, dropping users who ended where they started"""
+
+    def __init__(self):
+        self._latest: Dict[str, PresenceChange] = {}
+        self._initial: Dict[str, bool] = {}
+
+    def record(self, user_id: str, online: bool, at: datetime):
+        if user_id not in self._latest:
+            self._initial[user_id] = not online
+        self._latest[user_id] = (user_id, online, at)
+
+    def drain(self) -> Tuple[List[PresenceChange], int]:
+        latest, initial = self._latest, self._initial
+        self._latest, self._initial = {}, {}
+        changes = [change for user_id, change in latest.items() if change[1] != initial[user_id]]
+        return changes, len(latest) - len(changes)
+
+    def restore(self, changes: List[PresenceChange]):
+        """Put back drained changes that were not applied; newer changes of the same user win"""
+        for change in changes:
+            user_id, online, _ = change
+            # The stored state is still the one before the lost change
+            self._initial[user_id] = not online
+            self._latest.setdefault(user_id, change)
+
+
+class PresenceRegistry:
+    """Authoritative online state for the sockets on this worker.
+
+    Connects and disconnects only touch memory. Every PRESENCE_FLUSH_SECONDS
+    the net changes are written with one batched UPDATE, and every
+    PRESENCE_DEBOUNCE_SECONDS they are handed to `push` for peers. A user
+    who drops and reconnects within a window (e.g. a reconnect storm after a
+    deploy) costs neither a write nor a push.
+
+    Each worker only knows its own sockets, so with several workers the
+    is_user_online column is last-writer-wins: a worker writes offline when
+    its last local socket for the user closes, even if the user is still
+    connected to another worker. last_seen is accurate either way.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = PRESENCE_FLUSH_SECONDS,
+        debounce: float = PRESENCE_DEBOUNCE_SECONDS,
+        clock: Callable[[], datetime] = lambda: datetime.now(timezone.utc),
+    ):
+        self.flush_interval = flush_interval
+        self.debounce = debounce
+        self.clock = clock
+        self.stats = PresenceStats()
+        # Open sockets per user on this worker
+        self._sockets: Dict[str, int] = {}
+        self._unflushed = _NetChanges()
+        self._unpushed = _NetChanges()
+        self._push: Optional[Callable[[List[PresenceChange]], Awaitable[None]]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def started(self) -> bool:
+        return self._task is not None
+
+    def is_online(self, user_id: str) -> bool:
+        return user_id in self._sockets
+
+    def online_count(self) -> int:
+        return len(self._sockets)
+
+    def connected(self, user_id: str):
+        count = self._sockets.get(user_id, 0)
+        self._sockets[user_id] = count + 1
+        if count == 0:
+            self._changed(user_id, True)
+
+    def disconnected(self, user_id: str):
+        count = self._sockets.get(user_id, 0)
+        if count <= 1:
+            if self._sockets.pop(user_id, None) is not None:
+                self._changed(user_id, False)
+        else:
+            self._sockets[user_id] = count - 1
+
+    def _changed(self, user_id: str, online: bool):
+        at = self.clock()
+        self._unflushed.record(user_id, online, at)
+        self._unpushed.record(user_id, online, at)
+
+    def start(self, push: Callable[[List[PresenceChange]], Awaitable[None]]):
+        self._push = push
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Mark every local user offline and write that out before the worker exits"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for user_id in list(self._sockets):
+            self._sockets.pop(user_id)
+            self._changed(user_id, False)
+        await self.flush()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_flush = loop.time() + self.flush_interval
+        while True:
+            await asyncio.sleep(self.debounce)
+            try:
+                await self.push_pending()
+                if loop.time() >= next_flush:
+                    next_flush = loop.time() + self.flush_interval
+                    await self.flush()
+            except Exception:
+                print(traceback.format_exc())
+
+    async def push_pending(self):
+        changes, skipped = self._unpushed.drain()
+        self.stats.pushes_skipped += skipped
+        if changes and self._push is not None:
+            self.stats.pushes += len(changes)
+            await self._push(changes)
+
+    async def flush(self):
+        changes, skipped = self._unflushed.drain()
+        self.stats.writes_skipped += skipped
+        if not changes:
+            return
+        try:
+            await run_db(self._write, changes)
+        except Exception:
+            # Retried with the next flush, unless a newer change supersedes it
+            self._unflushed.restore(changes)
+            raise
+        self.stats.flushes += 1
+        self.stats.rows_written += len(changes)
+
+    @staticmethod
+    def _write(changes: List[PresenceChange]):
+        with session_scope() as db:
+            save_presence(db, changes)
+
+    def snapshot(self) -> dict:
+        snapshot = self.stats.snapshot()
+        snapshot["online"] = len(self._sockets)
+        return snapshot
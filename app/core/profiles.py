@@ -0,0 +1,90 @@
+from typing import Dict, Optional
+import os
+import weakref
+
+from sqlalchemy import event
+from sqlmodel import Session, select
+
+from app.database import run_db, session_scope
+from app.models.user import User
+from app.utils.cache import TTLCache
+
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "50000"))
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "300"))
+
+# Sender columns copied into every MessageResponse
+PROFILE_FIELDS = (
+    "PhoneNumber",
+    "FirstName",
+    "LastName",
+    "Email",
+    "Username",
+    "Bio",
+    "ProfilePhoto",
+    "backgroundImage",
+    "PrivacySettingsID",
+)
+
+
+def load_profile(db: Session, user_id: str) -> Dict[str, Optional[str]]:
+    """Fetch only the projected profile columns; unknown users map to empty fields"""
+    row = db.exec(
+        select(*[getattr(User, field) for field in PROFILE_FIELDS]).where(User.UserID == user_id)
+    ).first()
+    if row is None:
+        return dict.fromkeys(PROFILE_FIELDS)
+    return dict(zip(PROFILE_FIELDS, row))
+
+
+# Every live cache, so ORM writes in this process can invalidate them
+_caches: "weakref.WeakSet[ProfileCache]" = weakref.WeakSet()
+
+
+class ProfileCache:
+    """user_id -> projected profile dict, with LRU/TTL eviction.
+
+    Cached dicts are shared between broadcasts and must be treated as read-only.
+    """
+
+    def __init__(self, maxsize: int = PROFILE_CACHE_SIZE, ttl: float = PROFILE_CACHE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        _caches.add(self)
+
+    async def get(self, user_id: str, db: Optional[Session] = None) -> Dict[str, Optional[str]]:
+        profile = self._cache.get(user_id)
+        if profile is not None:
+            return profile
+        if db is not None:
+            profile = await run_db(load_profile, db, user_id)
+        else:
+            profile = await run_db(self._load_in_scope, user_id)
+        self._cache.set(user_id, profile)
+        return profile
+
+    @staticmethod
+    def _load_in_scope(user_id: str) -> Dict[str, Optional[str]]:
+        with session_scope() as db:
+            return load_profile(db, user_id)
+
+    def invalidate(self, user_id: str):
+        self._cache.pop(user_id)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+def invalidate_everywhere(user_id: str):
+    for cache in list(_caches):
+        cache.invalidate(user_id)
+
+
+# Profile edits made through the ORM in this process drop the cached entry;
+# other workers pick the change up via the bus or TTL
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _profile_changed(mapper, connection, target: User):
+    invalidate_everywhere(target.UserID)
@@ -0,0 +1,200 @@
+from typing import Callable, List, Optional, Tuple
+import os
+import time
+import traceback
+
+from app.utils.cache import TTLCache
+
+# Messages a sender may send per second, and how many at once after being idle (0 disables)
+RATE_LIMIT_USER_PER_SECOND = float(os.getenv("RATE_LIMIT_USER_PER_SECOND", "10"))
+RATE_LIMIT_USER_BURST = float(os.getenv("RATE_LIMIT_USER_BURST", "30"))
+# Messages a conversation accepts per second from all senders together (0 disables)
+RATE_LIMIT_CONVERSATION_PER_SECOND = float(os.getenv("RATE_LIMIT_CONVERSATION_PER_SECOND", "50"))
+RATE_LIMIT_CONVERSATION_BURST = float(os.getenv("RATE_LIMIT_CONVERSATION_BURST", "100"))
+RATE_LIMIT_BUCKETS = int(os.getenv("RATE_LIMIT_BUCKETS", "200000"))
+# "memory": limits per worker; "redis": also enforced across workers
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+
+
+class Limit:
+    __slots__ = ("rate", "burst")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    @property
+    def idle_seconds(self) -> float:
+        """Time for an empty bucket to refill; after that a fresh bucket is equivalent"""
+        return self.burst / self.rate
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+    def refill(self, limit: Limit, now: float) -> float:
+        self.tokens = min(limit.burst, self.tokens + (now - self.updated) * limit.rate)
+        self.updated = now
+        return self.tokens
+
+
+class RateLimitStats:
+    __slots__ = ("checked", "throttled_user", "throttled_conversation", "throttled_shared", "shared_errors")
+
+    def __init__(self):
+        self.checked = 0
+        self.throttled_user = 0
+        self.throttled_conversation = 0
+        self.throttled_shared = 0
+        self.shared_errors = 0
+
+    def snapshot(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+# Both buckets are refilled, and tokens are taken from both only if both have enough.
+# Returns 0 when allowed, else the 1-based index of the bucket that refused.
+TOKEN_BUCKETS_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local cost = tonumber(ARGV[1])
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local rate, burst = tonumber(ARGV[i * 2]), tonumber(ARGV[i * 2 + 1])
+    local state = redis.call('HMGET', key, 't', 'u')
+    local current = tonumber(state[1]) or burst
+    local updated = tonumber(state[2]) or now
+    current = math.min(burst, current + math.max(0, now - updated) * rate)
+    if current < cost then
+        return i
+    end
+    tokens[i] = current
+end
+for i, key in ipairs(KEYS) do
+    local rate, burst = tonumber(ARGV[i * 2]), tonumber(ARGV[i * 2 + 1])
+    redis.call('HSET', key, 't', tokens[i] - cost, 'u', now)
+    redis.call('PEXPIRE', key, math.ceil(burst / rate * 1000))
+end
+return 0
+"""
+
+
+class RedisRateLimiter:
+    """Token buckets shared by every worker, kept in Redis hashes (rumr:rate:<scope>:<id>)"""
+
+    def __init__(self, client=None):
+        if client is None:
+            from app.utils.redis import get_redis
+            client = get_redis()
+        self.client = client
+        self._script = client.register_script(TOKEN_BUCKETS_SCRIPT)
+
+    async def take(self, buckets: List[Tuple[str, Limit]], cost: int) -> int:
+        """0 when allowed, else the 1-based index of the bucket that refused"""
+        args: list = [cost]
+        for _, limit in buckets:
+            args.extend((limit.rate, limit.burst))
+        return int(await self._script(keys=[f"rumr:rate:{key}" for key, _ in buckets], args=args))
+
+
+class FloodControl:
+    """Token buckets per sender and per conversation, checked before any DB work.
+
+    Buckets live in memory and cost no I/O, so rejecting a flood is cheap.
+    Either bucket may be checked on its own: callers charge the sender's
+    before authorizing, and the conversation's only once the sender is known
+    to be a member, so outsiders cannot use up a conversation's budget. With
+    a shared limiter the same limits are then also enforced across workers,
+    but only for messages the local buckets let through. Idle buckets expire
+    once they would have refilled anyway.
+    """
+
+    def __init__(
+        self,
+        user: Limit = Limit(RATE_LIMIT_USER_PER_SECOND, RATE_LIMIT_USER_BURST),
+        conversation: Limit = Limit(RATE_LIMIT_CONVERSATION_PER_SECOND, RATE_LIMIT_CONVERSATION_BURST),
+        shared: Optional[RedisRateLimiter] = None,
+        maxsize: int = RATE_LIMIT_BUCKETS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.user = user
+        self.conversation = conversation
+        self.shared = shared
+        self.clock = clock
+        self.stats = RateLimitStats()
+        self._buckets = TTLCache(maxsize=maxsize, ttl=0, clock=clock)
+
+    def _limits(self, user_id: Optional[str], conversation_id: Optional[str]) -> List[Tuple[str, Limit]]:
+        limits = []
+        if user_id is not None and self.user.enabled:
+            limits.append((f"user:{user_id}", self.user))
+        if conversation_id is not None and self.conversation.enabled:
+            limits.append((f"conversation:{conversation_id}", self.conversation))
+        return limits
+
+    def check(self, user_id: Optional[str] = None, conversation_id: Optional[str] = None, cost: int = 1) -> Optional[float]:
+        """Take cost tokens from the local buckets given; None if allowed, else seconds until it would be"""
+        self.stats.checked += 1
+        now = self.clock()
+        limits = self._limits(user_id, conversation_id)
+        buckets = []
+        for key, limit in limits:
+            bucket = self._buckets.get(key, record=False)
+            if bucket is None:
+                bucket = TokenBucket(limit.burst, now)
+            tokens = bucket.refill(limit, now)
+            if tokens < cost:
+                self._throttled(key)
+                return (cost - tokens) / limit.rate
+            buckets.append(bucket)
+        for (key, limit), bucket in zip(limits, buckets):
+            bucket.tokens -= cost
+            self._buckets.set(key, bucket, ttl=limit.idle_seconds)
+        return None
+
+    async def allow(
+        self, user_id: Optional[str] = None, conversation_id: Optional[str] = None, cost: int = 1,
+    ) -> Optional[float]:
+        """Local check, then the shared one if configured; None if allowed, else a retry-after hint"""
+        retry_after = self.check(user_id, conversation_id, cost)
+        if retry_after is not None or self.shared is None:
+            return retry_after
+        limits = self._limits(user_id, conversation_id)
+        if not limits:
+            return None
+        try:
+            refused = await self.shared.take(limits, cost)
+        except Exception:
+            # Fail open: the local buckets still bound this worker
+            self.stats.shared_errors += 1
+            print(traceback.format_exc())
+            return None
+        if not refused:
+            return None
+        self.stats.throttled_shared += 1
+        limit = limits[refused - 1][1]
+        return cost / limit.rate
+
+    def _throttled(self, key: str):
+        if key.startswith("user:"):
+            self.stats.throttled_user += 1
+        else:
+            self.stats.throttled_conversation += 1
+
+    def clear(self):
+        self._buckets.clear()
+
+
+def get_flood_control() -> FloodControl:
+    """Build the limiter selected by RATE_LIMIT_BACKEND ("memory" or "redis")"""
+    if RATE_LIMIT_BACKEND == "redis":
+        return FloodControl(shared=RedisRateLimiter())
+    return FloodControl()
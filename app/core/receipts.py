@@ -0,0 +1,159 @@
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import os
+import traceback
+
+from app.database import run_db, session_scope
+from app.models.conversation_participant import save_receipts
+
+RECEIPT_FLUSH_SECONDS = float(os.getenv("RECEIPT_FLUSH_SECONDS", "1"))
+RECEIPT_PUSH_MS = float(os.getenv("RECEIPT_PUSH_MS", "250"))
+
+DELIVERED = "delivered"
+READ = "read"
+RECEIPT_KINDS = (DELIVERED, READ)
+
+# [delivered, read] high-water marks of one participant in one conversation
+Marks = List[int]
+# conversation_id -> receipts for that conversation, as sent to clients
+PushCallback = Callable[[Dict[str, List[dict]]], Awaitable[None]]
+
+
+def _raise(marks: Dict[str, Marks], key: str, delivered: int, read: int):
+    current = marks.get(key)
+    if current is None:
+        marks[key] = [delivered, read]
+    else:
+        current[0] = max(current[0], delivered)
+        current[1] = max(current[1], read)
+
+
+class ReceiptStats:
+    __slots__ = ("received", "flushes", "rows_written", "pushes")
+
+    def __init__(self):
+        self.received = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.pushes = 0
+
+    def snapshot(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class ReceiptBuffer:
+    """Delivered/read receipts aggregated into per-participant high-water marks.
+
+    A receipt only raises a mark in memory. Every RECEIPT_FLUSH_SECONDS the
+    marks are written with one executemany UPDATE (at most one row per
+    participant and conversation, however many receipts arrived), and every
+    RECEIPT_PUSH_MS they are handed to `push` as one batch for all
+    conversations. A read receipt also counts as delivered.
+    """
+
+    def __init__(self, flush_interval: float = RECEIPT_FLUSH_SECONDS, push_interval: float = RECEIPT_PUSH_MS / 1000):
+        self.flush_interval = flush_interval
+        self.push_interval = push_interval
+        self.stats = ReceiptStats()
+        # user_id -> conversation_id -> marks not yet written
+        self._unflushed: Dict[str, Dict[str, Marks]] = {}
+        # Marks being written right now; still visible to pending_read()
+        self._flushing: Dict[str, Dict[str, Marks]] = {}
+        # conversation_id -> user_id -> marks not yet pushed
+        self._unpushed: Dict[str, Dict[str, Marks]] = {}
+        self._push: Optional[PushCallback] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def started(self) -> bool:
+        return self._task is not None
+
+    def record(self, conversation_id: str, user_id: str, kind: str, seq: int):
+        read = seq if kind == READ else 0
+        self.stats.received += 1
+        _raise(self._unflushed.setdefault(user_id, {}), conversation_id, seq, read)
+        _raise(self._unpushed.setdefault(conversation_id, {}), user_id, seq, read)
+
+    def pending_read(self, user_id: str) -> Dict[str, int]:
+        """Read marks of a user not yet in the DB, so the user's own reads show up immediately"""
+        pending: Dict[str, int] = {}
+        for marks in (self._flushing.get(user_id, {}), self._unflushed.get(user_id, {})):
+            for conversation_id, (_, read) in marks.items():
+                if read > pending.get(conversation_id, 0):
+                    pending[conversation_id] = read
+        return pending
+
+    def start(self, push: PushCallback):
+        self._push = push
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_flush = loop.time() + self.flush_interval
+        while True:
+            await asyncio.sleep(self.push_interval)
+            try:
+                await self.push_pending()
+                if loop.time() >= next_flush:
+                    next_flush = loop.time() + self.flush_interval
+                    await self.flush()
+            except Exception:
+                print(traceback.format_exc())
+
+    async def push_pending(self):
+        pending, self._unpushed = self._unpushed, {}
+        if not pending or self._push is None:
+            return
+        receipts = {
+            conversation_id: [self._receipt(user_id, marks) for user_id, marks in users.items()]
+            for conversation_id, users in pending.items()
+        }
+        self.stats.pushes += 1
+        await self._push(receipts)
+
+    @staticmethod
+    def _receipt(user_id: str, marks: Marks) -> dict:
+        receipt = {"user_id": user_id, "delivered": marks[0]}
+        if marks[1]:
+            receipt["read"] = marks[1]
+        return receipt
+
+    async def flush(self):
+        self._flushing, self._unflushed = self._unflushed, {}
+        rows: List[Tuple[str, str, int, int]] = [
+            (conversation_id, user_id, delivered, read)
+            for user_id, conversations in self._flushing.items()
+            for conversation_id, (delivered, read) in conversations.items()
+        ]
+        try:
+            if rows:
+                await run_db(self._write, rows)
+                self.stats.flushes += 1
+                self.stats.rows_written += len(rows)
+        except Exception:
+            # Keep the marks for the next flush; they only ever move forward
+            for conversation_id, user_id, delivered, read in rows:
+                _raise(self._unflushed.setdefault(user_id, {}), conversation_id, delivered, read)
+            raise
+        finally:
+            self._flushing = {}
+
+    @staticmethod
+    def _write(rows: List[Tuple[str, str, int, int]]):
+        with session_scope() as db:
+            save_receipts(db, rows)
+
+    def snapshot(self) -> dict:
+        snapshot = self.stats.snapshot()
+        snapshot["pending"] = sum(len(conversations) for conversations in self._unflushed.values())
+        return snapshot
@@ -0,0 +1,77 @@
+from bisect import bisect_right
+from typing import List, Optional, Set, Tuple
+import os
+
+from app.core.frames import OutboundFrame
+from app.utils.cache import TTLCache
+
+RECENT_MESSAGES = int(os.getenv("RECENT_MESSAGES", "100"))
+RECENT_CONVERSATIONS = int(os.getenv("RECENT_CONVERSATIONS", "10000"))
+RECENT_TTL = float(os.getenv("RECENT_TTL", "3600"))
+
+
+class RecentMessages:
+    """Ring buffer of the latest broadcasts per conversation, ordered by sequence number.
+
+    Every worker records every broadcast it receives from the bus, so a client
+    can resume on any worker. Frames are kept encoded, so a replay reuses the
+    encodings made for the live broadcast. A conversation's buffer expires
+    RECENT_TTL seconds after its last message.
+    """
+
+    def __init__(self, size: int = RECENT_MESSAGES, maxsize: int = RECENT_CONVERSATIONS, ttl: float = RECENT_TTL):
+        self.size = size
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.replayed = 0
+        self.fallbacks = 0
+
+    def add(self, conversation_id: str, seq: int, frame: OutboundFrame):
+        with self._cache.lock:
+            entries: List[Tuple[int, OutboundFrame]] = self._cache.get(conversation_id, record=False) or []
+            # Workers publish independently, so a broadcast may arrive after a newer one
+            index = bisect_right(entries, seq, key=lambda entry: entry[0])
+            if index and entries[index - 1][0] == seq:
+                return
+            entries.insert(index, (seq, frame))
+            if len(entries) > self.size:
+                del entries[0]
+            self._cache.set(conversation_id, entries)
+
+    def since(self, conversation_id: str, seq: int) -> Optional[List[OutboundFrame]]:
+        """Frames after seq, or None when the buffer cannot prove it holds the whole gap"""
+        with self._cache.lock:
+            entries = self._cache.get(conversation_id, record=False)
+            if not entries or entries[0][0] > seq + 1:
+                self.fallbacks += 1
+                return None
+            missed = entries[bisect_right(entries, seq, key=lambda entry: entry[0]):]
+        # Any hole means a broadcast this worker has not seen (yet)
+        if any(entry[0] != seq + offset for offset, entry in enumerate(missed, 1)):
+            self.fallbacks += 1
+            return None
+        self.replayed += 1
+        return [frame for _, frame in missed]
+
+    def senders(self, conversation_id: str, seq: int) -> Optional[Set[str]]:
+        """Senders of the buffered messages up to seq, or None when the buffer does not reach back that far"""
+        with self._cache.lock:
+            entries = self._cache.get(conversation_id, record=False)
+            if not entries or entries[0][0] > seq:
+                return None
+            return {frame.sender_id for entry_seq, frame in entries if entry_seq <= seq}
+
+    def latest(self, conversation_id: str) -> Optional[int]:
+        """Highest buffered sequence, or None when nothing is buffered for the conversation"""
+        with self._cache.lock:
+            entries = self._cache.get(conversation_id, record=False)
+            return entries[-1][0] if entries else None
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return {
+            "conversations": len(self._cache),
+            "replayed": self.replayed,
+            "fallbacks": self.fallbacks,
+        }
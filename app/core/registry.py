@@ -0,0 +1,106 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+import os
+import threading
+import zlib
+
+from app.core.outbound import Connection
+
+REGISTRY_SHARDS = int(os.getenv("REGISTRY_SHARDS", "16"))
+# Oldest sockets of a user are closed beyond this many devices
+MAX_CONNECTIONS_PER_USER = int(os.getenv("MAX_CONNECTIONS_PER_USER", "10"))
+
+# Close code for a socket pushed out by a newer device of the same user (Policy Violation)
+TOO_MANY_DEVICES_CLOSE_CODE = 1008
+
+
+class _Shard:
+    __slots__ = ("lock", "users", "connections")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # user_id -> that user's sockets, oldest first; tuples are replaced, never mutated
+        self.users: Dict[str, Tuple[Connection, ...]] = {}
+        self.connections = 0
+
+
+class ConnectionRegistry:
+    """Every socket on this worker, several per user, sharded by user.
+
+    Lookups on the event loop (fanout) read a shard's dict without locking:
+    each user maps to an immutable tuple that connect/disconnect replace
+    whole. Connect and disconnect take only their shard's lock, and snapshots
+    taken from other threads (metrics scrapes) lock one shard at a time, so
+    a reconnect storm on some users never stalls lookups for the rest.
+    """
+
+    def __init__(self, shards: int = REGISTRY_SHARDS, max_per_user: int = MAX_CONNECTIONS_PER_USER):
+        self._shards = tuple(_Shard() for _ in range(max(1, shards)))
+        self.max_per_user = max_per_user
+
+    def _shard(self, user_id: str) -> _Shard:
+        # Stable across processes, unlike hash() of a str
+        return self._shards[zlib.crc32(user_id.encode()) % len(self._shards)]
+
+    def add(self, connection: Connection) -> Tuple[bool, List[Connection]]:
+        """Register a socket; returns whether it is the user's first, and the sockets it pushed out"""
+        shard = self._shard(connection.user_id)
+        with shard.lock:
+            current = shard.users.get(connection.user_id, ())
+            connections = current + (connection,)
+            evicted = list(connections[:-self.max_per_user]) if len(connections) > self.max_per_user else []
+            if evicted:
+                connections = connections[len(evicted):]
+            shard.users[connection.user_id] = connections
+            shard.connections += 1 - len(evicted)
+        return not current, evicted
+
+    def remove(self, connection: Connection) -> Optional[bool]:
+        """Forget a socket; returns whether it was the user's last, or None if it was not registered"""
+        shard = self._shard(connection.user_id)
+        with shard.lock:
+            current = shard.users.get(connection.user_id, ())
+            if connection not in current:
+                return None
+            remaining = tuple(item for item in current if item is not connection)
+            if remaining:
+                shard.users[connection.user_id] = remaining
+            else:
+                del shard.users[connection.user_id]
+            shard.connections -= 1
+        return not remaining
+
+    def get(self, user_id: str) -> Tuple[Connection, ...]:
+        """The user's sockets on this worker; empty when offline here"""
+        return self._shard(user_id).users.get(user_id, ())
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._shard(user_id).users
+
+    def __len__(self) -> int:
+        return sum(shard.connections for shard in self._shards)
+
+    def user_count(self) -> int:
+        return sum(len(shard.users) for shard in self._shards)
+
+    def connections(self) -> Iterator[Connection]:
+        """Every socket, one shard snapshot at a time; safe from other threads"""
+        for shard in self._shards:
+            with shard.lock:
+                groups = list(shard.users.values())
+            for connections in groups:
+                yield from connections
+
+    def clear(self):
+        for shard in self._shards:
+            with shard.lock:
+                shard.users = {}
+                shard.connections = 0
+
+    def stats(self) -> dict:
+        users = [len(shard.users) for shard in self._shards]
+        return {
+            "connections": len(self),
+            "users": sum(users),
+            "shards": len(self._shards),
+            "shard_users_max": max(users),
+        }
@@ -0,0 +1,102 @@
+from typing import Any, Callable, List, Optional
+import asyncio
+import math
+import os
+import traceback
+
+TIMER_TICK_SECONDS = float(os.getenv("TIMER_TICK_SECONDS", "1"))
+TIMER_WHEEL_SLOTS = int(os.getenv("TIMER_WHEEL_SLOTS", "512"))
+
+
+class Timer:
+    """A callback due on some tick of a TimerWheel; cancel() is O(1)"""
+
+    __slots__ = ("rounds", "callback", "argument", "cancelled")
+
+    def __init__(self, rounds: int, callback: Callable[[Any], None], argument: Any):
+        self.rounds = rounds
+        self.callback = callback
+        self.argument = argument
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+        # Drop references now; the slot forgets the timer when it comes round
+        self.callback = self.argument = None
+
+
+class TimerWheel:
+    """Hashed timing wheel: one task drives every coarse timer of the worker.
+
+    Scheduling and cancelling are O(1), and a tick only touches the timers in
+    one slot, so 100k per-connection timers cost one small object each
+    instead of a sleeping task each. Timers fire on the first tick at or after
+    their delay, so precision is TIMER_TICK_SECONDS. Callbacks run on the
+    event loop and must not block.
+    """
+
+    def __init__(self, tick: float = TIMER_TICK_SECONDS, slots: int = TIMER_WHEEL_SLOTS):
+        self.tick = tick
+        self._slots: List[List[Timer]] = [[] for _ in range(slots)]
+        self._cursor = 0
+        self._task: Optional[asyncio.Task] = None
+        self.fired = 0
+
+    @property
+    def started(self) -> bool:
+        return self._task is not None
+
+    def __len__(self) -> int:
+        return sum(len(slot) for slot in self._slots)
+
+    def schedule(self, delay: float, callback: Callable[[Any], None], argument: Any = None) -> Timer:
+        ticks = max(1, math.ceil(delay / self.tick))
+        rounds, offset = divmod(ticks - 1, len(self._slots))
+        timer = Timer(rounds, callback, argument)
+        self._slots[(self._cursor + offset + 1) % len(self._slots)].append(timer)
+        return timer
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time() + self.tick
+        while True:
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+            # Catch up on ticks missed while the loop was busy
+            while loop.time() >= next_tick:
+                next_tick += self.tick
+                self.advance()
+
+    def advance(self):
+        """Move to the next slot and fire its due timers"""
+        self._cursor = (self._cursor + 1) % len(self._slots)
+        slot = self._slots[self._cursor]
+        if not slot:
+            return
+        # Callbacks may schedule into this very slot; those go to the fresh list
+        self._slots[self._cursor] = []
+        pending = []
+        for timer in slot:
+            if timer.cancelled:
+                continue
+            if timer.rounds:
+                timer.rounds -= 1
+                pending.append(timer)
+                continue
+            self.fired += 1
+            try:
+                timer.callback(timer.argument)
+            except Exception:
+                print(traceback.format_exc())
+        self._slots[self._cursor].extend(pending)
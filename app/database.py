@@ -1,7 +1,16 @@
-from typing import Generator
+from typing import Any, Callable, Generator, Iterator, List, Optional, TypeVar
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar, copy_context
+from contextlib import contextmanager
+from functools import partial
+import asyncio
 import os
+import threading
+import time
 import urllib.parse
 
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from sqlmodel import SQLModel, create_engine, Session
 from dotenv import load_dotenv
 # Load environment variables
@@ -10,17 +19,27 @@ load_dotenv()
 # Check if we should use SQLite instead of MySQL
 USE_SQLITE = os.getenv("USE_SQLITE", "false").lower() in ("true", "1", "yes")
 
+# Connection pool tuning, shared by both backends
+POOL_OPTIONS = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() in ("true", "1", "yes"),
+}
+
 if USE_SQLITE:
     # Use SQLite for development/testing
     # Create data directory if it doesn't exist
     os.makedirs("./data", exist_ok=True)
-    
+
     # SQLite connection string (file-based for persistence)
     SQLALCHEMY_DATABASE_URL = "sqlite:///./data/rumr.db"
     # SQLite requires connect_args for multiple threads
     engine = create_engine(
-        SQLALCHEMY_DATABASE_URL, 
-        connect_args={"check_same_thread": False}
+        SQLALCHEMY_DATABASE_URL,
+        connect_args={"check_same_thread": False},
+        **POOL_OPTIONS
     )
     print("Using SQLite database")
 else:
@@ -37,7 +56,7 @@ else:
 
     # SQLModel setup with properly encoded connection string
     SQLALCHEMY_DATABASE_URL = f"mysql+pymysql://{encoded_user}:{encoded_password}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    engine = create_engine(SQLALCHEMY_DATABASE_URL, **POOL_OPTIONS)
     print(f"Using MySQL database: {SQLALCHEMY_DATABASE_URL}")
 
 # Database dependency for FastAPI endpoints
@@ -45,6 +64,113 @@ def get_db() -> Generator[Session, None, None]:
     with Session(engine) as session:
         yield session
 
+# Blocking database work is offloaded to a bounded pool so a slow query on
+# one socket never stalls the event loop serving every other socket
+DB_THREADPOOL_SIZE = int(os.getenv("DB_THREADPOOL_SIZE", "8"))
+db_executor = ThreadPoolExecutor(max_workers=DB_THREADPOOL_SIZE, thread_name_prefix="rumr-db")
+
+T = TypeVar("T")
+
+async def run_db(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a synchronous database call on the DB thread pool and await its result"""
+    loop = asyncio.get_running_loop()
+    # Carry context variables (e.g. the per-frame query counter) into the worker thread
+    context = copy_context()
+    return await loop.run_in_executor(db_executor, partial(context.run, fn, *args, **kwargs))
+
+
+class PoolCheckoutStats:
+    """Running totals of how long sessions waited for a pooled connection"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait: float):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "wait_seconds_total": self.total_wait,
+                "wait_seconds_avg": self.total_wait / self.checkouts if self.checkouts else 0.0,
+                "wait_seconds_max": self.max_wait,
+            }
+
+
+pool_checkout_stats = PoolCheckoutStats()
+
+
+class QueryCounter:
+    """Statements executed by this process, across every engine"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def increment(self):
+        with self._lock:
+            self.count += 1
+
+
+query_counter = QueryCounter()
+
+# Set while an inbound frame is being processed; holds that frame's statement count
+frame_queries: ContextVar[Optional[List[int]]] = ContextVar("frame_queries", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_query(*_):
+    query_counter.increment()
+    counter = frame_queries.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+def open_session() -> Session:
+    """Open a session and check out its connection up front, timing the wait"""
+    session = Session(engine, expire_on_commit=False)
+    started = time.perf_counter()
+    try:
+        session.connection()
+    except Exception:
+        session.close()
+        raise
+    pool_checkout_stats.record(time.perf_counter() - started)
+    return session
+
+
+@contextmanager
+def session_scope() -> Iterator[Session]:
+    """Short-lived session for blocking code that already runs off the event loop.
+
+    Sessions are scoped to one DB call (usually one run_db job), not to an
+    inbound frame or a socket, so a connection is held only while a query runs.
+    """
+    session = open_session()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def pool_status() -> dict:
+    """Current pool occupancy plus checkout wait statistics"""
+    pool = engine.pool
+    status = {"pool": pool.__class__.__name__}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        if hasattr(pool, name):
+            status[name] = getattr(pool, name)()
+    status.update(pool_checkout_stats.snapshot())
+    status["queries"] = query_counter.count
+    return status
+
 # Create tables
 def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
\ No newline at end of file
+    SQLModel.metadata.create_all(engine)
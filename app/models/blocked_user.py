@@ -2,6 +2,7 @@ from sqlmodel import SQLModel, Field
 from typing import Optional
 from datetime import datetime, timezone
 import uuid
+from sqlalchemy import Index, and_, or_
 from sqlmodel import Session, select
 
 # Helper function to check if one user has blocked another
@@ -15,10 +16,25 @@ def check_block_status(db: Session, blocker_id: str, blocked_id: str) -> bool:
     ).first()
     return block is not None
 
+def check_block_either_way(db: Session, user_a: str, user_b: str) -> bool:
+    """Check if either user has blocked the other, in one query served by the composite index"""
+    block = db.exec(
+        select(BlockedUser.id).where(
+            or_(
+                and_(BlockedUser.blocker_id == user_a, BlockedUser.blocked_id == user_b),
+                and_(BlockedUser.blocker_id == user_b, BlockedUser.blocked_id == user_a)
+            )
+        ).limit(1)
+    ).first()
+    return block is not None
+
 class BlockedUser(SQLModel, table=True):
     __tablename__ = "blocked_users"  # Table name as requested
+    __table_args__ = (
+        Index("ix_blocked_users_blocker_blocked", "blocker_id", "blocked_id"),
+    )
 
     id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True)
     blocker_id: Optional[str] = Field(default=None, foreign_key="user_rumr_app.UserID")
     blocked_id: Optional[str] = Field(default=None, foreign_key="user_rumr_app.UserID")
-    blocked_date: Optional[datetime] = Field(default_factory=lambda: datetime.now(timezone.utc))
\ No newline at end of file
+    blocked_date: Optional[datetime] = Field(default_factory=lambda: datetime.now(timezone.utc))
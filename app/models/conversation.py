@@ -12,4 +12,12 @@ class Conversation(SQLModel, table=True):
     name: Optional[str] = Field(default=None, max_length=255)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), nullable=False)
     user_id: str = Field(nullable=False,foreign_key="user_rumr_app.UserID")
-    group_image: Optional[str] = Field(default=None, max_length=255)
\ No newline at end of file
+    group_image: Optional[str] = Field(default=None, max_length=255)
+    # Sequence number of the newest message; see app.models.message.assign_sequences
+    last_seq: Optional[int] = Field(default=0)
+    # Summary of the newest message, kept current by save_messages for the conversation list
+    last_message_id: Optional[str] = Field(default=None, max_length=255)
+    last_message_at: Optional[datetime] = Field(default=None)
+    last_message_sender_id: Optional[str] = Field(default=None, max_length=255)
+    last_message_type: Optional[str] = Field(default=None, max_length=255)
+    last_message_preview: Optional[str] = Field(default=None, max_length=255)
\ No newline at end of file
@@ -1,7 +1,11 @@
 from sqlmodel import SQLModel, Field
-from typing import Optional
+from typing import Iterable, List, Optional, Tuple
 from datetime import datetime, timezone
 import uuid
+from sqlalchemy import Index, bindparam, case, func, or_
+from sqlmodel import Session, select, update
+
+from app.models.conversation import Conversation
 
 
 class ConversationParticipant(SQLModel, table=True):
@@ -14,4 +18,106 @@ class ConversationParticipant(SQLModel, table=True):
     deleted: Optional[bool] = Field(default=False)
     deleted_at: Optional[datetime] = Field(default=None)
     is_conversation_mute: Optional[bool] = Field(default=False)
-    is_conversation_pin: Optional[bool] = Field(default=False)
\ No newline at end of file
+    is_conversation_pin: Optional[bool] = Field(default=False)
+    # Highest sequence this participant has read; unread = Conversation.last_seq - last_read_seq
+    last_read_seq: Optional[int] = Field(default=0)
+    # Highest sequence delivered to one of this participant's devices
+    last_delivered_seq: Optional[int] = Field(default=0)
+
+    __table_args__ = (
+        Index("ix_participants_user", "user_id", "deleted"),
+        Index("ix_participants_conversation_user", "conversation_id", "user_id"),
+    )
+
+
+def mark_read(db: Session, conversation_id: str, user_id: str, seq: int, commit: bool = True) -> None:
+    """Move a participant's read marker forward to seq (capped at the conversation's last_seq)"""
+    last_seq = select(Conversation.last_seq).where(Conversation.id == conversation_id).scalar_subquery()
+    db.exec(
+        update(ConversationParticipant)
+        .where(
+            ConversationParticipant.conversation_id == conversation_id,
+            ConversationParticipant.user_id == user_id,
+            or_(ConversationParticipant.last_read_seq == None, ConversationParticipant.last_read_seq < seq),
+        )
+        .values(last_read_seq=case((last_seq < seq, last_seq), else_=seq))
+    )
+    if commit:
+        db.commit()
+
+
+def save_receipts(db: Session, marks: Iterable[Tuple[str, str, int, int]]) -> None:
+    """Raise (conversation_id, user_id, delivered, read) high-water marks in one executemany UPDATE.
+
+    Marks only move forward and never past the conversation's last_seq.
+    """
+    params = [
+        {"b_conversation_id": conversation_id, "b_user_id": user_id, "b_delivered": delivered, "b_read": read}
+        for conversation_id, user_id, delivered, read in marks
+    ]
+    if not params:
+        return
+    table = ConversationParticipant.__table__
+    # A conversation without a last_seq has no messages, so nothing can be delivered or read
+    last_seq = func.coalesce(
+        select(Conversation.last_seq).where(Conversation.id == bindparam("b_conversation_id")).scalar_subquery(), 0
+    )
+
+    def forward(column, name: str):
+        capped = case((last_seq < bindparam(name), last_seq), else_=bindparam(name))
+        return case((func.coalesce(column, 0) < capped, capped), else_=column)
+
+    # Core table rather than the entity: a list of params would be an ORM bulk update by primary key
+    db.exec(
+        update(table)
+        .where(table.c.conversation_id == bindparam("b_conversation_id"), table.c.user_id == bindparam("b_user_id"))
+        .values(
+            last_delivered_seq=forward(table.c.last_delivered_seq, "b_delivered"),
+            last_read_seq=forward(table.c.last_read_seq, "b_read"),
+        ),
+        params=params,
+    )
+    db.commit()
+
+
+def load_conversation_list(db: Session, user_id: str, limit: int) -> List[dict]:
+    """Every conversation of a user with its summary and unread count, in one query.
+
+    Pinned conversations come first, then unmuted before muted, each by the
+    time of their last message. The user's rows are found through
+    ix_participants_user and each conversation by primary key; nothing
+    touches messages_rumr_app.
+    """
+    rows = db.exec(
+        select(Conversation, ConversationParticipant)
+        .join(ConversationParticipant, ConversationParticipant.conversation_id == Conversation.id)
+        .where(ConversationParticipant.user_id == user_id, ConversationParticipant.deleted == False)
+        .order_by(
+            ConversationParticipant.is_conversation_pin.desc(),
+            ConversationParticipant.is_conversation_mute.asc(),
+            Conversation.last_message_at.desc(),
+        )
+        .limit(limit)
+    ).all()
+    conversations = []
+    for conversation, participant in rows:
+        last_seq = conversation.last_seq or 0
+        conversations.append({
+            "conversation_id": conversation.id,
+            "name": conversation.name,
+            "conversation_type": conversation.conversation_type,
+            "group_image": conversation.group_image,
+            "is_pinned": bool(participant.is_conversation_pin),
+            "is_muted": bool(participant.is_conversation_mute),
+            "last_seq": last_seq,
+            "last_read_seq": participant.last_read_seq or 0,
+            "unread_count": max(0, last_seq - (participant.last_read_seq or 0)),
+            "last_message": {
+                "id": conversation.last_message_id,
+                "sender_id": conversation.last_message_sender_id,
+                "type": conversation.last_message_type,
+                "preview": conversation.last_message_preview,
+                "created_at": conversation.last_message_at,
+            } if conversation.last_message_id else None,
+        })
+    return conversations
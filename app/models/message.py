@@ -1,9 +1,14 @@
 from sqlmodel import SQLModel, Field
-from typing import Optional
+from typing import List, Optional, Tuple
 from datetime import datetime
+from collections import Counter
 import uuid
 from datetime import datetime, timezone
-from sqlmodel import Session, select
+from sqlalchemy import Index, or_, tuple_
+from sqlmodel import Session, func, insert, select, update
+
+from app.models.conversation import Conversation
+from app.models.conversation_participant import mark_read
 
 
 
@@ -18,6 +23,18 @@ class Message(SQLModel, table=True):
     status: bool = Field(nullable=False)  # MySQL BIT(1) maps to boolean
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), nullable=False)
     image_key: Optional[str] = Field(default=None, max_length=255)
+    # Position within the conversation, assigned when the message is committed
+    seq: Optional[int] = Field(default=None)
+    # Chosen by the sending client so a retried send is stored once
+    client_message_id: Optional[str] = Field(default=None, max_length=64)
+
+    __table_args__ = (
+        Index("ix_messages_conversation_seq", "conversation_id", "seq"),
+        # Scoped to the sender, so one client cannot claim another's ids; NULLs never collide
+        Index("ux_messages_sender_client_id", "sender_id", "client_message_id", unique=True),
+        # Serves keyset-paginated history in either direction
+        Index("ix_messages_conversation_created_id", "conversation_id", "created_at", "id"),
+    )
 
 
 def save_message(db: Session, conversation_id: str, sender_id: str, content: str, msg_type: str = "text") -> Message:
@@ -36,3 +53,126 @@ def save_message(db: Session, conversation_id: str, sender_id: str, content: str
     # Removed db.refresh(message) here
     db.refresh(message)
     return message
+
+
+def build_message(
+    conversation_id: str, sender_id: str, content: str, msg_type: str = "text",
+    client_message_id: Optional[str] = None,
+) -> Message:
+    """Create an unsaved message; id and created_at are assigned here so no refresh is needed after insert"""
+    return Message(
+        conversation_id=conversation_id,
+        sender_id=sender_id,
+        content=content,
+        type=msg_type,
+        status=True,
+        created_at=datetime.now(timezone.utc),
+        client_message_id=client_message_id,
+    )
+
+
+def load_by_client_ids(db: Session, keys: List[Tuple[str, str]]) -> List[Message]:
+    """Stored messages for (sender_id, client_message_id) pairs, via ux_messages_sender_client_id"""
+    if not keys:
+        return []
+    return list(db.exec(
+        select(Message).where(tuple_(Message.sender_id, Message.client_message_id).in_(keys))
+    ).all())
+
+
+# Characters of the newest message kept on the conversation for the conversation list
+LAST_MESSAGE_PREVIEW_CHARS = 255
+
+
+def assign_sequences(db: Session, messages: List[Message]) -> None:
+    """Number messages per conversation from Conversation.last_seq, inside the caller's transaction.
+
+    The same UPDATE refreshes the conversation's last-message summary. It
+    row-locks each conversation until commit, so workers saving to the same
+    conversation concurrently get disjoint ranges, and the summary always
+    describes the highest sequence. Conversations are locked in id order to
+    avoid deadlocks between batches.
+    """
+    counts = Counter(message.conversation_id for message in messages)
+    newest = {message.conversation_id: message for message in messages}
+    next_seq = {}
+    for conversation_id in sorted(counts):
+        last = newest[conversation_id]
+        db.exec(
+            update(Conversation)
+            .where(Conversation.id == conversation_id)
+            .values(
+                last_seq=func.coalesce(Conversation.last_seq, 0) + counts[conversation_id],
+                last_message_id=last.id,
+                last_message_at=last.created_at,
+                last_message_sender_id=last.sender_id,
+                last_message_type=last.type,
+                last_message_preview=last.content[:LAST_MESSAGE_PREVIEW_CHARS],
+            )
+        )
+        last_seq = db.exec(select(Conversation.last_seq).where(Conversation.id == conversation_id)).first()
+        if last_seq is not None:
+            next_seq[conversation_id] = last_seq - counts[conversation_id] + 1
+    for message in messages:
+        seq = next_seq.get(message.conversation_id)
+        if seq is not None:
+            message.seq = seq
+            next_seq[message.conversation_id] = seq + 1
+
+
+def save_messages(db: Session, messages: List[Message]) -> None:
+    """Insert a batch of messages with one multi-row INSERT and a single commit"""
+    assign_sequences(db, messages)
+    db.exec(insert(Message), params=[message.model_dump() for message in messages])
+    # Senders have read their conversation up to their own newest message
+    read_up_to = {}
+    for message in messages:
+        if message.seq is not None:
+            read_up_to[(message.conversation_id, message.sender_id)] = message.seq
+    for (conversation_id, sender_id), seq in sorted(read_up_to.items()):
+        mark_read(db, conversation_id, sender_id, seq, commit=False)
+    db.commit()
+
+
+def load_messages_after(db: Session, conversation_id: str, seq: int, limit: int) -> List[Message]:
+    """Messages of a conversation with a sequence above seq, oldest first"""
+    return list(db.exec(
+        select(Message)
+        .where(Message.conversation_id == conversation_id, Message.seq > seq)
+        .order_by(Message.seq)
+        .limit(limit)
+    ).all())
+
+
+
+def load_history_page(
+    db: Session,
+    conversation_id: str,
+    limit: int,
+    before: Optional[Tuple[datetime, str]] = None,
+    after: Optional[Tuple[datetime, str]] = None,
+) -> List[Message]:
+    """One page of a conversation keyed on (created_at, id), never OFFSET.
+
+    Newest first, starting below the `before` key; with `after`, oldest
+    first from above that key. Either way the scan starts at a seek into
+    ix_messages_conversation_created_id, so the cost of a page does not
+    depend on how deep it is.
+    """
+    query = select(Message).where(Message.conversation_id == conversation_id)
+    if after is not None:
+        created_at, message_id = after
+        # The inclusive bound on created_at is what lets the index seek; the OR only trims ties
+        query = query.where(
+            Message.created_at >= created_at,
+            or_(Message.created_at > created_at, Message.id > message_id),
+        ).order_by(Message.created_at, Message.id)
+    else:
+        if before is not None:
+            created_at, message_id = before
+            query = query.where(
+                Message.created_at <= created_at,
+                or_(Message.created_at < created_at, Message.id < message_id),
+            )
+        query = query.order_by(Message.created_at.desc(), Message.id.desc())
+    return list(db.exec(query.limit(limit)).all())
@@ -13,6 +13,7 @@ class MessageResponse(SQLModel):
     content: Optional[str] = None
     type: Optional[str] = None
     status: Optional[int] = 1
+    seq: Optional[int] = None
     
     # User profile information
     PhoneNumber: Optional[str] = None
@@ -1,5 +1,5 @@
-from sqlmodel import SQLModel, Field
-from typing import Optional
+from sqlmodel import SQLModel, Field, Session, update
+from typing import Iterable, Optional, Tuple
 from datetime import datetime
 import uuid
 from datetime import datetime, timezone
@@ -24,4 +24,16 @@ class User(SQLModel, table=True):
     is_user_online: Optional[int] = Field(default=None)
     is_verified: Optional[bool] = Field(default=False)
     isBlocked: Optional[bool] = Field(default=False)
-    last_seen_visibility: Optional[bool] = Field(default=True)
\ No newline at end of file
+    last_seen_visibility: Optional[bool] = Field(default=True)
+
+
+def save_presence(db: Session, changes: Iterable[Tuple[str, bool, datetime]]):
+    """Write is_user_online/last_seen for many users in one executemany UPDATE"""
+    params = [
+        {"UserID": user_id, "is_user_online": int(online), "last_seen": last_seen}
+        for user_id, online, last_seen in changes
+    ]
+    if params:
+        # ORM bulk UPDATE by primary key
+        db.exec(update(User), params=params)
+        db.commit()
@@ -0,0 +1,33 @@
+from fastapi import APIRouter, Query
+from typing import List
+import os
+
+from app.database import run_db, session_scope
+from app.routers.websocket import manager
+from app.models.conversation_participant import load_conversation_list
+
+router = APIRouter()
+
+CONVERSATION_LIST_LIMIT = int(os.getenv("CONVERSATION_LIST_LIMIT", "500"))
+
+
+def _load_list(user_id: str, limit: int) -> List[dict]:
+    with session_scope() as db:
+        return load_conversation_list(db, user_id, limit)
+
+
+@router.get("")
+async def conversation_list(
+    user_id: str,
+    limit: int = Query(CONVERSATION_LIST_LIMIT, ge=1, le=CONVERSATION_LIST_LIMIT),
+):
+    """A user's conversations with last-message summary and unread count, pinned first, muted last"""
+    conversations = await run_db(_load_list, user_id, limit)
+    # Read receipts still buffered on this worker
+    pending = manager.receipts.pending_read(user_id)
+    for item in conversations:
+        read = min(pending.get(item["conversation_id"], 0), item["last_seq"])
+        if read > item["last_read_seq"]:
+            item["last_read_seq"] = read
+            item["unread_count"] = item["last_seq"] - read
+    return conversations
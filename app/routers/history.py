@@ -0,0 +1,75 @@
+from fastapi import APIRouter, HTTPException, Query
+from typing import List, Optional, Tuple
+from datetime import datetime
+import base64
+import binascii
+import os
+
+from app.database import run_db, session_scope
+from app.models.message import Message, load_history_page
+from app.routers.websocket import manager
+
+router = APIRouter()
+
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "200"))
+
+
+def encode_cursor(message: Message) -> str:
+    """Opaque cursor for the (created_at, id) key of a message"""
+    key = f"{message.created_at.isoformat()}|{message.id}"
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        key = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, message_id = key.split("|", 1)
+        return datetime.fromisoformat(created_at), message_id
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _load_page(conversation_id: str, limit: int, before, after) -> List[Message]:
+    with session_scope() as db:
+        return load_history_page(db, conversation_id, limit, before, after)
+
+
+@router.get("/{conversation_id}/messages")
+async def message_history(
+    conversation_id: str,
+    user_id: str,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+):
+    """Page through a conversation's messages, newest first.
+
+    Pass next_cursor back as `before` for older messages, or a message's cursor
+    as `after` to page forward (oldest first). Sender profiles are returned once
+    per page under "profiles" instead of on every message.
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Pass either before or after, not both")
+    conversation = await manager.membership.get(conversation_id)
+    if conversation is None or user_id not in conversation.members:
+        raise HTTPException(status_code=403, detail="Not a participant in this conversation")
+
+    # One extra row tells whether another page exists without a COUNT
+    messages = await run_db(
+        _load_page, conversation_id, limit + 1,
+        decode_cursor(before) if before else None,
+        decode_cursor(after) if after else None,
+    )
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+
+    profiles = {}
+    for message in messages:
+        if message.sender_id not in profiles:
+            profiles[message.sender_id] = await manager.profiles.get(message.sender_id)
+    return {
+        "messages": [message.model_dump() for message in messages],
+        "profiles": profiles,
+        "next_cursor": encode_cursor(messages[-1]) if has_more else None,
+    }
@@ -1,78 +1,370 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-from typing import Dict, List
-from sqlmodel import Session, select
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from typing import Dict, List, Optional, Union
+from sqlmodel import Session
+import asyncio
 import json
-from datetime import datetime, timezone
+import os
+import traceback
 
-from app.database import get_db
-from app.models.message import Message,save_message
-from app.models.conversation import Conversation
-from app.models.conversation_participant import ConversationParticipant
-from app.models.blocked_user import BlockedUser, check_block_status
+from app.models.message import Message, build_message
 from app.core.connection_manager import ConnectionManager
+from app.core.dedup import valid_client_message_id
+from app.core.events import EPHEMERAL_EVENT_TYPES
+from app.core.frames import FrameDecodeError, negotiate
+from app.core.message_writer import DuplicateMessage
+from app.core.metrics import FrameTimer
+from app.core.receipts import RECEIPT_KINDS
 router = APIRouter()
 
+# Feature flag: broadcasts carry only sender_id, profiles arrive as separate frames
+PROFILE_INTERNING = "profiles"
+# Feature flag: broadcasts arriving close together share one {"messages": [...]} frame
+COALESCING = "batch"
+# Feature flag: the server pings quiet sockets and disconnects silent ones
+HEARTBEAT = "heartbeat"
+
+# Most messages accepted in one {"messages": [...]} inbound frame
+MAX_BATCH_MESSAGES = int(os.getenv("MAX_BATCH_MESSAGES", "100"))
+
 
 # Track all connections with an instance of the manager
 manager = ConnectionManager()
 
 
+async def authorize_sender(conversation_id: str, user_id: str, db: Optional[Session] = None) -> Optional[str]:
+    """Return an error message if user_id may not post to the conversation, else None"""
+    # Verify conversation exists and user is a participant (cached membership)
+    conversation = await manager.membership.get(conversation_id, db)
+    if conversation is None or user_id not in conversation.members:
+        return "Not a participant in this conversation"
+    # Check for blocks between users, in either direction (cached)
+    if await manager.blocks.is_blocked(user_id, conversation.owner_id, db):
+        return "You are blocked by the conversation owner or you have blocked them"
+    return None
+
+
+def rate_limited(retry_after: float, **extra) -> dict:
+    return {"status": "error", "message": "Rate limit exceeded", "retry_after": round(retry_after, 3), **extra}
+
+
+def ack_fields(message: Message, **extra) -> dict:
+    fields = {
+        "id": message.id,
+        "conversation_id": message.conversation_id,
+        "created_at": message.created_at.isoformat(),
+        "seq": message.seq,
+    }
+    if message.client_message_id is not None:
+        fields["client_message_id"] = message.client_message_id
+    fields.update(extra)
+    return fields
+
+
+async def replayed(earlier) -> Optional[Message]:
+    """The message stored by an earlier attempt of the same send, None if that attempt failed"""
+    # Shielded: a replay whose socket goes away must not cancel the first attempt's future
+    return await asyncio.shield(earlier)
+
+
+async def handle_batch(connection, user_id: str, items: list, timer: FrameTimer):
+    """Process a {"messages": [...]} frame with one authorization per conversation,
+    one insert and one commit; acks come back together, errors carry the item index"""
+    if not isinstance(items, list) or len(items) > MAX_BATCH_MESSAGES:
+        connection.send_json({
+            "status": "error",
+            "message": f"A batch must be a list of at most {MAX_BATCH_MESSAGES} messages"
+        })
+        return
+
+    authorized: Dict[str, Optional[str]] = {}
+    accepted: List[tuple] = []
+    replays: List[tuple] = []
+    acks = []
+    saved: List[Message] = []
+    # client_message_id -> stored message, for every claim this frame made; settled however it ends
+    claims: Dict[str, Optional[Message]] = {}
+    try:
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                connection.send_json({"status": "error", "message": "Invalid message", "index": index})
+                continue
+            client_message_id = item.get("client_message_id")
+            if client_message_id is not None and not valid_client_message_id(client_message_id):
+                connection.send_json({"status": "error", "message": "Invalid client_message_id", "index": index})
+                continue
+            conversation_id = item.get("conversation_id")
+            retry_after = await manager.flood.allow(user_id=user_id)
+            if retry_after is not None:
+                connection.send_json(rate_limited(retry_after, index=index))
+                continue
+            if conversation_id not in authorized:
+                authorized[conversation_id] = await authorize_sender(conversation_id, user_id)
+            error = authorized[conversation_id]
+            if error:
+                connection.send_json({"status": "error", "message": error, "index": index})
+                continue
+            # Only members draw on the conversation's budget
+            retry_after = await manager.flood.allow(conversation_id=conversation_id)
+            if retry_after is not None:
+                connection.send_json(rate_limited(retry_after, index=index))
+                continue
+            if client_message_id is not None:
+                earlier = manager.dedup.claim(user_id, client_message_id)
+                if earlier is not None:
+                    replays.append((index, earlier))
+                    continue
+                claims[client_message_id] = None
+            accepted.append((index, build_message(
+                conversation_id, user_id, item.get("content", ""), item.get("type", "text"), client_message_id
+            )))
+        timer.mark("authorize")
+        if not accepted and not replays:
+            return
+
+        results = []
+        if accepted:
+            try:
+                results = await manager.writer.save_many([message for _, message in accepted])
+            except Exception:
+                print(traceback.format_exc())
+                results = [Exception("Message could not be saved")] * len(accepted)
+        timer.mark("save")
+
+        for (index, message), error in zip(accepted, results):
+            if isinstance(error, DuplicateMessage):
+                stored = error.message
+            else:
+                stored = message if error is None else None
+            if message.client_message_id is not None:
+                claims[message.client_message_id] = stored
+            if stored is None:
+                connection.send_json({"status": "error", "message": "Message could not be saved", "index": index})
+                continue
+            if stored is not message:
+                acks.append({"index": index, **ack_fields(stored, duplicate=True)})
+                continue
+            acks.append({"index": index, **ack_fields(message)})
+            saved.append(message)
+    finally:
+        # Also when cancelled or failing midway, so replays waiting on a claim are released
+        for client_message_id, stored in claims.items():
+            manager.dedup.settle(user_id, client_message_id, stored)
+    # Replays of sends already stored (or in this very batch) are re-acked, never broadcast again
+    for index, earlier in replays:
+        stored = await replayed(earlier)
+        if stored is None:
+            connection.send_json({"status": "error", "message": "Message could not be saved", "index": index})
+            continue
+        acks.append({"index": index, **ack_fields(stored, duplicate=True)})
+    if acks:
+        acks.sort(key=lambda ack: ack["index"])
+        connection.send_json({"status": "ack", "messages": acks})
+
+    for message in saved:
+        response, recipients = await manager.prepare_broadcast({
+            "id": message.id,
+            "sender_id": user_id,
+            "content": message.content,
+            "type": message.type,
+            "created_at": message.created_at.isoformat(),
+            "conversation_id": message.conversation_id,
+            "seq": message.seq
+        }, message.conversation_id, user_id)
+        await manager.fanout(response.model_dump(), recipients, message.conversation_id)
+    timer.mark("fanout")
+
+
+def parse_positions(value) -> Dict[str, int]:
+    """Last-seen sequences from "conv1:42,conv2:17" or {"conv1": 42}; bad entries are ignored"""
+    if isinstance(value, str):
+        value = dict(item.rpartition(":")[::2] for item in value.split(",") if ":" in item)
+    if not isinstance(value, dict):
+        return {}
+    positions = {}
+    for conversation_id, seq in value.items():
+        try:
+            positions[str(conversation_id)] = int(seq)
+        except (TypeError, ValueError):
+            continue
+    return positions
+
+
+async def handle_receipt(connection, user_id: str, kind: str, marker) -> None:
+    """Record a {"delivered"|"read": {"conversation_id": ..., "seq": ...}} receipt.
+
+    Receipts only raise in-memory high-water marks; the DB and the senders
+    get them in batches (see ReceiptBuffer). A seq past the conversation's
+    latest message is clamped to it.
+    """
+    seq = marker.get("seq") if isinstance(marker, dict) else None
+    # bool is an int subclass; true must not pass as sequence 1
+    if not isinstance(seq, int) or isinstance(seq, bool) or seq < 0:
+        connection.send_json({"status": "error", "message": f"Invalid {kind} marker"})
+        return
+    conversation_id = marker.get("conversation_id")
+    conversation = await manager.membership.get(conversation_id)
+    if conversation is None or user_id not in conversation.members:
+        connection.send_json({"status": "error", "message": "Not a participant in this conversation"})
+        return
+    # Pushes skip the DB's cap, so a mark past the last message must not reach the senders
+    seq = min(seq, await manager.latest_seq(conversation_id))
+    if seq == 0:
+        return
+    manager.receipts.record(conversation_id, user_id, kind, seq)
+
+
+async def handle_event(connection, user_id: str, event) -> None:
+    """Relay a {"event": {"conversation_id": ..., "type": "typing"}} frame; never touches the DB"""
+    if not isinstance(event, dict) or event.get("type") not in EPHEMERAL_EVENT_TYPES:
+        connection.send_json({"status": "error", "message": "Invalid event"})
+        return
+    await manager.send_event(user_id, event.get("conversation_id"), event["type"])
+
+
+async def receive_frame(websocket: WebSocket) -> Union[str, bytes]:
+    """Next text or binary frame; raises WebSocketDisconnect like receive_text"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    text = message.get("text")
+    return text if text is not None else message["bytes"]
 
 
 @router.websocket("/{user_id}")
 async def websocket_endpoint(
     websocket: WebSocket, 
-    user_id: str, 
-    db: Session = Depends(get_db)
+    user_id: str,
+    features: str = "",
+    resume: str = ""
 ):
-    await manager.connect(websocket, user_id)
+    # Opt-in protocol features, e.g. /ws/{user_id}?features=profiles
+    requested = set(features.split(","))
+    # Wire format from Sec-WebSocket-Protocol: rumr.msgpack[.deflate], else JSON
+    codec, subprotocol = negotiate(websocket.scope.get("subprotocols", []))
+    connection = await manager.connect(
+        websocket, user_id, intern_profiles=PROFILE_INTERNING in requested,
+        codec=codec, subprotocol=subprotocol, coalesce=COALESCING in requested,
+        heartbeat=HEARTBEAT in requested,
+    )
+    
+    try:
+        # Broadcasts spilled while an earlier socket fell behind, then what the
+        # client says it has seen (?resume=conv1:42,conv2:17), which is more precise
+        positions = await manager.spilled_positions(user_id)
+        positions.update(parse_positions(resume))
+        if positions:
+            await manager.resume(connection, positions)
+    except Exception:
+        print(traceback.format_exc())
     
     try:
         while True:
             # Receive message
-            data_str = await websocket.receive_text()
+            raw = await receive_frame(websocket)
+            connection.touch()
+            timer = FrameTimer()
+            conversation_id = None
             
             try:
                 # Parse message data
-                data = json.loads(data_str)
+                data = codec.decode(raw)
+                status = data.get("status")
+                if status == "pong":
+                    # Heartbeat answer; receiving it was the point
+                    continue
+                if status == "ping":
+                    connection.send_json({"status": "pong"})
+                    continue
+                if "event" in data:
+                    await handle_event(connection, user_id, data["event"])
+                    continue
+                kind = next((kind for kind in RECEIPT_KINDS if kind in data), None)
+                if kind is not None:
+                    await handle_receipt(connection, user_id, kind, data[kind])
+                    continue
+                if "resume" in data:
+                    await manager.resume(connection, parse_positions(data["resume"]))
+                    continue
+                if "messages" in data:
+                    timer.mark("parse")
+                    await handle_batch(connection, user_id, data["messages"], timer)
+                    continue
                 conversation_id = data.get("conversation_id")
                 content = data.get("content", "")
                 msg_type = data.get("type", "text")
-                
-                # Verify conversation exists and user is a participant
-                participant = db.exec(
-                    select(ConversationParticipant).where(
-                        ConversationParticipant.conversation_id == conversation_id,
-                        ConversationParticipant.user_id == user_id,
-                        ConversationParticipant.deleted == False
-                    )
-                ).first()
-                conversation_owner = db.exec(
-                    select(Conversation).where(
-                        Conversation.id == conversation_id,
-                    )
-                ).first()
-                # Check for blocks between users
-                sender_blocked_owner = check_block_status(db, user_id, conversation_owner.user_id)
-                owner_blocked_sender = check_block_status(db, conversation_owner.user_id, user_id)
-                
-                if not participant:
-                    await websocket.send_json({
+                # Chosen by the client and repeated on every retry of the same send
+                client_message_id = data.get("client_message_id")
+                timer.mark("parse")
+                if client_message_id is not None and not valid_client_message_id(client_message_id):
+                    connection.send_json({
                         "status": "error",
-                        "message": "Not a participant in this conversation"
+                        "message": "Invalid client_message_id"
                     })
                     continue
-                if sender_blocked_owner or owner_blocked_sender:
-                    await websocket.send_json({
+                
+                # Flood control runs on in-memory buckets, before anything touches the DB
+                retry_after = await manager.flood.allow(user_id=user_id)
+                if retry_after is not None:
+                    connection.send_json(rate_limited(retry_after))
+                    continue
+                
+                # Membership, block and profile lookups are cached; a miss opens
+                # its own short-lived session on the DB thread pool
+                error = await authorize_sender(conversation_id, user_id)
+                timer.mark("authorize")
+                if error:
+                    connection.send_json({
                         "status": "error",
-                        "message": "You are blocked by the conversation owner or you have blocked them"
+                        "message": error
                     })
                     continue
-
+                # Only members draw on the conversation's budget
+                retry_after = await manager.flood.allow(conversation_id=conversation_id)
+                if retry_after is not None:
+                    connection.send_json(rate_limited(retry_after))
+                    continue
+                
+                # A retry of a send already seen is re-acked with the stored message, not saved again
+                if client_message_id is not None:
+                    earlier = manager.dedup.claim(user_id, client_message_id)
+                    if earlier is not None:
+                        stored = await replayed(earlier)
+                        if stored is None:
+                            connection.send_json({
+                                "status": "error",
+                                "message": "Message could not be saved"
+                            })
+                        else:
+                            connection.send_json({"status": "ack", **ack_fields(stored, duplicate=True)})
+                        continue
                 
+                # Save message to database; resolves once its batch is committed
+                stored = None
+                try:
+                    try:
+                        message = stored = await manager.writer.save(
+                            build_message(conversation_id, user_id, content, msg_type, client_message_id)
+                        )
+                    except DuplicateMessage as duplicate:
+                        # Stored before this worker's window, e.g. ahead of a restart
+                        stored = duplicate.message
+                        connection.send_json({"status": "ack", **ack_fields(stored, duplicate=True)})
+                        continue
+                    except Exception:
+                        print(traceback.format_exc())
+                        connection.send_json({
+                            "status": "error",
+                            "message": "Message could not be saved"
+                        })
+                        continue
+                finally:
+                    # Also when cancelled mid-save, so replays waiting on the claim are released
+                    if client_message_id is not None:
+                        manager.dedup.settle(user_id, client_message_id, stored)
+                timer.mark("save")
                 
-                # Save message to database
-                message = save_message(db, conversation_id, user_id, content, msg_type)
+                # Send success acknowledgment to sender now that the message is durable
+                connection.send_json({"status": "ack", **ack_fields(message)})
                 
                 # Prepare message data for broadcasting
                 message_data = {
@@ -81,35 +373,37 @@ async def websocket_endpoint(
                     "content": content,
                     "type": msg_type,
                     "created_at": message.created_at.isoformat(),
-                    "conversation_id": conversation_id
+                    "conversation_id": conversation_id,
+                    "seq": message.seq
                 }
-                
-                # Broadcast to other participants
-                response = await manager.broadcast_to_conversation(
-                    message_data, conversation_id, user_id, db
+                response, recipients = await manager.prepare_broadcast(
+                    message_data, conversation_id, user_id
                 )
+                timer.mark("prepare")
                 
-                # # Send success acknowledgment to sender
-                # await websocket.send_json({
-                #     "id": message.id,
-                #     "sender_id": user_id,
-                #     "content": content,
-                #     "type": msg_type,
-                #     "created_at": message.created_at.isoformat(),
-                #     "conversation_id": conversation_id,
-                #     "delivered": True,
-                # })
+                # Broadcast to other participants
+                await manager.fanout(response.model_dump(), recipients, conversation_id)
+                timer.mark("fanout")
                 
             except json.JSONDecodeError:
-                await websocket.send_json({
+                connection.send_json({
                     "status": "error",
                     "message": "Invalid JSON format"
                 })
+            except FrameDecodeError:
+                connection.send_json({
+                    "status": "error",
+                    "message": "Invalid frame format"
+                })
             except KeyError:
-                await websocket.send_json({
+                connection.send_json({
                     "status": "error",
                     "message": "Missing required fields"
                 })
+            finally:
+                timer.finish(user_id=user_id, conversation_id=conversation_id)
             
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
\ No newline at end of file
+        pass
+    finally:
+        manager.disconnect(user_id, connection)
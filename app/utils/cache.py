@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+import threading
+import time
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Bounded mapping with least-recently-used eviction and per-entry expiry.
+
+    Safe to share between the event loop and the DB thread pool. on_evict is
+    called with (key, value) whenever an entry leaves the cache, whether it
+    was evicted, expired, replaced or invalidated, and runs under the cache lock.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 10000,
+        ttl: float = 300.0,
+        on_evict: Optional[Callable[[Hashable, Any], None]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.clock = clock
+        self.lock = threading.RLock()
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING, record=False) is not _MISSING
+
+    def get(self, key: Hashable, default: Any = None, record: bool = True) -> Any:
+        with self.lock:
+            item = self._data.get(key)
+            if item is not None and item[0] <= self.clock():
+                self._remove(key)
+                item = None
+            if item is None:
+                if record:
+                    self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            if record:
+                self.hits += 1
+            return item[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        with self.lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (self.clock() + (self.ttl if ttl is None else ttl), value)
+            while len(self._data) > self.maxsize:
+                self.evictions += 1
+                self._remove(next(iter(self._data)))
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Invalidate a single entry, returning its value if it was cached"""
+        with self.lock:
+            if key not in self._data:
+                return default
+            return self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            for key in list(self._data):
+                self._remove(key)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _remove(self, key: Hashable) -> Any:
+        _, value = self._data.pop(key)
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+        return value
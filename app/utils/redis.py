@@ -0,0 +1,27 @@
+from typing import Optional
+import os
+
+import redis.asyncio as redis
+from dotenv import load_dotenv
+# Load environment variables
+load_dotenv()
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+_client: Optional[redis.Redis] = None
+
+
+def get_redis() -> redis.Redis:
+    """Return the process-wide asyncio Redis client, creating it on first use"""
+    global _client
+    if _client is None:
+        _client = redis.from_url(REDIS_URL)
+    return _client
+
+
+async def close_redis():
+    """Close the shared client (called on application shutdown)"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,97 @@
+"""Memory per connection and registry churn/lookup cost for simulated connections.
+
+Each simulated connection is a real Connection (queue, writer task) in the
+ConnectionRegistry, on a socket stub that never sends. Memory is measured
+with tracemalloc, so it covers Python allocations only.
+
+    python -m benchmarks.connections --connections 100000
+"""
+import argparse
+import asyncio
+import gc
+import json
+import random
+import time
+import tracemalloc
+
+from app.core.outbound import Connection, OutboundStats
+from app.core.registry import ConnectionRegistry
+
+
+class IdleWebSocket:
+    async def send_text(self, data):
+        pass
+
+    async def send_bytes(self, data):
+        pass
+
+
+async def simulate(count: int, devices: int, shards: int, lookups: int) -> dict:
+    stats = OutboundStats()
+    registry = ConnectionRegistry(shards=shards)
+    users = [f"user-{index:08d}" for index in range(count // devices)]
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    connections = []
+    started = time.perf_counter()
+    for user_id in users:
+        for _ in range(devices):
+            connection = Connection(IdleWebSocket(), user_id, stats)
+            registry.add(connection)
+            connections.append(connection)
+    connect_seconds = time.perf_counter() - started
+    idle = tracemalloc.take_snapshot()
+    for connection in connections:
+        connection.start()
+    # Let every writer task reach its first await
+    await asyncio.sleep(0)
+    running = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    def per_connection(snapshot) -> int:
+        allocated = sum(stat.size_diff for stat in snapshot.compare_to(before, "filename"))
+        return round(allocated / len(connections))
+
+    sample = random.sample(users, min(lookups, len(users)))
+    started = time.perf_counter()
+    for user_id in sample:
+        registry.get(user_id)
+    lookup_seconds = time.perf_counter() - started
+
+    # Reconnect storm: every sampled user drops one device and reconnects it
+    started = time.perf_counter()
+    for user_id in sample:
+        connection = registry.get(user_id)[0]
+        registry.remove(connection)
+        registry.add(connection)
+    churn_seconds = time.perf_counter() - started
+
+    for connection in connections:
+        connection.close()
+    await asyncio.sleep(0)
+    return {
+        "connections": len(connections),
+        "users": registry.user_count(),
+        "shards": shards,
+        "bytes_per_connection": per_connection(running),
+        "bytes_per_connection_without_writer": per_connection(idle),
+        "connect_us": round(connect_seconds / len(connections) * 1e6, 3),
+        "lookup_us": round(lookup_seconds / len(sample) * 1e6, 3),
+        "reconnect_us": round(churn_seconds / len(sample) * 1e6, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--connections", type=int, default=100000)
+    parser.add_argument("--devices", type=int, default=2, help="sockets per user")
+    parser.add_argument("--shards", type=int, default=16)
+    parser.add_argument("--lookups", type=int, default=10000)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(simulate(args.connections, args.devices, args.shards, args.lookups)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
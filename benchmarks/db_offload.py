@@ -0,0 +1,99 @@
+"""Event-loop latency for idle connections while one connection is sending.
+
+Observers wake up on a short timer, like sockets waiting on their next frame,
+and record how late each wake-up is. One sender saves messages in a loop,
+either inline on the event loop (the old behaviour) or through run_db. Every
+statement gets artificial latency to stand in for the MySQL round trip.
+
+    python -m benchmarks.db_offload --messages 200 --latency-ms 2
+"""
+from typing import List
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import event
+from sqlmodel import Session, SQLModel, create_engine
+
+from app.database import run_db
+from app.models.conversation import Conversation  # noqa: F401 (registers FK targets)
+from app.models.message import save_message
+from app.models.user import User  # noqa: F401
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def make_engine(path: str, latency: float):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    SQLModel.metadata.create_all(engine)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def network_round_trip(*_):
+        time.sleep(latency)
+
+    return engine
+
+
+async def observe(stop: asyncio.Event, lag: List[float], interval: float):
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lag.append((time.perf_counter() - expected) * 1000)
+
+
+async def run(mode: str, engine, messages: int, observers: int, interval: float) -> dict:
+    stop = asyncio.Event()
+    lag: List[float] = []
+    tasks = [asyncio.create_task(observe(stop, lag, interval)) for _ in range(observers)]
+    await asyncio.sleep(interval * 5)
+
+    started = time.perf_counter()
+    with Session(engine) as db:
+        for _ in range(messages):
+            if mode == "inline":
+                save_message(db, "conv1", "user1", "benchmark")
+            else:
+                await run_db(save_message, db, "conv1", "user1", "benchmark")
+            # Yield like a real receive loop between frames
+            await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await asyncio.gather(*tasks)
+    return {
+        "mode": mode,
+        "sends_per_s": round(messages / elapsed, 1),
+        "observer_lag_ms_p50": round(statistics.median(lag), 3),
+        "observer_lag_ms_p99": round(percentile(lag, 99), 3),
+        "observer_lag_ms_max": round(max(lag), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--observers", type=int, default=50)
+    parser.add_argument("--interval-ms", type=float, default=5.0)
+    parser.add_argument("--latency-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(os.path.join(tmp, "bench.db"), args.latency_ms / 1000)
+        results = [
+            asyncio.run(run(mode, engine, args.messages, args.observers, args.interval_ms / 1000))
+            for mode in ("inline", "offloaded")
+        ]
+        engine.dispose()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Encode cost per recipient for one broadcast: per-recipient pretty JSON vs one compact frame.
+
+Also reports the interned-profile form (?features=profiles), where a recipient
+that already knows the sender gets only the message fields.
+
+    python -m benchmarks.encode_fanout --recipients 500
+"""
+from datetime import datetime, timezone
+import argparse
+import json
+import timeit
+
+from app.core.frames import OutboundFrame
+from app.models.message_response import MessageResponse
+
+
+def sample_response() -> MessageResponse:
+    return MessageResponse(
+        id="6f1c2a3e-8a4b-4c2d-9e1f-0a1b2c3d4e5f",
+        sender_id="b2c3d4e5-f6a7-4b8c-9d0e-1f2a3b4c5d6e",
+        conversation_id="c3d4e5f6-a7b8-4c9d-0e1f-2a3b4c5d6e7f",
+        content="Are we still on for tonight? Running about ten minutes late.",
+        type="text",
+        created_at=datetime.now(timezone.utc),
+        PhoneNumber="+15555550123",
+        FirstName="Ada",
+        LastName="Lovelace",
+        Email="ada@example.com",
+        Username="ada",
+        Bio="Analytical engines and poetical science.",
+        ProfilePhoto="profiles/ada.jpg",
+        backgroundImage="backgrounds/ada.jpg",
+        PrivacySettingsID="d4e5f6a7-b8c9-4d0e-1f2a-3b4c5d6e7f8a",
+    )
+
+
+def per_recipient(response: MessageResponse, recipients: int):
+    """Previous behaviour: model_dump and pretty, sorted json.dumps for every recipient"""
+    for _ in range(recipients):
+        json.dumps(response.model_dump(), indent=4, sort_keys=True, default=str)
+
+
+def encode_once(response: MessageResponse, recipients: int):
+    """Current behaviour: one model_dump, one compact encoding, reused by every recipient"""
+    frame = OutboundFrame(response.model_dump())
+    for _ in range(recipients):
+        frame.text
+
+
+def interned(response: MessageResponse, recipients: int):
+    """Interning connections that already hold the sender's profile"""
+    frame = OutboundFrame(response.model_dump())
+    for _ in range(recipients):
+        frame.profile_text
+        frame.message_text
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--recipients", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    response = sample_response()
+    results = {}
+    for name, fn in (("per_recipient", per_recipient), ("encode_once", encode_once), ("interned", interned)):
+        best = min(timeit.repeat(lambda: fn(response, args.recipients), number=1, repeat=args.repeat))
+        results[name] = {
+            "broadcast_ms": round(best * 1000, 3),
+            "us_per_recipient": round(best / args.recipients * 1e6, 3),
+        }
+    results["per_recipient"]["frame_bytes"] = len(json.dumps(response.model_dump(), indent=4, sort_keys=True, default=str))
+    results["encode_once"]["frame_bytes"] = len(OutboundFrame(response.model_dump()).text)
+    results["interned"]["frame_bytes"] = len(OutboundFrame(response.model_dump()).message_text)
+    results["interned"]["profile_frame_bytes"] = len(OutboundFrame(response.model_dump()).profile_text)
+    results["recipients"] = args.recipients
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
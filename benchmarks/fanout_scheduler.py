@@ -0,0 +1,108 @@
+"""1:1 delivery latency while 10k-member broadcasts are in flight: inline fanout vs the chunked scheduler.
+
+1:1 messages arrive on a fixed clock, whether or not the event loop is free,
+and latency runs from that arrival to the enqueue on the recipient's socket.
+"Inline" is the scheduler with one chunk per broadcast, i.e. the previous
+behaviour of looping over every recipient in one go.
+
+    python -m benchmarks.fanout_scheduler --members 10000 --broadcasts 20
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from app.core.connection_manager import ConnectionManager
+from app.core.fanout import FANOUT_CHUNK_SIZE, FanoutScheduler
+from app.core.frames import OutboundFrame
+from app.core.message_bus import InProcessMessageBus
+from app.core.outbound import Connection
+
+
+class IdleWebSocket:
+    async def send_text(self, data):
+        pass
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def simulate(chunk_size: int, members: int, broadcasts: int, interval: float) -> dict:
+    manager = ConnectionManager(bus=InProcessMessageBus())
+    group = [f"member-{index}" for index in range(members)]
+    for user_id in group + ["alice", "bob"]:
+        # Room for every broadcast; writers are not started, so nothing drains
+        manager.active_connections.add(Connection(IdleWebSocket(), user_id, manager.outbound_stats, maxsize=broadcasts + 100000))
+
+    arrivals = {}
+    latencies = []
+    large_done = []
+    deliver_chunk = manager.deliver_chunk
+
+    def deliver(frame, recipients):
+        delivered = deliver_chunk(frame, recipients)
+        now = time.perf_counter()
+        if frame.payload.get("direct") is not None:
+            latencies.append(now - arrivals[frame.payload["direct"]])
+        else:
+            large_done.append(now)
+        return delivered
+
+    manager.scheduler = FanoutScheduler(deliver, chunk_size=chunk_size)
+    manager.scheduler.start()
+
+    async def big_broadcasts():
+        for index in range(broadcasts):
+            manager.scheduler.submit(OutboundFrame({"id": f"big{index}", "content": "x" * 100}), group, members)
+            await asyncio.sleep(0)
+
+    async def direct_messages(count: int):
+        started = time.perf_counter()
+        for index in range(count):
+            arrival = started + index * interval
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            arrivals[index] = arrival
+            manager.scheduler.submit(OutboundFrame({"direct": index}), ["bob"], 2)
+
+    started = time.perf_counter()
+    big = asyncio.create_task(big_broadcasts())
+    # Keep 1:1 traffic flowing for roughly as long as the big broadcasts take inline
+    await direct_messages(200)
+    await big
+    while any(manager.scheduler.pending().values()):
+        await asyncio.sleep(0.001)
+    await manager.scheduler.stop()
+    return {
+        "chunk_size": chunk_size,
+        "direct_latency_ms": {
+            "p50": round(statistics.median(latencies) * 1000, 3),
+            "p99": round(percentile(latencies, 0.99) * 1000, 3),
+            "max": round(max(latencies) * 1000, 3),
+        },
+        "large_broadcasts_done_ms": round((max(large_done) - started) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, default=10000)
+    parser.add_argument("--broadcasts", type=int, default=20)
+    parser.add_argument("--interval-ms", type=float, default=1.0, help="1:1 message inter-arrival time")
+    parser.add_argument("--chunk-size", type=int, default=FANOUT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    results = {}
+    for name, chunk_size in (("inline", args.members), ("scheduled", args.chunk_size)):
+        results[name] = asyncio.run(simulate(chunk_size, args.members, args.broadcasts, args.interval_ms / 1000))
+    results["members"] = args.members
+    results["broadcasts"] = args.broadcasts
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""History page latency by depth: keyset pagination vs LIMIT/OFFSET.
+
+Seeds one conversation with --messages rows in a temporary SQLite file (or
+any SQLAlchemy URL via --url), then times fetching a page that starts at
+increasing depths into the history.
+
+    python -m benchmarks.history --messages 200000
+"""
+from datetime import datetime, timedelta
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from sqlmodel import Session, SQLModel, create_engine, insert, select
+
+from app.models.conversation import Conversation  # noqa: F401 (registers FK targets)
+from app.models.message import Message, load_history_page
+from app.models.user import User  # noqa: F401
+
+
+def seed(engine, messages: int):
+    start = datetime(2024, 1, 1)
+    with Session(engine) as db:
+        for offset in range(0, messages, 10000):
+            db.exec(insert(Message), params=[
+                {"id": f"m{index:09d}", "conversation_id": "conv1", "sender_id": "user1", "content": "x",
+                 "type": "text", "status": True, "created_at": start + timedelta(milliseconds=index)}
+                for index in range(offset, min(offset + 10000, messages))
+            ])
+        db.commit()
+
+
+def best_ms(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return round(min(timings) * 1000, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="SQLAlchemy URL; defaults to a temporary SQLite file")
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--page", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(args.url or f"sqlite:///{os.path.join(tmp, 'history.db')}")
+        SQLModel.metadata.create_all(engine)
+        seed(engine, args.messages)
+
+        newest_first = select(Message).where(Message.conversation_id == "conv1").order_by(
+            Message.created_at.desc(), Message.id.desc()
+        )
+        results = []
+        with Session(engine) as db:
+            for fraction in (0, 0.5, 0.99):
+                depth = int(args.messages * fraction)
+                # The key just above the page; a client would hold it as its cursor
+                cursor = None
+                if depth:
+                    row = db.exec(newest_first.offset(depth - 1).limit(1)).one()
+                    cursor = (row.created_at, row.id)
+                results.append({
+                    "depth": depth,
+                    "keyset_ms": best_ms(lambda: load_history_page(db, "conv1", args.page, before=cursor), args.repeat),
+                    "offset_ms": best_ms(lambda: db.exec(newest_first.offset(depth).limit(args.page)).all(), args.repeat),
+                })
+        engine.dispose()
+
+    print(json.dumps({"messages": args.messages, "page": args.page, "pages": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""Load test for /ws/{user_id}: starts the app on SQLite and drives many websocket clients.
+
+Seeds N users and M conversations whose sizes cycle through --sizes, opens one
+socket per user, lets --senders users post --messages each, then reports a
+single JSON document (stdout or --output):
+
+  sends/s, end-to-end fanout latency percentiles, DB queries per message and
+  server memory per connection (Linux only, from /proc).
+
+    python -m benchmarks.loadtest --users 2000 --conversations 200 --sizes 2,10,50
+
+With --workers > 1 set MESSAGE_BUS=redis so fanout crosses workers; the DB
+query count then only covers the worker that answered /db/pool.
+"""
+from pathlib import Path
+from typing import Dict, List, Optional
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import websockets
+from sqlmodel import Session, SQLModel, create_engine
+
+from app.models.blocked_user import BlockedUser  # noqa: F401 (table is created by seed)
+from app.models.conversation import Conversation
+from app.models.conversation_participant import ConversationParticipant
+from app.models.message import Message  # noqa: F401
+from app.models.user import User
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def percentile(samples: List[float], pct: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def seed(workdir: str, users: int, conversations: int, sizes: List[int], rng: random.Random) -> Dict[str, List[str]]:
+    """Create the SQLite file the server will open (./data/rumr.db under workdir)"""
+    os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+    engine = create_engine(f"sqlite:///{os.path.join(workdir, 'data', 'rumr.db')}")
+    SQLModel.metadata.create_all(engine)
+
+    user_ids = [f"load-user-{index}" for index in range(users)]
+    members: Dict[str, List[str]] = {}
+    with Session(engine) as db:
+        db.add_all(User(UserID=user_id, Username=user_id, FirstName="Load") for user_id in user_ids)
+        for index in range(conversations):
+            size = min(sizes[index % len(sizes)], users)
+            conversation_members = rng.sample(user_ids, size)
+            conversation_id = f"load-conv-{index}"
+            members[conversation_id] = conversation_members
+            db.add(Conversation(
+                id=conversation_id, user_id=conversation_members[0],
+                conversation_type="group" if size > 2 else "single"
+            ))
+            db.add_all(
+                ConversationParticipant(conversation_id=conversation_id, user_id=user_id)
+                for user_id in conversation_members
+            )
+        db.commit()
+    engine.dispose()
+    return members
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get_json(url: str) -> dict:
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return json.loads(response.read())
+
+
+def rss_bytes(pid: int) -> Optional[int]:
+    """Resident memory of the server process and its children (Linux /proc)"""
+    total = 0
+    pids = [pid]
+    try:
+        children = Path(f"/proc/{pid}/task/{pid}/children").read_text().split()
+        pids.extend(int(child) for child in children)
+        for process in pids:
+            for line in Path(f"/proc/{process}/status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return total
+
+
+def start_server(workdir: str, port: int, workers: int) -> subprocess.Popen:
+    env = dict(os.environ, USE_SQLITE="true", PYTHONPATH=str(ROOT))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.app:app", "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=workdir, env=env,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            get_json(f"http://127.0.0.1:{port}/db/pool")
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("Server did not start")
+
+
+class Client:
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.websocket = None
+        self.acks = 0
+        self.errors = 0
+
+    async def connect(self, base_url: str):
+        self.websocket = await websockets.connect(f"{base_url}/ws/{self.user_id}", max_queue=None)
+
+    async def read(self, latencies: List[float]):
+        try:
+            async for raw in self.websocket:
+                frame = json.loads(raw)
+                status = frame.get("status")
+                if status == "ack":
+                    self.acks += 1
+                elif status == "error":
+                    self.errors += 1
+                elif frame.get("content", "").startswith("t="):
+                    latencies.append(time.time() - float(frame["content"][2:]))
+        except websockets.ConnectionClosed:
+            pass
+
+    async def send(self, conversation_id: str, count: int, interval: float):
+        for _ in range(count):
+            await self.websocket.send(json.dumps({
+                "conversation_id": conversation_id,
+                "content": f"t={time.time()}",
+                "type": "text",
+            }))
+            await asyncio.sleep(interval)
+
+
+async def drive(args, members: Dict[str, List[str]], base_url: str, http_url: str, server_pid: int) -> dict:
+    rng = random.Random(args.seed + 1)
+    user_ids = sorted({user_id for conversation in members.values() for user_id in conversation})
+    clients = {user_id: Client(user_id) for user_id in user_ids}
+
+    rss_before = rss_bytes(server_pid)
+    limit = asyncio.Semaphore(args.connect_concurrency)
+
+    async def connect(client: Client):
+        async with limit:
+            await client.connect(base_url)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(connect(client) for client in clients.values()))
+    connect_seconds = time.perf_counter() - started
+    await asyncio.sleep(1)
+    rss_after = rss_bytes(server_pid)
+
+    latencies: List[float] = []
+    readers = [asyncio.create_task(client.read(latencies)) for client in clients.values()]
+
+    senders = []
+    for conversation_id in rng.sample(sorted(members), min(args.senders, len(members))):
+        senders.append((clients[members[conversation_id][0]], conversation_id))
+
+    queries_before = get_json(f"{http_url}/db/pool").get("queries", 0)
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        client.send(conversation_id, args.messages, 1 / args.rate) for client, conversation_id in senders
+    ))
+    # Wait for acks to come back before stopping the clock
+    expected = len(senders) * args.messages
+    deadline = time.perf_counter() + args.drain_timeout
+    while sum(client.acks + client.errors for client in clients.values()) < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    await asyncio.sleep(0.5)
+    queries = get_json(f"{http_url}/db/pool").get("queries", 0) - queries_before
+
+    for client in clients.values():
+        await client.websocket.close()
+    await asyncio.gather(*readers, return_exceptions=True)
+
+    acked = sum(client.acks for client in clients.values())
+    latencies_ms = [latency * 1000 for latency in latencies]
+    memory = None
+    if rss_before is not None and rss_after is not None:
+        memory = (rss_after - rss_before) / len(clients)
+    return {
+        "connections": len(clients),
+        "connect_seconds": round(connect_seconds, 3),
+        "messages_sent": expected,
+        "messages_acked": acked,
+        "errors": sum(client.errors for client in clients.values()),
+        "sends_per_s": round(acked / elapsed, 1) if elapsed else None,
+        "deliveries": len(latencies_ms),
+        "fanout_latency_ms": {
+            name: round(value, 3) if value is not None else None
+            for name, value in (
+                ("p50", percentile(latencies_ms, 50)),
+                ("p95", percentile(latencies_ms, 95)),
+                ("p99", percentile(latencies_ms, 99)),
+                ("max", max(latencies_ms, default=None)),
+            )
+        },
+        "db_queries_per_message": round(queries / acked, 3) if acked else None,
+        "server_rss_bytes_per_connection": round(memory) if memory is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--conversations", type=int, default=100)
+    parser.add_argument("--sizes", default="2,10,50", help="conversation sizes, cycled")
+    parser.add_argument("--senders", type=int, default=50, help="conversations with an active sender")
+    parser.add_argument("--messages", type=int, default=20, help="messages per sender")
+    parser.add_argument("--rate", type=float, default=10.0, help="messages per second per sender")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--drain-timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    with tempfile.TemporaryDirectory() as workdir:
+        members = seed(workdir, args.users, args.conversations, sizes, random.Random(args.seed))
+        port = free_port()
+        server = start_server(workdir, port, args.workers)
+        try:
+            results = asyncio.run(drive(
+                args, members, f"ws://127.0.0.1:{port}", f"http://127.0.0.1:{port}", server.pid
+            ))
+        finally:
+            server.send_signal(signal.SIGINT)
+            server.wait(timeout=30)
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
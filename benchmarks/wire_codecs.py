@@ -0,0 +1,56 @@
+"""Parse and encode cost per frame, and frame size, for each wire format.
+
+Compares the JSON text protocol with the binary MessagePack subprotocols
+(rumr.msgpack and rumr.msgpack.deflate) for an inbound message frame and an
+outbound MessageResponse, with and without the sender profile.
+
+    python -m benchmarks.wire_codecs --number 20000
+"""
+import argparse
+import json
+import timeit
+import zlib
+
+from app.core.frames import JSON, MSGPACK, MSGPACK_DEFLATE
+from app.core.profiles import PROFILE_FIELDS
+from benchmarks.encode_fanout import sample_response
+
+CODECS = {"json": JSON, "msgpack": MSGPACK, "msgpack+deflate": MSGPACK_DEFLATE}
+
+
+def best_us(fn, number: int, repeat: int) -> float:
+    return round(min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    payload = sample_response().model_dump()
+    inbound = {"conversation_id": payload["conversation_id"], "content": payload["content"], "type": "text"}
+    outbound = {"full": payload, "interned": {key: value for key, value in payload.items() if key not in PROFILE_FIELDS}}
+
+    results = {}
+    for name, codec in CODECS.items():
+        frame = codec.encode(inbound)
+        result = {
+            "inbound_bytes": len(frame),
+            "inbound_parse_us": best_us(lambda: codec.decode(frame), args.number, args.repeat),
+        }
+        for kind, body in outbound.items():
+            result[f"outbound_{kind}_bytes"] = len(codec.encode(body))
+            result[f"outbound_{kind}_encode_us"] = best_us(lambda: codec.encode(body), args.number, args.repeat)
+        results[name] = result
+
+    # What transport-level permessage-deflate would cost: one compression per recipient
+    text = JSON.encode(payload).encode()
+    results["json_permessage_deflate_us_per_recipient"] = best_us(
+        lambda: zlib.compress(text, 6), args.number // 10, args.repeat
+    )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,24 @@ import sys
 import os
 from pathlib import Path
 
+import pytest
+from sqlmodel import SQLModel, create_engine
+from sqlmodel.pool import StaticPool
+
 # Add the project root directory to Python path
 root_dir = Path(__file__).parent.parent
-sys.path.insert(0, str(root_dir))
\ No newline at end of file
+sys.path.insert(0, str(root_dir))
+
+from app import database
+
+
+@pytest.fixture(name="engine")
+def engine_fixture(monkeypatch):
+    """Empty in-memory database, shared by every thread; modules seed it by overriding this fixture"""
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    SQLModel.metadata.create_all(engine)
+    # Every DB call opens its own session from app.database.engine
+    monkeypatch.setattr(database, "engine", engine)
+    return engine
@@ -0,0 +1,51 @@
+import asyncio
+import pytest
+from sqlalchemy import event
+from sqlmodel import Session
+
+from app.core.blocks import BlockService
+from app.models.blocked_user import BlockedUser
+from app.models.user import User
+
+
+@pytest.fixture(name="engine")
+def engine_fixture(engine):
+    with Session(engine) as session:
+        session.add_all([User(UserID="alice"), User(UserID="bob"), User(UserID="carol")])
+        session.add(BlockedUser(blocker_id="alice", blocked_id="bob"))
+        session.commit()
+    return engine
+
+
+def test_either_direction_is_one_cached_query(engine):
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    blocks = BlockService()
+
+    with Session(engine) as db:
+        assert asyncio.run(blocks.is_blocked("bob", "alice", db)) is True
+        assert asyncio.run(blocks.is_blocked("alice", "bob", db)) is True
+        assert asyncio.run(blocks.is_blocked("alice", "carol", db)) is False
+        assert asyncio.run(blocks.is_blocked("carol", "alice", db)) is False
+
+    assert len(statements) == 2
+
+
+def test_creating_and_removing_a_block_invalidates(engine):
+    blocks = BlockService()
+    with Session(engine) as db:
+        assert asyncio.run(blocks.is_blocked("carol", "bob", db)) is False
+
+        block = BlockedUser(blocker_id="carol", blocked_id="bob")
+        db.add(block)
+        db.commit()
+        assert asyncio.run(blocks.is_blocked("bob", "carol", db)) is True
+
+        db.delete(block)
+        db.commit()
+        assert asyncio.run(blocks.is_blocked("bob", "carol", db)) is False
+
+
+def test_composite_index_is_declared():
+    indexes = {index.name: [column.name for column in index.columns] for index in BlockedUser.__table__.indexes}
+    assert indexes["ix_blocked_users_blocker_blocked"] == ["blocker_id", "blocked_id"]
@@ -0,0 +1,64 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app.app import app
+from app.models.conversation import Conversation
+from app.models.conversation_participant import ConversationParticipant, load_conversation_list, mark_read
+from app.models.message import build_message, save_messages
+from app.models.user import User
+
+
+@pytest.fixture(name="session")
+def session_fixture(engine):
+    with Session(engine) as session:
+        session.add_all([
+            User(UserID="user1", Username="user1"),
+            User(UserID="user2", Username="user2"),
+            Conversation(id="quiet", user_id="user1", conversation_type="single"),
+            Conversation(id="busy", user_id="user1", conversation_type="group"),
+            Conversation(id="muted", user_id="user1", conversation_type="group"),
+            Conversation(id="pinned", user_id="user1", conversation_type="group"),
+            ConversationParticipant(conversation_id="quiet", user_id="user2"),
+            ConversationParticipant(conversation_id="busy", user_id="user2"),
+            ConversationParticipant(conversation_id="muted", user_id="user2", is_conversation_mute=True),
+            ConversationParticipant(conversation_id="pinned", user_id="user2", is_conversation_pin=True),
+            *(ConversationParticipant(conversation_id=conversation_id, user_id="user1")
+              for conversation_id in ("quiet", "busy", "muted", "pinned")),
+        ])
+        session.commit()
+        yield session
+
+
+def test_summary_and_unread_counts_follow_saves_and_read_markers(session):
+    save_messages(session, [build_message("pinned", "user1", "old news")])
+    save_messages(session, [build_message("muted", "user1", "shh")])
+    save_messages(session, [
+        build_message("busy", "user1", "one"),
+        build_message("busy", "user2", "two"),
+        build_message("busy", "user1", "three " * 100),
+    ])
+    mark_read(session, "busy", "user2", 99)
+
+    listing = {item["conversation_id"]: item for item in load_conversation_list(session, "user2", 100)}
+    owner = {item["conversation_id"]: item for item in load_conversation_list(session, "user1", 100)}
+
+    busy = listing["busy"]
+    assert busy["last_seq"] == 3
+    assert busy["last_message"]["preview"] == ("three " * 100)[:255]
+    # Read markers are capped at the newest message
+    assert busy["last_read_seq"] == 3 and busy["unread_count"] == 0
+    # Sending marks the sender's own messages as read
+    assert owner["busy"]["unread_count"] == 0
+    assert listing["muted"]["unread_count"] == 1
+    assert listing["quiet"]["last_message"] is None
+
+
+def test_list_orders_pinned_first_and_muted_last(session):
+    for conversation_id in ("pinned", "muted", "busy"):
+        save_messages(session, [build_message(conversation_id, "user1", conversation_id)])
+
+    with TestClient(app) as client:
+        listing = client.get("/conversations", params={"user_id": "user2"}).json()
+
+    assert [item["conversation_id"] for item in listing] == ["pinned", "busy", "quiet", "muted"]
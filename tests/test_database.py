@@ -86,4 +86,18 @@ class TestMessageModelCompatibility:
         assert uuid.UUID(new_message.id, version=4)  # Valid UUID4
         assert new_message.created_at is not None
         assert isinstance(new_message.created_at, datetime)
-        assert new_message.image_key is None  # Default for optional field
\ No newline at end of file
+        assert new_message.image_key is None  # Default for optional field
+
+def test_session_scope_records_pool_checkout(monkeypatch):
+    """Each short-lived session times its connection checkout"""
+    from app import database
+    from sqlmodel.pool import StaticPool
+
+    monkeypatch.setattr(database, "engine", create_engine("sqlite://", poolclass=StaticPool))
+    before = database.pool_checkout_stats.snapshot()["checkouts"]
+    with database.session_scope() as session:
+        assert session.exec(text("SELECT 1")).one()[0] == 1
+
+    status = database.pool_status()
+    assert status["checkouts"] == before + 1
+    assert status["wait_seconds_max"] >= 0
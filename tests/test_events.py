@@ -0,0 +1,124 @@
+import asyncio
+import json
+
+from app import database
+from app.core.blocks import pair_key
+from app.core.connection_manager import ConnectionManager
+from app.core.events import EventThrottle
+from app.core.membership import ConversationMembers
+from app.core.message_bus import InProcessMessageBus
+from app.core.outbound import Connection
+
+
+def test_throttle_sends_first_and_latest_event_per_window():
+    released = []
+    throttle = EventThrottle(released.append, interval=0.05)
+
+    async def scenario():
+        first = throttle.offer(("user1", "conv1"), {"type": "typing"})
+        held = [throttle.offer(("user1", "conv1"), {"type": kind}) for kind in ("typing", "typing", "paused")]
+        other = throttle.offer(("user2", "conv1"), {"type": "typing"})
+        await asyncio.sleep(0.1)
+        return first, held, other
+
+    first, held, other = asyncio.run(scenario())
+
+    assert first == {"type": "typing"} and other == {"type": "typing"}
+    assert held == [None, None, None]
+    assert released == [{"type": "paused"}]
+
+
+class FakeWebSocket:
+    async def send_text(self, data):
+        pass
+
+
+def make_manager():
+    manager = ConnectionManager(bus=InProcessMessageBus())
+    for user_id in ("user1", "user2", "user3"):
+        manager.active_connections.add(Connection(FakeWebSocket(), user_id, manager.outbound_stats, maxsize=4))
+    manager.membership.add(ConversationMembers("conv1", "user1", ["user1", "user2", "user3"]))
+    for user_id in ("user1", "user2", "user3"):
+        manager.membership.user_online(user_id)
+    return manager
+
+
+def test_events_use_only_cached_data():
+    manager = make_manager()
+    warmed = []
+    # Misses are loaded in the background (see the next test), never by the event itself
+    manager._warm_event_caches = lambda sender_id, conversation_id: warmed.append(conversation_id)
+    statements = database.query_counter.count
+
+    async def scenario():
+        await manager.bus.start(manager.deliver_local)
+        # Block status not cached yet: dropped, not looked up inline
+        uncached = await manager.send_event("user2", "conv1", "typing")
+        unknown = await manager.send_event("user2", "missing", "typing")
+        manager.blocks._cache.set(("user1", "user2"), False)
+        sent = await manager.send_event("user2", "conv1", "typing")
+        return uncached, unknown, sent
+
+    assert asyncio.run(scenario()) == (False, False, True)
+    assert database.query_counter.count == statements
+    event = {"status": "event", "type": "typing", "conversation_id": "conv1", "user_id": "user2"}
+    for user_id in ("user1", "user3"):
+        assert json.loads(manager.active_connections.get(user_id)[0].queue.get_nowait()) == event
+    # Not echoed to the sender
+    assert manager.active_connections.get("user2")[0].depth == 0
+    assert manager.event_stats.snapshot()["uncached"] == 2
+    assert warmed == ["conv1", "missing"]
+
+
+def test_dropped_event_warms_the_caches_for_the_next_one():
+    manager = make_manager()
+    manager.membership.clear()
+    loads = []
+
+    async def load_members(conversation_id, db=None):
+        loads.append(conversation_id)
+        entry = ConversationMembers(conversation_id, "user1", ["user1", "user2", "user3"])
+        manager.membership.add(entry)
+        return entry
+
+    async def load_block(user_a, user_b, db=None):
+        manager.blocks._cache.set(pair_key(user_a, user_b), False)
+        return False
+
+    manager.membership.get = load_members
+    manager.blocks.is_blocked = load_block
+
+    async def scenario():
+        await manager.bus.start(manager.deliver_local)
+        cold = [await manager.send_event("user2", "conv1", "typing") for _ in range(3)]
+        await asyncio.sleep(0)
+        await asyncio.gather(*manager._background)
+        warm = await manager.send_event("user2", "conv1", "typing")
+        return cold, warm
+
+    cold, warm = asyncio.run(scenario())
+
+    assert cold == [False, False, False] and warm is True
+    # One load for the whole burst
+    assert loads == ["conv1"]
+
+
+def test_events_are_dropped_for_backed_up_recipients():
+    manager = make_manager()
+    manager.blocks._cache.set(("user1", "user2"), False)
+    backed_up = manager.active_connections.get("user3")[0]
+    for index in range(4):
+        backed_up.send(f"frame{index}")
+
+    async def scenario():
+        await manager.bus.start(manager.deliver_local)
+        await manager.send_event("user2", "conv1", "typing")
+
+    asyncio.run(scenario())
+
+    # The full queue kept its messages and nobody was disconnected
+    assert [backed_up.queue.get_nowait() for _ in range(4)] == [f"frame{index}" for index in range(4)]
+    assert not backed_up.closed
+    assert manager.outbound_stats.ephemeral_dropped == 1
+    assert manager.outbound_stats.dropped == 0
+    assert manager.active_connections.get("user1")[0].depth == 1
@@ -0,0 +1,41 @@
+import asyncio
+
+from app.core.fanout import DIRECT, LARGE, SMALL, FanoutScheduler, size_class
+from app.core.frames import OutboundFrame
+
+
+def test_size_classes():
+    assert [size_class(members) for members in (2, 3, 100, 101, 10000)] == [DIRECT, SMALL, SMALL, LARGE, LARGE]
+
+
+def test_direct_message_overtakes_a_large_broadcast():
+    delivered = []
+
+    def deliver(frame, recipients):
+        delivered.append((frame.payload["id"], list(recipients)))
+        return len(recipients)
+
+    scheduler = FanoutScheduler(deliver, chunk_size=2, weights=(1, 1, 1))
+
+    async def scenario():
+        scheduler.start()
+        scheduler.submit(OutboundFrame({"id": "big1"}), ["a", "b", "c", "d", "e", "f"], members=5000)
+        scheduler.submit(OutboundFrame({"id": "big2"}), ["a", "b"], members=5000)
+        # One chunk of the big broadcast goes out, then the 1:1 message arrives
+        await asyncio.sleep(0)
+        scheduler.submit(OutboundFrame({"id": "direct"}), ["x"], members=2)
+        for _ in range(10):
+            await asyncio.sleep(0)
+        await scheduler.stop()
+
+    asyncio.run(scenario())
+
+    assert delivered == [
+        ("big1", ["a", "b"]),
+        ("direct", ["x"]),
+        ("big1", ["c", "d"]),
+        ("big1", ["e", "f"]),
+        ("big2", ["a", "b"]),
+    ]
+    assert scheduler.stats.snapshot() == {"broadcasts": 3, "chunks": 5, "deliveries": 9}
+    assert scheduler.pending() == {DIRECT: 0, SMALL: 0, LARGE: 0}
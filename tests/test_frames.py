@@ -0,0 +1,45 @@
+from datetime import datetime, timezone
+
+import msgpack
+import pytest
+
+from app.core.frames import (
+    DEFLATED, JSON, MSGPACK, MSGPACK_DEFLATE, RAW, FrameDecodeError, OutboundFrame, negotiate,
+)
+
+
+def test_msgpack_uses_short_keys_and_omits_nulls():
+    frame = MSGPACK.encode({"conversation_id": "conv1", "content": "hi", "image_key": None})
+
+    assert msgpack.unpackb(frame) == {"c": "conv1", "b": "hi"}
+    assert MSGPACK.decode(frame) == {"conversation_id": "conv1", "content": "hi"}
+
+
+def test_compression_is_decided_per_message():
+    small = MSGPACK_DEFLATE.encode({"status": "ack", "id": "m1"})
+    large = MSGPACK_DEFLATE.encode({"content": "x" * 2000, "created_at": datetime.now(timezone.utc)})
+
+    assert small[:1] == RAW
+    assert large[:1] == DEFLATED and len(large) < 200
+    assert MSGPACK_DEFLATE.decode(large)["content"] == "x" * 2000
+
+
+def test_invalid_binary_frames_are_rejected():
+    with pytest.raises(FrameDecodeError):
+        MSGPACK.decode(msgpack.packb([1, 2, 3]))
+    with pytest.raises(FrameDecodeError):
+        MSGPACK.decode(b"\xc1")
+    with pytest.raises(FrameDecodeError):
+        MSGPACK_DEFLATE.decode(DEFLATED + b"not deflate")
+
+
+def test_negotiate_prefers_client_order_and_defaults_to_json():
+    assert negotiate(["chat", "rumr.msgpack.deflate", "rumr.msgpack"]) == (MSGPACK_DEFLATE, "rumr.msgpack.deflate")
+    assert negotiate([]) == (JSON, None)
+
+
+def test_outbound_frame_encodes_once_per_codec():
+    frame = OutboundFrame({"id": "m1", "sender_id": "user1"})
+
+    assert frame.encode(MSGPACK) is frame.encode(MSGPACK)
+    assert frame.encode(JSON) == frame.text
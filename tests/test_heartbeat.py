@@ -0,0 +1,96 @@
+import asyncio
+import json
+
+from app.core.connection_manager import ConnectionManager
+from app.core.heartbeat import IDLE_CLOSE_CODE, HeartbeatMonitor
+from app.core.message_bus import InProcessMessageBus
+from app.core.timers import TimerWheel
+
+
+def test_wheel_fires_each_timer_once_on_its_tick():
+    wheel = TimerWheel(tick=1, slots=4)
+    fired = []
+    wheel.schedule(1, fired.append, "a")
+    wheel.schedule(2.5, fired.append, "b")
+    # Past one full turn of the wheel
+    wheel.schedule(9, fired.append, "c")
+    wheel.schedule(2, fired.append, "cancelled").cancel()
+
+    ticks = []
+    for tick in range(1, 11):
+        before = len(fired)
+        wheel.advance()
+        ticks.extend((tick, name) for name in fired[before:])
+
+    assert ticks == [(1, "a"), (3, "b"), (9, "c")]
+    assert len(wheel) == 0
+
+
+def test_rescheduling_from_a_callback_waits_a_full_turn():
+    wheel = TimerWheel(tick=1, slots=2)
+    fired = []
+
+    def again(name):
+        fired.append(name)
+        if fired.count(name) < 3:
+            wheel.schedule(2, again, name)
+
+    wheel.schedule(2, again, "x")
+    for _ in range(6):
+        wheel.advance()
+        fired.append("|")
+
+    assert "".join(fired) == "|x||x||x|"
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.close_code = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+def test_quiet_clients_are_pinged_and_silent_ones_reaped():
+    now = [1000.0]
+
+    async def scenario():
+        manager = ConnectionManager(bus=InProcessMessageBus())
+        manager.heartbeats = HeartbeatMonitor(
+            TimerWheel(tick=1, slots=8), interval=2, idle_timeout=5, legacy_idle_timeout=0, clock=lambda: now[0],
+        )
+        wheel = manager.heartbeats.wheel
+        live, silent, legacy = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        answering = await manager.connect(live, "alice", heartbeat=True)
+        dead = await manager.connect(silent, "bob", heartbeat=True)
+        await manager.connect(legacy, "carol")
+        for connection in (answering, dead):
+            connection.last_activity = now[0]
+
+        for _ in range(6):
+            now[0] += 1
+            wheel.advance()
+            # alice answers every ping
+            if live.sent and live.sent[-1] == {"status": "ping"}:
+                answering.last_activity = now[0]
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)
+        return manager, answering, dead, silent
+
+    manager, answering, dead, silent = asyncio.run(scenario())
+
+    assert {"status": "ping"} in silent.sent and silent.close_code == IDLE_CLOSE_CODE
+    assert dead.closed and "bob" not in manager.active_connections
+    assert not manager.presence.is_online("bob")
+    assert not answering.closed and "alice" in manager.active_connections
+    # Legacy clients are never pinged or reaped unless LEGACY_IDLE_TIMEOUT_SECONDS is set
+    assert "carol" in manager.active_connections
+    stats = manager.heartbeats.snapshot()
+    assert (stats["watched"], stats["reaped"], stats["timers"]) == (1, 1, 1)
@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlmodel import Session
+
+from app.app import app
+from app.models.conversation import Conversation
+from app.models.conversation_participant import ConversationParticipant
+from app.models.message import Message
+from app.models.user import User
+from app.routers.websocket import manager
+
+
+@pytest.fixture(name="engine")
+def engine_fixture(engine):
+    manager.membership.clear()
+    manager.profiles.clear()
+    return engine
+
+
+@pytest.fixture(name="client")
+def client_fixture(engine):
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture(name="messages")
+def messages_fixture(engine):
+    start = datetime(2024, 1, 1)
+    # Pairs of messages share a timestamp, so the id breaks ties
+    messages = [
+        Message(id=f"m{index}", conversation_id="conv1", sender_id="user1", content=str(index),
+                type="text", status=True, created_at=start + timedelta(seconds=index // 2))
+        for index in range(7)
+    ]
+    ids = [message.id for message in messages]
+    with Session(engine) as session:
+        session.add_all([
+            User(UserID="user1", Username="user1", FirstName="Ada"),
+            User(UserID="user2", Username="user2"),
+            Conversation(id="conv1", user_id="user1", conversation_type="group"),
+            ConversationParticipant(conversation_id="conv1", user_id="user1"),
+            *messages,
+        ])
+        session.commit()
+    return ids
+
+
+def test_pages_walk_history_without_gaps_or_repeats(client, messages):
+    seen, cursor = [], None
+    while True:
+        params = {"user_id": "user1", "limit": 3}
+        if cursor:
+            params["before"] = cursor
+        page = client.get("/conversations/conv1/messages", params=params).json()
+        seen.extend(message["id"] for message in page["messages"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert seen == list(reversed(messages))
+    assert page["profiles"]["user1"]["FirstName"] == "Ada"
+
+
+def test_after_pages_forward(client, messages):
+    newest_first = client.get("/conversations/conv1/messages", params={"user_id": "user1", "limit": 4}).json()
+    page = client.get(
+        "/conversations/conv1/messages", params={"user_id": "user1", "after": newest_first["next_cursor"]}
+    ).json()
+
+    assert [message["id"] for message in page["messages"]] == messages[4:]
+
+
+def test_history_requires_membership_and_valid_cursor(client, messages):
+    assert client.get("/conversations/conv1/messages", params={"user_id": "user2"}).status_code == 403
+    response = client.get("/conversations/conv1/messages", params={"user_id": "user1", "before": "%%%"})
+    assert response.status_code == 400
+
+
+def test_page_query_seeks_the_composite_index(engine, messages):
+    with engine.connect() as connection:
+        plan = connection.execute(text(
+            "EXPLAIN QUERY PLAN SELECT * FROM messages_rumr_app WHERE conversation_id = 'conv1' "
+            "AND created_at <= '2024-01-01 00:00:02' AND (created_at < '2024-01-01 00:00:02' OR id < 'm4') "
+            "ORDER BY created_at DESC, id DESC LIMIT 3"
+        )).all()
+
+    details = " ".join(row[-1] for row in plan)
+    assert "ix_messages_conversation_created_id (conversation_id=? AND created_at<?)" in details
+    assert "TEMP B-TREE" not in details
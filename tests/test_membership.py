@@ -0,0 +1,102 @@
+import asyncio
+import pytest
+from datetime import datetime, timezone
+from sqlalchemy import event
+from sqlmodel import Session, select
+
+from app.core.membership import MembershipIndex
+from app.models.conversation import Conversation
+from app.models.conversation_participant import ConversationParticipant
+from app.models.user import User
+from app.utils.cache import TTLCache
+
+
+@pytest.fixture(name="engine")
+def engine_fixture(engine):
+    with Session(engine) as session:
+        session.add_all([
+            User(UserID="owner"), User(UserID="alice"), User(UserID="bob"),
+            Conversation(id="conv1", user_id="owner", conversation_type="group"),
+            ConversationParticipant(conversation_id="conv1", user_id="owner"),
+            ConversationParticipant(conversation_id="conv1", user_id="alice"),
+            ConversationParticipant(conversation_id="conv1", user_id="bob"),
+        ])
+        session.commit()
+    return engine
+
+
+@pytest.fixture(name="statements")
+def statements_fixture(engine):
+    executed = []
+    event.listen(engine, "before_cursor_execute", lambda *args: executed.append(args[2]))
+    return executed
+
+
+def test_membership_is_loaded_once_and_cached(engine, statements):
+    index = MembershipIndex(is_online=lambda user_id: user_id == "alice")
+
+    with Session(engine) as db:
+        first = asyncio.run(index.get("conv1", db))
+        loaded = len(statements)
+        second = asyncio.run(index.get("conv1", db))
+
+    assert loaded == 1
+    assert len(statements) == loaded
+    assert second is first
+    assert first.owner_id == "owner"
+    assert first.members == {"owner", "alice", "bob"}
+    assert first.online == {"alice"}
+
+
+def test_online_reverse_index_follows_presence(engine):
+    online = set()
+    index = MembershipIndex(is_online=lambda user_id: user_id in online)
+    with Session(engine) as db:
+        entry = asyncio.run(index.get("conv1", db))
+
+    online.add("bob")
+    index.user_online("bob")
+    assert entry.online == {"bob"}
+
+    online.discard("bob")
+    index.user_offline("bob")
+    assert entry.online == set()
+
+
+def test_join_leave_and_soft_delete_invalidate(engine):
+    index = MembershipIndex(is_online=lambda user_id: False)
+    with Session(engine) as db:
+        entry = asyncio.run(index.get("conv1", db))
+
+        index.leave("conv1", "bob")
+        assert "bob" not in entry.members
+        index.join("conv1", "bob")
+        assert "bob" in entry.members
+
+        # Soft deleting a participant through the ORM drops the cached entry
+        participant = db.exec(
+            select(ConversationParticipant).where(ConversationParticipant.user_id == "alice")
+        ).one()
+        participant.deleted = True
+        participant.deleted_at = datetime.now(timezone.utc)
+        db.add(participant)
+        db.commit()
+        assert index.peek("conv1") is None
+
+        assert asyncio.run(index.get("conv1", db)).members == {"owner", "bob"}
+
+
+def test_ttl_cache_expires_and_evicts_least_recently_used():
+    now = [0.0]
+    evicted = []
+    cache = TTLCache(maxsize=2, ttl=10, on_evict=lambda key, value: evicted.append(key), clock=lambda: now[0])
+
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert evicted == ["b"]
+
+    now[0] = 11
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 1
@@ -0,0 +1,187 @@
+import asyncio
+import json
+
+from app.core.connection_manager import ConnectionManager
+from app.core.message_bus import InProcessMessageBus, RedisMessageBus
+
+
+class FakePubSub:
+    """Minimal stand-in for redis.asyncio.client.PubSub"""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.queue = asyncio.Queue()
+
+    async def subscribe(self, channel):
+        self.broker.subscribers.setdefault(channel, []).append(self)
+
+    async def unsubscribe(self, channel):
+        self.broker.subscribers[channel].remove(self)
+
+    async def aclose(self):
+        pass
+
+    async def listen(self):
+        while True:
+            item = await self.queue.get()
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+class FakeRedis:
+    """Shared broker playing the role of one Redis server for several workers"""
+
+    def __init__(self):
+        self.subscribers = {}
+
+    def pubsub(self):
+        return FakePubSub(self)
+
+    async def publish(self, channel, data):
+        for pubsub in self.subscribers.get(channel, []):
+            pubsub.queue.put_nowait({"type": "message", "channel": channel, "data": data})
+        return len(self.subscribers.get(channel, []))
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+
+def test_in_process_bus_delivers_to_local_sockets():
+    async def scenario():
+        manager = ConnectionManager(bus=InProcessMessageBus())
+        alice, bob = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(alice, "alice")
+        await manager.connect(bob, "bob")
+
+        await manager.fanout({"content": "hi"}, ["bob", "carol"])
+        # Fanout only enqueues; let the writer tasks flush
+        await asyncio.sleep(0.01)
+
+        assert alice.sent == []
+        assert bob.sent == [{"content": "hi"}]
+        await manager.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_redis_bus_delivers_across_workers():
+    async def scenario():
+        broker = FakeRedis()
+        worker_a = ConnectionManager(bus=RedisMessageBus(client=broker))
+        worker_b = ConnectionManager(bus=RedisMessageBus(client=broker))
+        alice, bob = FakeWebSocket(), FakeWebSocket()
+        await worker_a.connect(alice, "alice")
+        await worker_b.connect(bob, "bob")
+
+        # Alice's worker publishes; only Bob's worker holds a matching socket
+        await worker_a.fanout({"content": "hello"}, ["alice", "bob"])
+        await asyncio.sleep(0.01)
+
+        assert alice.sent == [{"content": "hello"}]
+        assert bob.sent == [{"content": "hello"}]
+
+        await worker_a.shutdown()
+        await worker_b.shutdown()
+        assert broker.subscribers[worker_a.bus.channel] == []
+
+    asyncio.run(scenario())
+
+
+def test_redis_bus_resubscribes_after_the_connection_drops():
+    async def scenario():
+        broker = FakeRedis()
+        worker = ConnectionManager(bus=RedisMessageBus(client=broker, retry_delay=0.001))
+        bob = FakeWebSocket()
+        await worker.connect(bob, "bob")
+        pubsub = broker.subscribers[worker.bus.channel][0]
+        pubsub.queue.put_nowait(ConnectionError("connection lost"))
+        await asyncio.sleep(0.01)
+
+        await worker.fanout({"content": "still here"}, ["bob"])
+        await asyncio.sleep(0.01)
+
+        assert worker.bus.reconnects == 1
+        assert bob.sent == [{"content": "still here"}]
+        await worker.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_first_connects_share_one_subscription():
+    class SlowSubscribe(FakeRedis):
+        def pubsub(self):
+            pubsub = super().pubsub()
+            subscribe = pubsub.subscribe
+
+            async def slow(channel):
+                await asyncio.sleep(0.01)
+                await subscribe(channel)
+
+            pubsub.subscribe = slow
+            return pubsub
+
+    async def scenario():
+        broker = SlowSubscribe()
+        worker = ConnectionManager(bus=RedisMessageBus(client=broker))
+        await asyncio.gather(*(worker.connect(FakeWebSocket(), f"user{index}") for index in range(5)))
+        subscriptions = len(broker.subscribers[worker.bus.channel])
+        await worker.shutdown()
+        return subscriptions, broker.subscribers[worker.bus.channel]
+
+    subscriptions, remaining = asyncio.run(scenario())
+
+    assert subscriptions == 1
+    assert remaining == []
+
+
+def test_redis_bus_is_not_started_until_subscribed():
+    class Unreachable(FakeRedis):
+        def pubsub(self):
+            pubsub = super().pubsub()
+
+            async def subscribe(channel):
+                raise ConnectionError("redis down")
+
+            pubsub.subscribe = subscribe
+            return pubsub
+
+    async def scenario():
+        bus = RedisMessageBus(client=Unreachable())
+        try:
+            await bus.start(lambda envelope: None)
+        except ConnectionError:
+            pass
+        return bus.started
+
+    assert asyncio.run(scenario()) is False
+
+
+def test_broadcast_is_encoded_once_for_all_recipients(monkeypatch):
+    from app.core import frames
+
+    encoded = []
+    original = frames.encode_json
+    monkeypatch.setattr(frames, "encode_json", lambda payload: encoded.append(payload) or original(payload))
+
+    async def scenario():
+        manager = ConnectionManager(bus=InProcessMessageBus())
+        sockets = {user_id: FakeWebSocket() for user_id in ("a", "b", "c")}
+        for user_id, websocket in sockets.items():
+            await manager.connect(websocket, user_id)
+
+        await manager.fanout({"content": "hi"}, list(sockets))
+        await asyncio.sleep(0.01)
+        return sockets
+
+    sockets = asyncio.run(scenario())
+    assert len(encoded) == 1
+    assert all(websocket.sent == [{"content": "hi"}] for websocket in sockets.values())
@@ -0,0 +1,109 @@
+import asyncio
+from sqlmodel import Session, create_engine, select
+
+from app import database
+from app.core.message_writer import DuplicateMessage, MessageWriter
+from app.models.conversation import Conversation
+from app.models.message import Message, build_message
+from app.models.user import User
+
+
+def test_concurrent_saves_share_one_commit(engine):
+    writer = MessageWriter(max_batch=100, max_delay=0.02)
+
+    async def scenario():
+        messages = [build_message("conv1", f"user{index}", f"hello {index}") for index in range(25)]
+        saved = await asyncio.gather(*(writer.save(message) for message in messages))
+        await writer.stop()
+        return messages, saved
+
+    messages, saved = asyncio.run(scenario())
+
+    assert saved == messages
+    assert writer.stats.batches == 1
+    assert writer.stats.largest_batch == 25
+    with Session(engine) as db:
+        stored = {message.id for message in db.exec(select(Message)).all()}
+    assert stored == {message.id for message in messages}
+
+
+def test_bad_row_fails_alone(engine):
+    writer = MessageWriter(max_delay=0.02)
+    good = build_message("conv1", "user1", "fine")
+    bad = build_message("conv1", "user1", "dup")
+    duplicate = Message(**bad.model_dump())
+
+    async def scenario():
+        results = await asyncio.gather(
+            writer.save(good), writer.save(bad), writer.save(duplicate), return_exceptions=True
+        )
+        await writer.stop()
+        return results
+
+    results = asyncio.run(scenario())
+
+    assert results[0] is good
+    assert results[1] is bad
+    assert isinstance(results[2], Exception)
+    assert writer.stats.failed_batches == 1
+
+
+def test_save_many_is_not_split_across_batches(engine):
+    writer = MessageWriter(max_batch=4, max_delay=0.02)
+
+    async def scenario():
+        messages = [build_message("conv1", "user1", f"burst {index}") for index in range(10)]
+        results = await writer.save_many(messages)
+        await writer.stop()
+        return results
+
+    assert asyncio.run(scenario()) == [None] * 10
+    assert writer.stats.batches == 1
+    assert writer.stats.largest_batch == 10
+
+
+def test_replayed_client_message_id_returns_the_stored_row(engine):
+    writer = MessageWriter(max_delay=0.02)
+    original = build_message("conv1", "user1", "hi", client_message_id="m-1")
+    # Another sender may reuse the same client id
+    other = build_message("conv1", "user2", "hi", client_message_id="m-1")
+
+    async def scenario():
+        await writer.save(original)
+        results = await writer.save_many([
+            build_message("conv1", "user1", "hi again", client_message_id="m-1"),
+            build_message("conv1", "user1", "fresh", client_message_id="m-2"),
+            other,
+        ])
+        await writer.stop()
+        return results
+
+    duplicate, fresh, other_result = asyncio.run(scenario())
+
+    assert isinstance(duplicate, DuplicateMessage) and duplicate.message.id == original.id
+    assert fresh is None and other_result is None
+    assert writer.stats.duplicates == 1
+    with Session(engine) as db:
+        assert len(db.exec(select(Message)).all()) == 3
+
+
+def test_database_outage_answers_every_sender_and_keeps_the_writer(monkeypatch):
+    # Nothing listens there: every checkout fails, including the duplicate lookup
+    monkeypatch.setattr(database, "engine", create_engine("sqlite:////nonexistent/dir/rumr.db"))
+    writer = MessageWriter(max_delay=0.01)
+
+    async def scenario():
+        first = await asyncio.wait_for(writer.save_many([
+            build_message("conv1", "user1", "one", client_message_id="m-1"),
+            build_message("conv1", "user2", "two"),
+        ]), 5)
+        # The writer task survived and serves the next batch
+        second = await asyncio.wait_for(writer.save_many([build_message("conv1", "user1", "three")]), 5)
+        alive = not writer._task.done()
+        await writer.stop()
+        return first, second, alive
+
+    first, second, alive = asyncio.run(scenario())
+
+    assert all(isinstance(error, Exception) for error in first + second)
+    assert alive
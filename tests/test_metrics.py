@@ -0,0 +1,56 @@
+import asyncio
+
+from sqlalchemy import text
+from sqlmodel import create_engine
+
+from app.core.metrics import FrameTimer, Histogram, Metrics, metrics
+from app.database import run_db
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("rumr_test_seconds", "test", buckets=(0.1, 1.0), labelnames=("stage",))
+    histogram.observe(0.05, ("save",))
+    histogram.observe(0.5, ("save",))
+    histogram.observe(5.0, ("save",))
+
+    lines = histogram.render()
+
+    assert 'rumr_test_seconds_bucket{stage="save",le="0.1"} 1' in lines
+    assert 'rumr_test_seconds_bucket{stage="save",le="1.0"} 2' in lines
+    assert 'rumr_test_seconds_bucket{stage="save",le="+Inf"} 3' in lines
+    assert 'rumr_test_seconds_count{stage="save"} 3' in lines
+
+
+def test_snapshot_exposes_numeric_fields_only():
+    registry = Metrics()
+    registry.add_snapshot("pool", lambda: {"checkedout": 2, "pool": "QueuePool", "pre_ping": True})
+
+    rendered = registry.render()
+
+    assert "rumr_pool_checkedout 2" in rendered
+    assert "rumr_pool_pool" not in rendered
+    assert "rumr_pool_pre_ping" not in rendered
+
+
+def test_frame_timer_counts_queries_run_on_the_db_pool():
+    engine = create_engine("sqlite://")
+
+    def query():
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+            connection.execute(text("SELECT 2"))
+
+    async def frame():
+        timer = FrameTimer()
+        await run_db(query)
+        timer.mark("authorize")
+        timer.finish()
+        return timer
+
+    before = metrics.stage_seconds._series.get(("authorize",), [[0], 0.0])[0][:]
+    timer = asyncio.run(frame())
+    # Statements outside a frame are not attributed to it
+    asyncio.run(run_db(query))
+
+    assert timer.queries == [2]
+    assert sum(metrics.stage_seconds._series[("authorize",)][0]) == sum(before) + 1
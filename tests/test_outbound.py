@@ -0,0 +1,216 @@
+import asyncio
+import json
+
+from app.core.frames import OutboundFrame
+from app.core.outbound import DISCONNECT, DROP_OLDEST, SPILL, Connection, OutboundStats, SpillStore
+
+
+class SlowWebSocket:
+    """Socket whose sends block until released, like a client on a bad link"""
+
+    def __init__(self, blocked: bool = True):
+        self.sent = []
+        self.closed_with = None
+        self.release = asyncio.Event()
+        if not blocked:
+            self.release.set()
+
+    async def send_text(self, text):
+        await self.release.wait()
+        self.sent.append(text)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+class MemorySpillStore(SpillStore):
+    def __init__(self, broken: bool = False):
+        self.missed = {}
+        self.broken = broken
+
+    async def spill(self, user_id, missed):
+        if self.broken:
+            raise ConnectionError("redis unavailable")
+        for conversation_id, seq in missed:
+            self.missed.setdefault(user_id, {}).setdefault(conversation_id, seq)
+
+    async def drain(self, user_id):
+        return {conversation_id: seq - 1 for conversation_id, seq in self.missed.pop(user_id, {}).items()}
+
+
+def test_slow_consumer_does_not_delay_others():
+    async def scenario():
+        stats = OutboundStats()
+        slow = Connection(SlowWebSocket(), "slow", stats, maxsize=4)
+        fast = Connection(SlowWebSocket(blocked=False), "fast", stats, maxsize=4)
+        slow.start()
+        fast.start()
+
+        for index in range(3):
+            slow.send(f"m{index}")
+            fast.send(f"m{index}")
+        await asyncio.sleep(0.01)
+
+        assert fast.websocket.sent == ["m0", "m1", "m2"]
+        assert slow.websocket.sent == []
+        slow.close()
+        fast.close()
+
+    asyncio.run(scenario())
+
+
+def test_drop_oldest_keeps_newest_frames():
+    async def scenario():
+        stats = OutboundStats()
+        connection = Connection(SlowWebSocket(), "user", stats, maxsize=2, policy=DROP_OLDEST)
+        for index in range(4):
+            assert connection.send(f"m{index}")
+
+        assert list(connection.queue._queue) == ["m2", "m3"]
+        assert stats.dropped == 2
+
+    asyncio.run(scenario())
+
+
+def test_disconnect_policy_evicts_and_closes():
+    async def scenario():
+        evicted = []
+        stats = OutboundStats()
+        websocket = SlowWebSocket()
+        connection = Connection(websocket, "user", stats, maxsize=1, policy=DISCONNECT, on_evict=evicted.append)
+        connection.send("m0")
+        assert connection.send("m1") is False
+        await asyncio.sleep(0)
+
+        assert evicted == [connection]
+        assert connection.closed
+        assert websocket.closed_with == 1013
+        assert stats.slow_disconnects == 1
+
+    asyncio.run(scenario())
+
+
+def test_spill_policy_records_missed_positions():
+    async def scenario():
+        store = MemorySpillStore()
+        stats = OutboundStats()
+        connection = Connection(SlowWebSocket(), "user", stats, maxsize=1, policy=SPILL, spill_store=store)
+        connection.send("m0")
+        for seq in (7, 8):
+            connection.send_broadcast(OutboundFrame({"conversation_id": "conv1", "seq": seq, "content": "hi"}))
+        # Not a broadcast: nothing to replay it from
+        connection.send("ack")
+        await asyncio.sleep(0)
+
+        assert await store.drain("user") == {"conv1": 6}
+        assert (stats.spilled, stats.dropped) == (2, 1)
+        assert not connection.closed
+
+    asyncio.run(scenario())
+
+
+def test_failed_spill_is_counted_not_raised():
+    async def scenario():
+        stats = OutboundStats()
+        connection = Connection(
+            SlowWebSocket(), "user", stats, maxsize=1, policy=SPILL, spill_store=MemorySpillStore(broken=True)
+        )
+        connection.send("m0")
+        connection.send_broadcast(OutboundFrame({"conversation_id": "conv1", "seq": 1}))
+        await asyncio.sleep(0)
+
+        assert (stats.spilled, stats.spill_errors, stats.dropped) == (0, 1, 1)
+
+    asyncio.run(scenario())
+
+
+def test_interning_connection_gets_each_profile_once():
+    async def scenario():
+        connection = Connection(SlowWebSocket(blocked=False), "user2", OutboundStats(), intern_profiles=True)
+        legacy = Connection(SlowWebSocket(blocked=False), "user3", OutboundStats())
+        connection.start()
+        legacy.start()
+
+        payload = {"id": "m1", "sender_id": "user1", "content": "hi", "FirstName": "Ada"}
+        for frame in (OutboundFrame(payload), OutboundFrame(dict(payload, id="m2"))):
+            connection.send_broadcast(frame)
+            legacy.send_broadcast(frame)
+        # A changed profile is sent again before the next message
+        connection.send_broadcast(OutboundFrame(dict(payload, id="m3", FirstName="Grace")))
+        await asyncio.sleep(0.01)
+
+        sent = [json.loads(text) for text in connection.websocket.sent]
+        assert [frame.get("status") for frame in sent] == ["profile", None, None, "profile", None]
+        assert sent[0]["user_id"] == "user1" and sent[0]["FirstName"] == "Ada"
+        assert "FirstName" not in sent[1] and sent[1]["sender_id"] == "user1"
+        assert sent[3]["FirstName"] == "Grace"
+        assert [json.loads(text)["FirstName"] for text in legacy.websocket.sent] == ["Ada", "Ada"]
+        connection.close()
+        legacy.close()
+
+    asyncio.run(scenario())
+
+
+def test_coalescing_connection_batches_broadcasts_within_window():
+    async def scenario():
+        connection = Connection(SlowWebSocket(blocked=False), "user2", OutboundStats(), coalesce_window=0.005)
+        connection.start()
+
+        for index in range(3):
+            connection.send_broadcast(OutboundFrame({"id": f"m{index}", "sender_id": "user1"}))
+        await asyncio.sleep(0.02)
+        connection.send_broadcast(OutboundFrame({"id": "m3", "sender_id": "user1"}))
+        # A direct frame flushes held broadcasts first, keeping order
+        connection.send_json({"status": "ack", "id": "m4"})
+        await asyncio.sleep(0.01)
+
+        sent = [json.loads(text) for text in connection.websocket.sent]
+        assert sent == [
+            {"messages": [{"id": "m0", "sender_id": "user1"}, {"id": "m1", "sender_id": "user1"},
+                          {"id": "m2", "sender_id": "user1"}]},
+            {"id": "m3", "sender_id": "user1"},
+            {"status": "ack", "id": "m4"},
+        ]
+        assert connection.stats.coalesced == 2
+        connection.close()
+
+    asyncio.run(scenario())
+
+
+def test_resume_longer_than_the_queue_is_paced_not_dropped():
+    from app.core.connection_manager import ConnectionManager
+    from app.core.membership import ConversationMembers
+    from app.core.message_bus import InProcessMessageBus
+
+    class TrickleWebSocket:
+        def __init__(self):
+            self.sent = []
+
+        async def accept(self):
+            pass
+
+        async def send_text(self, text):
+            await asyncio.sleep(0)
+            self.sent.append(json.loads(text))
+
+    async def scenario():
+        manager = ConnectionManager(bus=InProcessMessageBus())
+        for seq in range(1, 61):
+            manager.recent.add("conv1", seq, OutboundFrame({"conversation_id": "conv1", "seq": seq}))
+
+        async def members(conversation_id, db=None):
+            return ConversationMembers("conv1", "user1", ["user1", "user2"])
+
+        manager.membership.get = members
+        websocket = TrickleWebSocket()
+        connection = Connection(websocket, "user2", manager.outbound_stats, maxsize=8)
+        connection.start()
+        await manager.resume(connection, {"conv1": 0})
+        await asyncio.sleep(0.05)
+        connection.close()
+        return [frame["seq"] for frame in websocket.sent], manager.outbound_stats.dropped
+
+    seqs, dropped = asyncio.run(scenario())
+
+    assert seqs == list(range(1, 61))
+    assert dropped == 0
@@ -0,0 +1,136 @@
+import asyncio
+
+import pytest
+from sqlmodel import Session
+
+from app import database
+from app.core.connection_manager import ConnectionManager
+from app.core.membership import ConversationMembers
+from app.core.message_bus import InProcessMessageBus
+from app.core.presence import PresenceRegistry
+from app.models.user import User
+
+
+@pytest.fixture(name="engine")
+def engine_fixture(engine):
+    with Session(engine) as session:
+        session.add_all([User(UserID=f"user{index}", Username=f"user{index}") for index in range(1, 4)])
+        session.commit()
+    return engine
+
+
+def presence_of(engine, user_id):
+    with Session(engine) as session:
+        user = session.get(User, user_id)
+        return user.is_user_online, user.last_seen
+
+
+def test_reconnect_within_window_writes_nothing(engine):
+    registry = PresenceRegistry()
+
+    async def scenario():
+        for _ in range(50):
+            registry.connected("user1")
+            registry.disconnected("user1")
+        registry.connected("user1")
+        registry.disconnected("user1")
+        registry.connected("user1")
+        await registry.flush()
+
+    asyncio.run(scenario())
+
+    # One write for the net change, however many times the socket flapped
+    assert registry.stats.flushes == 1 and registry.stats.rows_written == 1
+    assert presence_of(engine, "user1")[0] == 1
+
+    async def flap():
+        registry.disconnected("user1")
+        registry.connected("user1")
+        await registry.flush()
+
+    statements = database.query_counter.count
+    asyncio.run(flap())
+    assert database.query_counter.count == statements
+    assert registry.stats.writes_skipped == 1
+
+
+def test_changes_are_flushed_in_one_batch(engine):
+    registry = PresenceRegistry()
+
+    async def scenario():
+        for user_id in ("user1", "user2", "user3"):
+            registry.connected(user_id)
+        await registry.flush()
+        registry.disconnected("user2")
+        await registry.stop()
+
+    asyncio.run(scenario())
+
+    assert registry.stats.flushes == 2
+    assert registry.stats.rows_written == 6
+    assert presence_of(engine, "user2")[0] == 0
+    # stop() marks users still connected offline
+    online, last_seen = presence_of(engine, "user3")
+    assert online == 0 and last_seen is not None
+
+
+class FakeConnection:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.frames = []
+
+    def send_broadcast(self, frame):
+        self.frames.append(frame.payload)
+
+
+def test_failed_flush_is_retried(engine, monkeypatch):
+    registry = PresenceRegistry()
+    write = registry._write
+
+    def broken(changes):
+        raise RuntimeError("database unavailable")
+
+    async def scenario():
+        registry.connected("user1")
+        registry.connected("user2")
+        monkeypatch.setattr(registry, "_write", broken)
+        with pytest.raises(RuntimeError):
+            await registry.flush()
+        # Newer than the lost change, so it replaces it
+        registry.disconnected("user2")
+        monkeypatch.setattr(registry, "_write", write)
+        await registry.flush()
+
+    asyncio.run(scenario())
+
+    assert presence_of(engine, "user1")[0] == 1
+    assert presence_of(engine, "user2")[0] != 1
+    assert registry.stats.rows_written == 1
+
+
+def test_peers_get_one_debounced_push():
+    manager = ConnectionManager(bus=InProcessMessageBus())
+    for user_id in ("user1", "user2"):
+        manager.active_connections.add(FakeConnection(user_id))
+    manager.membership.add(ConversationMembers("conv1", "user1", ["user1", "user2", "user3"]))
+    for user_id in ("user1", "user2"):
+        manager.membership.user_online(user_id)
+
+    async def scenario():
+        await manager.bus.start(manager.deliver_local)
+        manager.presence.connected("user3")
+        manager.presence.disconnected("user3")
+        manager.presence.connected("user3")
+        manager.presence._push = manager.publish_presence
+        await manager.presence.push_pending()
+        manager.presence.connected("user4")
+        manager.presence.disconnected("user4")
+        await manager.presence.push_pending()
+
+    asyncio.run(scenario())
+
+    presence = {"status": "presence", "user_id": "user3", "online": True}
+    assert manager.active_connections.get("user1")[0].frames == [presence]
+    assert manager.active_connections.get("user2")[0].frames == [presence]
+    assert manager.presence.stats.pushes == 1
+    assert manager.presence.stats.pushes_skipped == 1
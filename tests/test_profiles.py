@@ -0,0 +1,52 @@
+import asyncio
+import pytest
+from sqlalchemy import event
+from sqlmodel import Session
+
+from app.core.profiles import PROFILE_FIELDS, ProfileCache
+from app.models.user import User
+
+
+@pytest.fixture(name="engine")
+def engine_fixture(engine):
+    with Session(engine) as session:
+        session.add(User(UserID="alice", FirstName="Alice", Password="secret", Bio="hi"))
+        session.commit()
+    return engine
+
+
+def test_profile_is_projected_and_cached(engine):
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    profiles = ProfileCache()
+
+    with Session(engine) as db:
+        first = asyncio.run(profiles.get("alice", db))
+        second = asyncio.run(profiles.get("alice", db))
+
+    assert first is second
+    assert set(first) == set(PROFILE_FIELDS)
+    assert first["FirstName"] == "Alice"
+    assert len(statements) == 1
+    assert "Password" not in statements[0]
+    assert profiles.stats()["hits"] == 1
+    assert profiles.stats()["misses"] == 1
+
+
+def test_profile_update_invalidates(engine):
+    profiles = ProfileCache()
+    with Session(engine) as db:
+        assert asyncio.run(profiles.get("alice", db))["Bio"] == "hi"
+
+        user = db.get(User, "alice")
+        user.Bio = "updated"
+        db.add(user)
+        db.commit()
+
+        assert asyncio.run(profiles.get("alice", db))["Bio"] == "updated"
+
+
+def test_unknown_user_has_empty_profile(engine):
+    with Session(engine) as db:
+        profile = asyncio.run(ProfileCache().get("nobody", db))
+    assert profile == dict.fromkeys(PROFILE_FIELDS)
@@ -0,0 +1,60 @@
+import asyncio
+
+from app.core.ratelimit import FloodControl, Limit
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_sender_bucket_allows_burst_then_refills():
+    clock = FakeClock()
+    flood = FloodControl(user=Limit(2, 3), conversation=Limit(0, 0), clock=clock)
+
+    assert [flood.check("user1", "conv1") for _ in range(3)] == [None, None, None]
+    assert flood.check("user1", "conv1") == 0.5
+    # Other senders have their own bucket
+    assert flood.check("user2", "conv1") is None
+    clock.now += 0.5
+    assert flood.check("user1", "conv1") is None
+    assert flood.check("user1", "conv1") is not None
+    assert flood.stats.snapshot()["throttled_user"] == 2
+
+
+def test_conversation_bucket_is_shared_and_refusals_take_nothing():
+    clock = FakeClock()
+    flood = FloodControl(user=Limit(1, 2), conversation=Limit(1, 3), clock=clock)
+
+    assert flood.check("user1", "conv1") is None
+    assert flood.check("user2", "conv1") is None
+    assert flood.check("user3", "conv1") is None
+    assert flood.check("user1", "conv1") == 1.0
+    assert flood.stats.throttled_conversation == 1
+    # The refused message did not use user1's last token
+    assert flood.check("user1", "conv2") is None
+    assert flood.check("user1", "conv2") is not None
+
+
+class FakeShared:
+    def __init__(self, refused):
+        self.refused = refused
+        self.calls = []
+
+    async def take(self, buckets, cost):
+        self.calls.append([key for key, _ in buckets])
+        return self.refused
+
+
+def test_shared_limits_apply_after_the_local_buckets():
+    shared = FakeShared(refused=2)
+    flood = FloodControl(user=Limit(1, 1), conversation=Limit(4, 10), shared=shared, clock=FakeClock())
+
+    assert asyncio.run(flood.allow("user1", "conv1")) == 0.25
+    # Locally refused: no round trip
+    assert asyncio.run(flood.allow("user1", "conv1")) == 1.0
+    assert shared.calls == [["user:user1", "conversation:conv1"]]
+    assert flood.stats.throttled_shared == 1 and flood.stats.throttled_user == 1
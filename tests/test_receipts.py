@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+from sqlmodel import Session, select
+
+from app import database
+from app.core.connection_manager import ConnectionManager
+from app.core.frames import OutboundFrame
+from app.core.membership import ConversationMembers
+from app.core.message_bus import InProcessMessageBus
+from app.core.receipts import DELIVERED, READ, ReceiptBuffer
+from app.models.conversation import Conversation
+from app.models.conversation_participant import ConversationParticipant
+
+MEMBERS = [f"user{index}" for index in range(200)]
+
+
+@pytest.fixture(name="engine")
+def engine_fixture(engine):
+    with Session(engine) as session:
+        session.add(Conversation(id="group", user_id="user0", conversation_type="group", last_seq=3))
+        session.add_all([ConversationParticipant(conversation_id="group", user_id=user_id) for user_id in MEMBERS])
+        session.commit()
+    return engine
+
+
+def marks(engine):
+    with Session(engine) as session:
+        return {
+            participant.user_id: (participant.last_delivered_seq, participant.last_read_seq)
+            for participant in session.exec(select(ConversationParticipant))
+        }
+
+
+def test_group_receipts_are_written_in_one_statement(engine):
+    receipts = ReceiptBuffer()
+    for seq in (1, 2, 3):
+        for user_id in MEMBERS:
+            receipts.record("group", user_id, DELIVERED, seq)
+    receipts.record("group", "user1", READ, 2)
+    # Late and out-of-range receipts neither lower nor overshoot a mark
+    receipts.record("group", "user1", DELIVERED, 1)
+    receipts.record("group", "user2", READ, 99)
+
+    statements = database.query_counter.count
+    asyncio.run(receipts.flush())
+
+    assert database.query_counter.count - statements == 1
+    assert receipts.stats.received == 603
+    assert receipts.stats.rows_written == 200
+    stored = marks(engine)
+    assert stored["user1"] == (3, 2)
+    assert stored["user2"] == (3, 3)
+    assert stored["user199"] == (3, 0)
+
+    receipts.record("group", "user1", READ, 1)
+    asyncio.run(receipts.flush())
+    assert marks(engine)["user1"] == (3, 2)
+
+
+def test_receipts_for_a_conversation_without_last_seq_stay_at_zero(engine):
+    with Session(engine) as session:
+        session.add(Conversation(id="empty", user_id="user0", conversation_type="group", last_seq=None))
+        session.add(ConversationParticipant(conversation_id="empty", user_id="user0"))
+        session.commit()
+    receipts = ReceiptBuffer()
+    receipts.record("empty", "user0", READ, 50)
+    asyncio.run(receipts.flush())
+
+    with Session(engine) as session:
+        participant = session.exec(
+            select(ConversationParticipant).where(ConversationParticipant.conversation_id == "empty")
+        ).one()
+    assert (participant.last_delivered_seq, participant.last_read_seq) == (0, 0)
+
+
+def test_pending_reads_are_visible_before_the_flush():
+    receipts = ReceiptBuffer()
+    receipts.record("group", "user1", READ, 2)
+    receipts.record("group", "user1", DELIVERED, 5)
+
+    assert receipts.pending_read("user1") == {"group": 2}
+    assert receipts.pending_read("user2") == {}
+
+
+class FakeConnection:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.frames = []
+
+    def send_broadcast(self, frame):
+        self.frames.append(frame.payload)
+
+
+def test_receipts_reach_senders_in_one_frame():
+    manager = ConnectionManager(bus=InProcessMessageBus())
+    for user_id in ("user0", "user1", "user2"):
+        manager.active_connections.add(FakeConnection(user_id))
+    manager.membership.add(ConversationMembers("group", "user0", ["user0", "user1", "user2"]))
+    for seq in (1, 2):
+        manager.recent.add("group", seq, OutboundFrame({"sender_id": "user0", "seq": seq}))
+
+    async def scenario():
+        await manager.bus.start(manager.deliver_local)
+        manager.receipts._push = manager.publish_receipts
+        for seq in (1, 2):
+            manager.receipts.record("group", "user1", DELIVERED, seq)
+            manager.receipts.record("group", "user2", DELIVERED, seq)
+        manager.receipts.record("group", "user1", READ, 2)
+        await manager.receipts.push_pending()
+
+    asyncio.run(scenario())
+
+    assert manager.active_connections.get("user0")[0].frames == [{
+        "status": "receipts",
+        "conversation_id": "group",
+        "receipts": [
+            {"user_id": "user1", "delivered": 2, "read": 2},
+            {"user_id": "user2", "delivered": 2},
+        ],
+    }]
+    assert manager.active_connections.get("user1")[0].frames == []
+    assert manager.receipts.stats.pushes == 1
@@ -0,0 +1,30 @@
+from app.core.frames import OutboundFrame
+from app.core.recent import RecentMessages
+
+
+def frame(seq):
+    return OutboundFrame({"id": f"m{seq}", "seq": seq})
+
+
+def test_gap_is_served_from_the_buffer():
+    recent = RecentMessages(size=3)
+    for seq in (1, 2, 4, 3, 3):
+        recent.add("conv1", seq, frame(seq))
+
+    assert [item.payload["seq"] for item in recent.since("conv1", 2)] == [3, 4]
+    assert recent.since("conv1", 4) == []
+    assert recent.stats()["replayed"] == 2
+
+
+def test_gap_older_than_buffer_or_with_holes_falls_back():
+    recent = RecentMessages(size=3)
+    for seq in (1, 2, 3, 4):
+        recent.add("conv1", seq, frame(seq))
+    recent.add("conv2", 1, frame(1))
+    recent.add("conv2", 3, frame(3))
+
+    # seq 1 was pushed out of the buffer
+    assert recent.since("conv1", 0) is None
+    assert recent.since("conv2", 0) is None
+    assert recent.since("unknown", 0) is None
+    assert recent.stats()["fallbacks"] == 3
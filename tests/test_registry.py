@@ -0,0 +1,72 @@
+import asyncio
+import json
+
+from app.core.connection_manager import ConnectionManager
+from app.core.message_bus import InProcessMessageBus
+from app.core.outbound import Connection, OutboundStats
+from app.core.registry import TOO_MANY_DEVICES_CLOSE_CODE, ConnectionRegistry
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.close_code = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+def test_registry_tracks_several_sockets_per_user():
+    registry = ConnectionRegistry(shards=4, max_per_user=2)
+    stats = OutboundStats()
+    phone, laptop, tablet = (Connection(FakeWebSocket(), "user1", stats) for _ in range(3))
+
+    assert registry.add(phone) == (True, [])
+    assert registry.add(laptop) == (False, [])
+    # Over the cap the oldest socket is pushed out
+    assert registry.add(tablet) == (False, [phone])
+    assert registry.get("user1") == (laptop, tablet)
+    assert registry.remove(phone) is None
+    assert registry.remove(laptop) is False
+    assert "user1" in registry and len(registry) == 1
+    assert registry.remove(tablet) is True
+    assert "user1" not in registry and registry.get("user1") == ()
+    assert registry.stats()["connections"] == 0
+
+
+def test_every_device_gets_broadcasts_until_the_last_disconnects():
+    async def scenario():
+        manager = ConnectionManager(bus=InProcessMessageBus())
+        manager.active_connections.max_per_user = 2
+        phone, laptop, tablet = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        first = await manager.connect(phone, "alice")
+        second = await manager.connect(laptop, "alice")
+
+        await manager.fanout({"content": "hi"}, ["alice"])
+        await asyncio.sleep(0.01)
+        assert phone.sent == laptop.sent == [{"content": "hi"}]
+
+        manager.disconnect("alice", first)
+        assert "alice" in manager.active_connections
+        assert manager.presence.is_online("alice")
+
+        await manager.connect(tablet, "alice")
+        third = manager.active_connections.get("alice")[-1]
+        await manager.connect(FakeWebSocket(), "alice")
+        await asyncio.sleep(0.01)
+        # The oldest remaining device made room for the newest
+        assert laptop.close_code == TOO_MANY_DEVICES_CLOSE_CODE
+        assert second.closed and not third.closed
+
+        manager.disconnect("alice")
+        assert "alice" not in manager.active_connections
+        assert not manager.presence.is_online("alice")
+        await manager.bus.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,389 @@
+import asyncio
+
+import msgpack
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+
+from app.app import app
+from app.core.frames import DEFLATED, MSGPACK_DEFLATE
+from app.models.blocked_user import BlockedUser
+from app.models.conversation import Conversation
+from app.models.conversation_participant import ConversationParticipant
+from app.models.message import Message
+from app.models.user import User
+from app.routers.websocket import manager
+
+
+@pytest.fixture(name="session")
+def session_fixture(engine):
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture(name="client")
+def client_fixture(engine):
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture(name="test_data")
+def test_data_fixture(session):
+    session.add_all([
+        User(UserID="user1", Username="user1", FirstName="Ada"),
+        User(UserID="user2", Username="user2"),
+        User(UserID="user3", Username="user3"),
+        User(UserID="user4", Username="user4"),
+        Conversation(id="conv1", name="Test Conversation", user_id="user1", conversation_type="group"),
+        ConversationParticipant(conversation_id="conv1", user_id="user1"),
+        ConversationParticipant(conversation_id="conv1", user_id="user2"),
+        ConversationParticipant(conversation_id="conv1", user_id="user3"),
+        # user1 (the owner) blocks user3
+        BlockedUser(blocker_id="user1", blocked_id="user3"),
+    ])
+    session.commit()
+
+
+@pytest.fixture(autouse=True)
+def reset_manager():
+    manager.active_connections.clear()
+    manager.membership.clear()
+    manager.blocks.clear()
+    manager.profiles.clear()
+    manager.recent.clear()
+    manager.flood.clear()
+    manager.dedup.clear()
+    yield
+
+
+def test_message_is_saved_and_broadcast(client, session, test_data):
+    with client.websocket_connect("/ws/user2") as receiver:
+        with client.websocket_connect("/ws/user1") as sender:
+            sender.send_json({"conversation_id": "conv1", "content": "Hello", "type": "text"})
+            ack = sender.receive_json()
+            delivered = receiver.receive_json()
+
+    assert ack["status"] == "ack"
+    assert ack["id"] == delivered["id"]
+    assert delivered["content"] == "Hello"
+    assert delivered["sender_id"] == "user1"
+    assert delivered["FirstName"] == "Ada"
+    assert len(session.exec(select(Message)).all()) == 1
+
+
+def test_non_participant_is_rejected(client, session, test_data):
+    with client.websocket_connect("/ws/user4") as websocket:
+        websocket.send_json({"conversation_id": "conv1", "content": "nope"})
+        reply = websocket.receive_json()
+
+    assert reply == {"status": "error", "message": "Not a participant in this conversation"}
+    assert session.exec(select(Message)).all() == []
+
+
+def test_blocked_sender_is_rejected(client, session, test_data):
+    with client.websocket_connect("/ws/user3") as websocket:
+        websocket.send_json({"conversation_id": "conv1", "content": "hi"})
+        reply = websocket.receive_json()
+
+    assert reply["status"] == "error"
+    assert "blocked" in reply["message"]
+
+
+def test_metrics_endpoint_reports_frame_stages(client, test_data):
+    with client.websocket_connect("/ws/user1") as sender:
+        sender.send_json({"conversation_id": "conv1", "content": "Hello", "type": "text"})
+        sender.receive_json()
+        body = client.get("/metrics").text
+
+    assert 'rumr_frame_stage_seconds_count{stage="save"}' in body
+    assert "rumr_frame_db_queries_count" in body
+    assert "rumr_active_connections 1" in body
+
+
+def test_profiles_feature_sends_profile_once(client, test_data):
+    with client.websocket_connect("/ws/user2?features=profiles") as receiver:
+        with client.websocket_connect("/ws/user1") as sender:
+            for content in ("one", "two"):
+                sender.send_json({"conversation_id": "conv1", "content": content, "type": "text"})
+                sender.receive_json()
+            profile = receiver.receive_json()
+            first = receiver.receive_json()
+            second = receiver.receive_json()
+
+    assert profile["status"] == "profile"
+    assert profile["user_id"] == "user1" and profile["FirstName"] == "Ada"
+    assert first["content"] == "one" and first["sender_id"] == "user1"
+    assert "FirstName" not in first
+    assert second["content"] == "two"
+
+
+def test_msgpack_subprotocol_round_trip(client, session, test_data):
+    with client.websocket_connect("/ws/user2", subprotocols=["rumr.msgpack.deflate"]) as receiver:
+        with client.websocket_connect("/ws/user1", subprotocols=["rumr.msgpack"]) as sender:
+            assert sender.accepted_subprotocol == "rumr.msgpack"
+            # Long enough for the broadcast to be deflated
+            sender.send_bytes(msgpack.packb({"c": "conv1", "b": "Hello " * 100, "t": "text"}))
+            ack = msgpack.unpackb(sender.receive_bytes())
+            delivered = receiver.receive_bytes()
+
+    assert ack["st"] == "ack"
+    assert delivered[:1] == DEFLATED
+    delivered = MSGPACK_DEFLATE.decode(delivered)
+    assert delivered["id"] == ack["i"]
+    assert delivered["content"] == "Hello " * 100 and delivered["FirstName"] == "Ada"
+    assert session.exec(select(Message)).one().content == "Hello " * 100
+
+
+def test_msgpack_event_is_understood(client, test_data):
+    with client.websocket_connect("/ws/user2", subprotocols=["rumr.msgpack"]) as receiver:
+        with client.websocket_connect("/ws/user1", subprotocols=["rumr.msgpack"]) as sender:
+            # Warms the membership and block caches events are authorized from
+            sender.send_bytes(msgpack.packb({"c": "conv1", "b": "Hello", "t": "text"}))
+            msgpack.unpackb(sender.receive_bytes())
+            receiver.receive_bytes()
+            sender.send_bytes(msgpack.packb({"e": {"c": "conv1", "t": "typing"}}))
+            event = msgpack.unpackb(receiver.receive_bytes())
+
+    assert event == {"st": "event", "t": "typing", "c": "conv1", "u": "user1"}
+
+
+def test_msgpack_read_marker_clears_unread_count(client, test_data):
+    with client.websocket_connect("/ws/user2", subprotocols=["rumr.msgpack"]) as receiver:
+        with client.websocket_connect("/ws/user1") as sender:
+            sender.send_json({"conversation_id": "conv1", "content": "Hello", "type": "text"})
+            sender.receive_json()
+            seq = msgpack.unpackb(receiver.receive_bytes())["q"]
+        receiver.send_bytes(msgpack.packb({"rd": {"c": "conv1", "q": True}}))
+        invalid = msgpack.unpackb(receiver.receive_bytes())
+        receiver.send_bytes(msgpack.packb({"rd": {"c": "conv1", "q": seq}}))
+        # Answered after the marker was handled, so an error would have arrived first
+        receiver.send_bytes(msgpack.packb({"st": "ping"}))
+        reply = msgpack.unpackb(receiver.receive_bytes())
+
+    assert invalid["m"] == "Invalid read marker"
+    assert reply == {"st": "pong"}
+    assert client.get("/conversations", params={"user_id": "user2"}).json()[0]["unread_count"] == 0
+
+
+def test_batch_frame_is_saved_in_one_commit(client, session, test_data):
+    batches_before = manager.writer.stats.batches
+    with client.websocket_connect("/ws/user2?features=batch") as receiver:
+        with client.websocket_connect("/ws/user1") as sender:
+            sender.send_json({"messages": [
+                {"conversation_id": "conv1", "content": "one"},
+                {"conversation_id": "conv2", "content": "nowhere"},
+                {"conversation_id": "conv1", "content": "two"},
+            ]})
+            error = sender.receive_json()
+            ack = sender.receive_json()
+            delivered = receiver.receive_json()
+
+    assert error == {"status": "error", "message": "Not a participant in this conversation", "index": 1}
+    assert ack["status"] == "ack"
+    assert [item["index"] for item in ack["messages"]] == [0, 2]
+    assert [item["content"] for item in delivered["messages"]] == ["one", "two"]
+    assert manager.writer.stats.batches == batches_before + 1
+    assert len(session.exec(select(Message)).all()) == 2
+
+
+def test_reconnect_resumes_from_last_seen_sequence(client, test_data):
+    with client.websocket_connect("/ws/user1") as sender:
+        acks = []
+        for content in ("one", "two", "three"):
+            sender.send_json({"conversation_id": "conv1", "content": content, "type": "text"})
+            acks.append(sender.receive_json())
+            sender.receive_json()  # own broadcast
+    assert [ack["seq"] for ack in acks] == [1, 2, 3]
+
+    with client.websocket_connect("/ws/user2?resume=conv1:1") as receiver:
+        from_memory = [receiver.receive_json()["content"] for _ in range(2)]
+
+    manager.recent.clear()
+    with client.websocket_connect("/ws/user2") as receiver:
+        receiver.send_json({"resume": {"conv1": 2}})
+        from_db = receiver.receive_json()
+
+    assert from_memory == ["two", "three"]
+    assert from_db["content"] == "three" and from_db["seq"] == 3 and from_db["FirstName"] == "Ada"
+
+
+def test_read_marker_clears_unread_count(client, session, test_data):
+    with client.websocket_connect("/ws/user2") as receiver:
+        with client.websocket_connect("/ws/user1") as sender:
+            sender.send_json({"conversation_id": "conv1", "content": "Hello", "type": "text"})
+            sender.receive_json()
+            seq = receiver.receive_json()["seq"]
+        before = client.get("/conversations", params={"user_id": "user2"}).json()[0]["unread_count"]
+        receiver.send_json({"read": {"conversation_id": "conv1", "seq": seq}})
+        receiver.send_json({"read": {"conversation_id": "conv1", "seq": "x"}})
+        assert receiver.receive_json()["message"] == "Invalid read marker"
+
+    after = client.get("/conversations", params={"user_id": "user2"}).json()[0]["unread_count"]
+    assert (before, after) == (1, 0)
+
+
+def test_read_marker_past_the_last_message_is_clamped(client, test_data):
+    with client.websocket_connect("/ws/user1") as sender:
+        with client.websocket_connect("/ws/user2") as receiver:
+            sender.send_json({"conversation_id": "conv1", "content": "Hello", "type": "text"})
+            sender.receive_json()
+            sender.receive_json()  # own broadcast
+            receiver.receive_json()
+            receiver.send_json({"read": {"conversation_id": "conv1", "seq": 1000000000}})
+            pushed = sender.receive_json()
+
+    assert pushed["status"] == "receipts"
+    assert pushed["receipts"] == [{"user_id": "user2", "delivered": 1, "read": 1}]
+    # Without a buffered broadcast the cap comes from Conversation.last_seq
+    manager.recent.clear()
+    assert asyncio.run(manager.latest_seq("conv1")) == 1
+
+
+def test_flooding_sender_is_throttled_before_any_db_work(client, session, test_data, monkeypatch):
+    from app import database as db_module
+    from app.core.ratelimit import FloodControl, Limit
+
+    monkeypatch.setattr(manager, "flood", FloodControl(user=Limit(0.001, 1), conversation=Limit(0, 0)))
+    with client.websocket_connect("/ws/user1") as sender:
+        sender.send_json({"conversation_id": "conv1", "content": "one", "type": "text"})
+        assert sender.receive_json()["status"] == "ack"
+        # The sender's own copy of the broadcast
+        assert sender.receive_json()["content"] == "one"
+        statements = db_module.query_counter.count
+        sender.send_json({"conversation_id": "conv1", "content": "two", "type": "text"})
+        reply = sender.receive_json()
+
+    assert reply["message"] == "Rate limit exceeded" and reply["retry_after"] > 0
+    assert db_module.query_counter.count == statements
+    assert manager.flood.stats.throttled_user == 1
+    assert len(session.exec(select(Message)).all()) == 1
+
+
+def test_replayed_send_is_acked_again_without_a_second_row(client, session, test_data):
+    frame = {"conversation_id": "conv1", "content": "once", "type": "text", "client_message_id": "m-1"}
+    with client.websocket_connect("/ws/user2") as receiver:
+        with client.websocket_connect("/ws/user1") as sender:
+            sender.send_json(frame)
+            first = sender.receive_json()
+            sender.receive_json()  # own broadcast
+            sender.send_json(frame)
+            replay = sender.receive_json()
+            # As after a restart: only the unique index still knows the send
+            manager.dedup.clear()
+            sender.send_json(frame)
+            late_replay = sender.receive_json()
+            sender.send_json({"conversation_id": "conv1", "content": "next", "type": "text"})
+            sender.receive_json()
+            broadcasts = [receiver.receive_json()["content"] for _ in range(2)]
+
+    assert first["client_message_id"] == "m-1" and "duplicate" not in first
+    for ack in (replay, late_replay):
+        assert ack["status"] == "ack" and ack["duplicate"] is True
+        assert (ack["id"], ack["seq"]) == (first["id"], first["seq"])
+    assert broadcasts == ["once", "next"]
+    assert len(session.exec(select(Message)).all()) == 2
+
+
+def test_batch_replays_are_acked_in_place(client, session, test_data):
+    with client.websocket_connect("/ws/user1") as sender:
+        sender.send_json({"conversation_id": "conv1", "content": "one", "client_message_id": "a"})
+        first = sender.receive_json()
+        sender.receive_json()
+        sender.send_json({"messages": [
+            {"conversation_id": "conv1", "content": "one", "client_message_id": "a"},
+            {"conversation_id": "conv1", "content": "two", "client_message_id": "b"},
+            {"conversation_id": "conv1", "content": "two", "client_message_id": "b"},
+            {"conversation_id": "conv1", "content": "bad", "client_message_id": ""},
+        ]})
+        error = sender.receive_json()
+        ack = sender.receive_json()
+
+    assert error == {"status": "error", "message": "Invalid client_message_id", "index": 3}
+    items = ack["messages"]
+    assert [item["index"] for item in items] == [0, 1, 2]
+    assert items[0]["id"] == first["id"] and items[0]["duplicate"] is True
+    assert items[2]["id"] == items[1]["id"] and items[2]["duplicate"] is True and "duplicate" not in items[1]
+    assert len(session.exec(select(Message)).all()) == 2
+
+
+def test_reconnect_replays_spilled_broadcasts(client, test_data, monkeypatch):
+    from app.core.outbound import SpillStore
+
+    class MemorySpillStore(SpillStore):
+        missed = {}
+
+        async def spill(self, user_id, missed):
+            pass
+
+        async def drain(self, user_id):
+            return {conversation_id: seq - 1 for conversation_id, seq in self.missed.pop(user_id, {}).items()}
+
+    store = MemorySpillStore()
+    monkeypatch.setattr(manager, "spill_store", store)
+    with client.websocket_connect("/ws/user1") as sender:
+        for content in ("one", "two"):
+            sender.send_json({"conversation_id": "conv1", "content": content, "type": "text"})
+            sender.receive_json()
+            sender.receive_json()
+    # As if user2's previous socket had fallen behind from seq 2
+    store.missed["user2"] = {"conv1": 2}
+
+    with client.websocket_connect("/ws/user2") as receiver:
+        replayed = receiver.receive_json()
+
+    assert (replayed["content"], replayed["seq"]) == ("two", 2)
+    assert store.missed == {}
+
+
+def test_outsider_cannot_use_up_a_conversations_budget(client, session, test_data, monkeypatch):
+    from app.core.ratelimit import FloodControl, Limit
+
+    monkeypatch.setattr(manager, "flood", FloodControl(user=Limit(0, 0), conversation=Limit(0.001, 2)))
+    with client.websocket_connect("/ws/user4") as outsider:
+        for _ in range(5):
+            outsider.send_json({"conversation_id": "conv1", "content": "spam", "type": "text"})
+            assert outsider.receive_json()["message"] == "Not a participant in this conversation"
+    with client.websocket_connect("/ws/user1") as member:
+        member.send_json({"conversation_id": "conv1", "content": "hello", "type": "text"})
+        reply = member.receive_json()
+
+    assert reply["status"] == "ack"
+    assert manager.flood.stats.throttled_conversation == 0
+
+
+def test_cancelled_send_releases_its_claim(monkeypatch):
+    from app.core.metrics import FrameTimer
+    from app.routers import websocket as router
+
+    class Recorder:
+        def __init__(self):
+            self.sent = []
+
+        def send_json(self, payload):
+            self.sent.append(payload)
+
+    async def authorized(conversation_id, user_id, db=None):
+        return None
+
+    async def never_saved(messages):
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(router, "authorize_sender", authorized)
+    monkeypatch.setattr(manager.writer, "save_many", never_saved)
+
+    async def scenario():
+        item = {"conversation_id": "conv1", "content": "hi", "client_message_id": "m-1"}
+        first = asyncio.create_task(router.handle_batch(Recorder(), "user1", [item], FrameTimer()))
+        await asyncio.sleep(0)
+        replay = Recorder()
+        waiting = asyncio.create_task(router.handle_batch(replay, "user1", [item], FrameTimer()))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.wait_for(waiting, 1)
+        return replay.sent, manager.dedup.claim("user1", "m-1")
+
+    sent, claim = asyncio.run(scenario())
+
+    assert sent == [{"status": "error", "message": "Message could not be saved", "index": 0}]
+    # Released, so the next retry is a fresh send
+    assert claim is None